@@ -0,0 +1,88 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+# Write-behind lastActive tracking
+#
+# Authenticated requests only record a float timestamp per user here; the
+# store sees one batched write per flush interval instead of one write per
+# request. Until a timestamp has been flushed, readers overlay it onto the
+# stored user record with apply().
+
+
+class ActivityTracker:
+    def __init__(
+        self,
+        flush: Callable[[Dict[str, str]], Awaitable[None]],
+        interval: float = 5.0,
+        on_error: Optional[Callable[[BaseException], None]] = None,
+    ):
+        self._flush = flush
+        self.interval = interval
+        # Called with the exception when a background flush fails
+        self.on_error = on_error
+        # user_id -> unix timestamp of the latest request not yet flushed
+        self._pending: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flushed_users = 0
+
+    def touch(self, user_id: str):
+        self._pending[user_id] = time.time()
+
+    def forget(self, user_id: str):
+        self._pending.pop(user_id, None)
+
+    def last_active(self, user_id: str) -> Optional[str]:
+        timestamp = self._pending.get(user_id)
+        if timestamp is None:
+            return None
+        return datetime.fromtimestamp(timestamp).isoformat()
+
+    def apply(self, user: dict) -> dict:
+        """Return user with its freshest lastActive value"""
+        last_active = self.last_active(user["id"])
+        if last_active is None:
+            return user
+        return {**user, "lastActive": last_active}
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        batch = dict(self._pending)
+        await self._flush({
+            user_id: datetime.fromtimestamp(timestamp).isoformat()
+            for user_id, timestamp in batch.items()
+        })
+        # Keep entries touched again while the write was in flight
+        for user_id, timestamp in batch.items():
+            if self._pending.get(user_id) == timestamp:
+                del self._pending[user_id]
+        self.flushes += 1
+        self.flushed_users += len(batch)
+        return len(batch)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as exc:
+                # Entries stay pending and are retried on the next flush
+                if self.on_error is not None:
+                    self.on_error(exc)
@@ -0,0 +1,273 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Iterable, Optional
+
+# Admission control
+#
+# Two layers keep one busy client from slowing down everyone else:
+#
+# - A Budget guards an expensive kind of work (logins, bot replies). It
+#   rate limits each key (a user id, or a client address and account) with
+#   a token bucket, and caps how many requests do the work at once. A
+#   request over the cap waits up to ``queue_timeout`` seconds for a slot,
+#   behind at most ``max_queued`` others.
+# - A FailureLimit only spends tokens on failures (wrong passwords), so a
+#   client guessing at many accounts is slowed down without limiting the
+#   clients that log in successfully.
+# - AdmissionMiddleware caps the requests being handled by the whole
+#   process. A request stops counting once its response has started, so
+#   open event streams don't hold on to a slot.
+#
+# Refused requests raise AdmissionRejected (or get a response from the
+# middleware directly) and are answered with 429 and Retry-After.
+#
+# A token bucket that has been idle long enough to refill is the same as a
+# new one, so it is dropped: the limiter holds one bucket per recently
+# active key. Everything here runs on the event loop thread and keeps state
+# per process; with several workers each enforces its own limits.
+
+
+class AdmissionRejected(Exception):
+    """A request was refused; retry_after is a hint in seconds"""
+
+    def __init__(self, budget: str, reason: str, retry_after: float):
+        super().__init__(f"{budget}: {reason}")
+        self.budget = budget
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token buckets of ``burst`` tokens refilled at ``rate`` per second, one per key"""
+
+    def __init__(self, rate: float, burst: float):
+        # rate=0 turns the limiter off
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        # key -> [tokens, monotonic time of last use], least recently used first
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    def take(self, key: str) -> float:
+        """Take a token for key: 0 if there was one, else seconds until there is"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._expire(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return (1 - bucket[0]) / self.rate
+        bucket[0] -= 1
+        return 0.0
+
+    def peek(self, key: str) -> float:
+        """Seconds until key has a token, without taking one"""
+        if self.rate <= 0:
+            return 0.0
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return 0.0
+        tokens = min(self.burst, bucket[0] + (time.monotonic() - bucket[1]) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def _expire(self, now: float):
+        # Buckets are ordered by last use, and any bucket unused for
+        # burst / rate seconds is full again
+        refilled = now - self.burst / self.rate
+        buckets = self._buckets
+        while buckets:
+            key = next(iter(buckets))
+            if buckets[key][1] > refilled:
+                break
+            del buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class Budget:
+    def __init__(
+        self,
+        name: str,
+        rate: float = 0.0,
+        burst: float = 1.0,
+        max_in_flight: int = 0,
+        max_queued: Optional[int] = None,
+        queue_timeout: float = 1.0,
+    ):
+        self.name = name
+        self.limiter = RateLimiter(rate, burst)
+        # max_in_flight=0 leaves concurrency unbounded
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_in_flight if max_queued is None else max_queued
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rate_limited = 0
+        self.busy = 0
+
+    async def acquire(self, key: str):
+        """Admit a request for key or raise AdmissionRejected; admitted requests must release()"""
+        retry_after = self.limiter.take(key)
+        if retry_after:
+            self.rate_limited += 1
+            raise AdmissionRejected(self.name, "rate_limited", retry_after)
+        if self._slots is not None:
+            if self._slots.locked():
+                await self._wait_for_slot()
+            else:
+                await self._slots.acquire()
+        self.in_flight += 1
+        self.admitted += 1
+
+    def release(self):
+        self.in_flight -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def admit(self, key: str):
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def _wait_for_slot(self):
+        if self.waiting >= self.max_queued:
+            self.busy += 1
+            raise AdmissionRejected(self.name, "busy", self.queue_timeout)
+        self.waiting += 1
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.busy += 1
+            raise AdmissionRejected(self.name, "busy", self.queue_timeout) from None
+        finally:
+            self.waiting -= 1
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.limiter.rate,
+            "burst": self.limiter.burst,
+            "buckets": len(self.limiter),
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rate_limited": self.rate_limited,
+            "busy": self.busy,
+        }
+
+
+class FailureLimit:
+    """Refuses a key once it has failed ``burst`` times, then ``rate`` times a second"""
+
+    def __init__(self, name: str, rate: float = 0.0, burst: float = 1.0):
+        self.name = name
+        self.limiter = RateLimiter(rate, burst)
+        self.failures = 0
+        self.rate_limited = 0
+
+    def check(self, key: str):
+        """Raise AdmissionRejected if key has no failures left"""
+        retry_after = self.limiter.peek(key)
+        if retry_after:
+            self.rate_limited += 1
+            raise AdmissionRejected(self.name, "rate_limited", retry_after)
+
+    def failed(self, key: str):
+        self.failures += 1
+        self.limiter.take(key)
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.limiter.rate,
+            "burst": self.limiter.burst,
+            "buckets": len(self.limiter),
+            "failures": self.failures,
+            "rate_limited": self.rate_limited,
+        }
+
+
+class InFlightLimit:
+    """Count of requests being handled by the process, and its cap"""
+
+    def __init__(self, max_in_flight: int = 0):
+        # max_in_flight=0 turns the cap off
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.peak = 0
+        self.shed = 0
+
+    def stats(self) -> dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "peak": self.peak,
+            "shed": self.shed,
+        }
+
+
+SHED_BODY = b'{"detail":"Server busy, please retry"}'
+
+
+class AdmissionMiddleware:
+    """ASGI middleware answering 429 once ``limit.max_in_flight`` requests are being handled"""
+
+    def __init__(self, app, limit: InFlightLimit, exempt: Iterable[str] = ()):
+        self.app = app
+        self.limit = limit
+        self.exempt = frozenset(exempt)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt:
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limit
+        if limit.max_in_flight and limit.in_flight >= limit.max_in_flight:
+            limit.shed += 1
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(SHED_BODY)).encode()),
+                    (b"retry-after", b"1"),
+                ],
+            })
+            await send({"type": "http.response.body", "body": SHED_BODY})
+            return
+
+        limit.in_flight += 1
+        limit.peak = max(limit.peak, limit.in_flight)
+        counted = True
+
+        def done():
+            nonlocal counted
+            if counted:
+                counted = False
+                limit.in_flight -= 1
+
+        async def send_and_release(message):
+            if message["type"] == "http.response.start":
+                done()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_release)
+        finally:
+            done()
@@ -0,0 +1,351 @@
+import secrets
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+# Incremental usage analytics
+#
+# Counters are kept in UTC time buckets and updated as events happen, so a
+# report only walks the buckets in its time range:
+#
+# - sessions created per day
+# - messages per hour
+# - active users: each user's last-seen hour, plus a count of users per
+#   last-seen hour. Users active within a window are the sum of the counts
+#   for the hours in that window.
+# - session duration (first to last message) summed per session creation
+#   day, together with the number of sessions that have any messages
+#
+# Buckets older than ``retention_days`` are pruned as time moves on, and so
+# are the per-session times of sessions created before then. Deleted
+# sessions are forgotten through forget_session(); what they already added
+# to the counters stays, like any other past event.
+#
+# ``version`` goes up with every change to the counters, so a report for the
+# same range and hour is unchanged while it stays put. ``epoch`` tells one
+# engine's versions from another's (a rebuild, another process).
+#
+# AnalyticsEngine counts in process memory, which is right for the in-memory
+# store. With a store that several workers share (SQLiteStore), each worker
+# would only count the requests it served, so StoreAnalytics reports from
+# buckets the store keeps itself: the same counters, bumped in the same
+# transaction as each write (see bucket_updates()), and active users from
+# the users' lastActive. Every worker then reports the same figures.
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def parse_timestamp(value: str) -> float:
+    """Unix time of an ISO timestamp; naive values are local time like datetime.now()"""
+    return datetime.fromisoformat(value).timestamp()
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, HOUR)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h {minutes}m"
+    if minutes:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
+
+
+def bucket_updates(
+    session_created: str,
+    messages: List[dict],
+    last_sent: Optional[float],
+    oldest_day: int,
+) -> Tuple[List[Tuple[str, int, float]], Optional[float]]:
+    """(counter, bucket, increment) for messages added to a session, and its new last_sent
+
+    ``last_sent`` is the time of the session's latest earlier message, or
+    None if it had none; sessions created before ``oldest_day`` no longer
+    count towards durations, as in AnalyticsEngine once they are pruned.
+    """
+    day = int(parse_timestamp(session_created) // DAY)
+    updates = []
+    for message in messages:
+        sent = parse_timestamp(message["timestamp"])
+        updates.append(("messages", int(sent // HOUR), 1))
+        if day < oldest_day:
+            continue
+        if last_sent is None:
+            updates.append(("active_sessions", day, 1))
+            last_sent = sent
+        elif sent > last_sent:
+            updates.append(("duration", day, sent - last_sent))
+            last_sent = sent
+    return updates, last_sent
+
+
+class AnalyticsEngine:
+    def __init__(self, retention_days: int = 90):
+        self.retention_days = retention_days
+        self._sessions_per_day: Counter = Counter()
+        self._messages_per_hour: Counter = Counter()
+        self._user_last_hour: Dict[str, int] = {}
+        self._users_per_last_hour: Counter = Counter()
+        # session_id -> (creation day, last activity); last activity is None
+        # until the session's first message
+        self._session_times: Dict[str, Tuple[int, Optional[float]]] = {}
+        self._duration_per_day: Counter = Counter()
+        self._active_sessions_per_day: Counter = Counter()
+        self._pruned_before_day = 0
+        self.version = 0
+        self.epoch = secrets.token_hex(8)
+
+    # Event hooks
+    def record_session(self, session: dict):
+        created = parse_timestamp(session["created_at"])
+        day = int(created // DAY)
+        self._sessions_per_day[day] += 1
+        self._session_times[session["id"]] = (day, None)
+        self.version += 1
+        for message in session.get("messages", []):
+            self.record_message(session["id"], message)
+
+    def record_message(self, session_id: str, message: dict):
+        sent = parse_timestamp(message["timestamp"])
+        self._messages_per_hour[int(sent // HOUR)] += 1
+        self.version += 1
+        if message["type"] == "user":
+            self.record_activity(message["user_id"], sent)
+
+        times = self._session_times.get(session_id)
+        if times is None:
+            return
+        day, last = times
+        if last is None:
+            # Duration runs from the first message to the latest one
+            self._active_sessions_per_day[day] += 1
+            self._session_times[session_id] = (day, sent)
+        elif sent > last:
+            self._duration_per_day[day] += sent - last
+            self._session_times[session_id] = (day, sent)
+
+    def record_activity(self, user_id: str, when: Optional[float] = None):
+        hour = int((time.time() if when is None else when) // HOUR)
+        previous = self._user_last_hour.get(user_id)
+        if previous is not None and previous >= hour:
+            return
+        if previous is not None:
+            self._users_per_last_hour[previous] -= 1
+            if not self._users_per_last_hour[previous]:
+                del self._users_per_last_hour[previous]
+        self._user_last_hour[user_id] = hour
+        self._users_per_last_hour[hour] += 1
+        self.version += 1
+        self._prune(hour // 24)
+
+    def forget_user(self, user_id: str):
+        hour = self._user_last_hour.pop(user_id, None)
+        if hour is not None:
+            self.version += 1
+            self._users_per_last_hour[hour] -= 1
+            if not self._users_per_last_hour[hour]:
+                del self._users_per_last_hour[hour]
+
+    def forget_session(self, session_id: str):
+        # The report doesn't change, so neither does the version
+        self._session_times.pop(session_id, None)
+
+    # Queries
+    def active_users(self, hours: int, now: Optional[float] = None) -> int:
+        current = int((time.time() if now is None else now) // HOUR)
+        return sum(self._users_per_last_hour.get(hour, 0) for hour in range(current - hours + 1, current + 1))
+
+    def report(self, days: int = 7, now: Optional[float] = None) -> dict:
+        return build_report(
+            days,
+            time.time() if now is None else now,
+            {
+                "sessions": self._sessions_per_day,
+                "messages": self._messages_per_hour,
+                "duration": self._duration_per_day,
+                "active_sessions": self._active_sessions_per_day,
+            },
+            lambda hours, now: self.active_users(hours, now),
+        )
+
+    # Snapshots
+    def state(self) -> dict:
+        """The counters as JSON-encodable lists"""
+        return {
+            "sessions_per_day": list(self._sessions_per_day.items()),
+            "messages_per_hour": list(self._messages_per_hour.items()),
+            "user_last_hour": list(self._user_last_hour.items()),
+            "users_per_last_hour": list(self._users_per_last_hour.items()),
+            "session_times": [[session_id, day, last] for session_id, (day, last) in self._session_times.items()],
+            "duration_per_day": list(self._duration_per_day.items()),
+            "active_sessions_per_day": list(self._active_sessions_per_day.items()),
+            "pruned_before_day": self._pruned_before_day,
+            "version": self.version,
+            "epoch": self.epoch,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict, retention_days: int = 90):
+        """An engine with the counters from state()"""
+        engine = cls(retention_days)
+        engine._sessions_per_day.update(dict(state["sessions_per_day"]))
+        engine._messages_per_hour.update(dict(state["messages_per_hour"]))
+        engine._user_last_hour.update(state["user_last_hour"])
+        engine._users_per_last_hour.update(dict(state["users_per_last_hour"]))
+        engine._session_times.update((session_id, (day, last)) for session_id, day, last in state["session_times"])
+        engine._duration_per_day.update(dict(state["duration_per_day"]))
+        engine._active_sessions_per_day.update(dict(state["active_sessions_per_day"]))
+        engine._pruned_before_day = state["pruned_before_day"]
+        engine.version = state["version"]
+        engine.epoch = state["epoch"]
+        return engine
+
+    def replay_store_write(self, method: str, args: list):
+        """Count a store write replayed from a journal, as the routes would have"""
+        if method == "add_session":
+            self.record_session(args[0])
+        elif method == "add_message":
+            self.record_message(*args)
+        elif method == "update_last_active":
+            for user_id, last_active in args[0].items():
+                self.record_activity(user_id, parse_timestamp(last_active))
+        elif method == "delete_user":
+            self.forget_user(args[0])
+        elif method == "delete_session":
+            self.forget_session(args[0])
+
+    # Rebuild
+    @classmethod
+    def from_records(cls, users: Iterable[dict], sessions: Iterable[dict], retention_days: int = 90):
+        """Recompute every counter from stored users and sessions"""
+        engine = cls(retention_days)
+        for session in sessions:
+            engine.record_session(session)
+        for user in users:
+            engine.record_activity(user["id"], parse_timestamp(user["lastActive"]))
+        return engine
+
+    def _prune(self, today: int):
+        oldest_day = today - self.retention_days
+        if oldest_day <= self._pruned_before_day:
+            return
+        for counter, per_hour in (
+            (self._sessions_per_day, False),
+            (self._duration_per_day, False),
+            (self._active_sessions_per_day, False),
+            (self._messages_per_hour, True),
+        ):
+            cutoff = oldest_day * 24 if per_hour else oldest_day
+            for key in [key for key in counter if key < cutoff]:
+                del counter[key]
+        # Later messages in these sessions would only add to pruned days
+        for session_id in [session_id for session_id, (day, _) in self._session_times.items() if day < oldest_day]:
+            del self._session_times[session_id]
+        self._pruned_before_day = oldest_day
+
+
+class StoreAnalytics:
+    """Analytics from the counters a shared store keeps (see SQLiteStore)
+
+    Has AnalyticsEngine's event hooks so the routes can call either, but
+    they do nothing: the store counts its own writes.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def record_session(self, session: dict):
+        pass
+
+    def record_message(self, session_id: str, message: dict):
+        pass
+
+    def record_activity(self, user_id: str, when: Optional[float] = None):
+        pass
+
+    def forget_user(self, user_id: str):
+        pass
+
+    def forget_session(self, session_id: str):
+        pass
+
+    def report(self, days: int = 7, now: Optional[float] = None) -> dict:
+        """Blocking: queries the store"""
+        now = time.time() if now is None else now
+        current_hour = int(now // HOUR)
+        windows = sorted({days * 24, 1, 24, 7 * 24})
+        # Users last seen in the current hour or the ones before it, like
+        # AnalyticsEngine.active_users(); lastActive is naive local time
+        since = [datetime.fromtimestamp((current_hour - hours + 1) * HOUR).isoformat() for hours in windows]
+        active = dict(zip(windows, self.store.count_active_users(since)))
+        counters = self.store.analytics_buckets(
+            int(now // DAY) - days + 1, int(now // DAY), current_hour - days * 24 + 1, current_hour,
+        )
+        return build_report(days, now, counters, lambda hours, now: active[hours])
+
+    def rebuild(self):
+        """Recompute the store's counters from its sessions; blocking"""
+        self.store.rebuild_analytics()
+        return self
+
+
+def build_report(
+    days: int,
+    now: float,
+    counters: Dict[str, Mapping[int, float]],
+    active_users: Callable[[int, float], int],
+) -> dict:
+    """The analytics report for the ``days`` up to ``now``
+
+    ``counters`` maps "sessions", "duration" and "active_sessions" to
+    per-day buckets and "messages" to per-hour buckets, holding at least
+    the report's range; ``active_users(hours, now)`` counts the users seen
+    in the last ``hours`` hours.
+    """
+    last_day = int(now // DAY)
+    day_range = range(last_day - days + 1, last_day + 1)
+    current_hour = int(now // HOUR)
+    hour_range = range(current_hour - days * 24 + 1, current_hour + 1)
+    sessions_per_day, messages_per_hour = counters["sessions"], counters["messages"]
+
+    duration = sum(counters["duration"].get(day, 0.0) for day in day_range)
+    active_sessions = sum(counters["active_sessions"].get(day, 0) for day in day_range)
+    average_duration = duration / active_sessions if active_sessions else 0.0
+
+    return {
+        "range": {
+            "days": days,
+            "start": _utc(day_range[0] * DAY).date().isoformat(),
+            "end": _utc(last_day * DAY).date().isoformat(),
+        },
+        "daily_sessions": [
+            {
+                "day": _utc(day * DAY).strftime("%a"),
+                "date": _utc(day * DAY).date().isoformat(),
+                "count": sessions_per_day.get(day, 0),
+            }
+            for day in day_range
+        ],
+        "hourly_messages": [
+            {
+                "hour": _utc(hour * HOUR).strftime("%Y-%m-%dT%H:00Z"),
+                "count": messages_per_hour.get(hour, 0),
+            }
+            for hour in hour_range
+        ],
+        "user_activity": {
+            "active_users": active_users(days * 24, now),
+            "active_users_1h": active_users(1, now),
+            "active_users_24h": active_users(24, now),
+            "active_users_7d": active_users(7 * 24, now),
+            "total_messages": sum(messages_per_hour.get(hour, 0) for hour in hour_range),
+            "average_session_duration": format_duration(average_duration),
+            "average_session_duration_seconds": round(average_duration, 1),
+        },
+    }
+
+
+def _utc(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
@@ -0,0 +1,141 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+# Signed access tokens
+#
+# A token is "<payload>.<signature>", both urlsafe base64. The payload is the
+# JSON claims (including "exp" as a unix timestamp) and the signature is an
+# HMAC-SHA256 of the encoded payload under the server's secret key.
+
+
+def create_token(claims: dict, secret: str, expires_in: float) -> str:
+    to_encode = dict(claims)
+    to_encode["exp"] = int(time.time() + expires_in)
+    payload = base64.urlsafe_b64encode(json.dumps(to_encode, separators=(",", ":")).encode())
+    signature = base64.urlsafe_b64encode(_sign(payload, secret))
+    return f"{payload.decode()}.{signature.decode()}"
+
+
+def verify_token(token: str, secret: str) -> Optional[dict]:
+    """Return the token's claims, or None if it is malformed, forged or expired"""
+    try:
+        payload, signature = token.encode().split(b".")
+        if not hmac.compare_digest(base64.urlsafe_b64decode(signature), _sign(payload, secret)):
+            return None
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or not isinstance(claims.get("exp"), (int, float)):
+        return None
+    if time.time() > claims["exp"]:
+        return None
+    return claims
+
+
+def _sign(payload: bytes, secret: str) -> bytes:
+    return hmac.new(secret.encode(), payload, hashlib.sha256).digest()
+
+
+def load_secret_key(path: str) -> str:
+    """Read the signing key from ``path``, creating it on first use
+
+    The new key is written to a temporary file and hard-linked into place, so
+    processes starting at the same time all end up reading the same key.
+    """
+    if not os.path.exists(path):
+        scratch = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(scratch, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(scratch, path)
+        except FileExistsError:
+            pass  # another process got there first
+        finally:
+            os.unlink(scratch)
+    with open(path) as f:
+        return f.read().strip()
+
+
+# Verified-token cache
+#
+# Maps a digest of the raw bearer token to the user it resolved to, so repeat
+# requests skip decoding, signature verification and the user lookup. Entries
+# expire with the token (or after ``ttl`` seconds, whichever comes first) and
+# are evicted least-recently-used beyond ``max_size``. Anything that changes
+# whether a user may authenticate must call invalidate_user().
+
+
+class TokenCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        # digest -> (expires_at, user)
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._digests_by_user: Dict[str, Set[bytes]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token: str) -> Optional[dict]:
+        key = _digest(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, user = entry
+        if time.time() >= expires_at:
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return user
+
+    def put(self, token: str, user: dict, token_expires_at: float):
+        key = _digest(token)
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (min(token_expires_at, time.time() + self.ttl), user)
+        self._digests_by_user.setdefault(user["id"], set()).add(key)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate_user(self, user_id: str):
+        for key in self._digests_by_user.pop(user_id, ()):
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._digests_by_user.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _remove(self, key: bytes):
+        _, user = self._entries.pop(key)
+        digests = self._digests_by_user.get(user["id"])
+        if digests is not None:
+            digests.discard(key)
+            if not digests:
+                del self._digests_by_user[user["id"]]
+
+
+def _digest(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
@@ -0,0 +1,135 @@
+"""Benchmark: indexed /users filtering and bulk user creation.
+
+Run from the api directory:
+
+    python benchmarks/bench_admin_users.py
+    python benchmarks/bench_admin_users.py --users 200000 --batch 1000
+
+Fills an InMemoryStore with ``--users`` users, then times
+InMemoryStore.query_users() against the old approach for several admin
+listings. The old approach fetches every user and filters, sorts and slices
+in Python.
+
+It then creates ``--batch`` users through the app over an in-process ASGI
+transport. It does this once with one POST /users per user and once with a
+single POST /users/bulk. Password hashing is set to a cheap scrypt cost
+(PASSWORD_SCRYPT_N=1024), so the comparison shows the per-request cost
+rather than the KDF.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("PASSWORD_SCRYPT_N", "1024")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from store import InMemoryStore, user_sort_value  # noqa: E402
+
+FIRST_NAMES = ("Ada", "Grace", "Linus", "Barbara", "Ken", "Margaret", "Dennis", "Frances", "Guido", "Radia")
+
+QUERIES = (
+    ("first page", {"limit": 50}),
+    ("status=Inactive", {"status": "Inactive", "limit": 50}),
+    ("role=Admin", {"role": "Admin", "limit": 50}),
+    ("name prefix 'grace 1'", {"name_prefix": "grace 1", "limit": 50}),
+    ("sort=name desc", {"sort": "name", "descending": True, "limit": 50}),
+    ("Active by lastActive", {"status": "Active", "sort": "lastActive", "limit": 50, "offset": 500}),
+)
+
+
+def build_store(n: int, seed: int) -> InMemoryStore:
+    rng = random.Random(seed)
+    store = InMemoryStore()
+    for i in range(n):
+        store.add_user({
+            "id": str(i),
+            "name": f"{rng.choice(FIRST_NAMES)} {i}",
+            "email": f"user{i}@example.com",
+            "role": "Admin" if rng.random() < 0.01 else "User",
+            "status": "Inactive" if rng.random() < 0.1 else "Active",
+            "lastActive": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:00:00",
+            "password_hash": "x",
+        })
+    return store
+
+
+def scan_users(store: InMemoryStore, role=None, status=None, name_prefix=None, sort=None,
+               descending=False, limit=None, offset=0):
+    """The old way: every user, filtered and sorted in Python"""
+    users = store.list_public_users()
+    if role is not None:
+        users = [user for user in users if user["role"] == role]
+    if status is not None:
+        users = [user for user in users if user["status"] == status]
+    if name_prefix:
+        users = [user for user in users if user["name"].lower().startswith(name_prefix.lower())]
+    if sort is not None:
+        users.sort(key=lambda user: (user_sort_value(user, sort), user["id"]), reverse=descending)
+    elif descending:
+        users.reverse()
+    return users[offset:None if limit is None else offset + limit], len(users)
+
+
+def time_call(fn, repeat: int, **kwargs) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(**kwargs)
+    return (time.perf_counter() - started) / repeat
+
+
+async def time_creation(batch: int):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        login = await client.post("/token", data={"username": "john@example.com", "password": "password123"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        def user(prefix: str, i: int) -> dict:
+            return {
+                "name": f"{prefix} {i}", "email": f"{prefix}{i}@example.com",
+                "role": "User", "status": "Active", "password": "onboarding",
+            }
+
+        started = time.perf_counter()
+        for i in range(batch):
+            (await client.post("/users", json=user("single", i), headers=headers)).raise_for_status()
+        single = time.perf_counter() - started
+
+        started = time.perf_counter()
+        response = await client.post("/users/bulk", json={"users": [user("bulk", i) for i in range(batch)]}, headers=headers)
+        response.raise_for_status()
+        bulk = time.perf_counter() - started
+        assert response.json()["succeeded"] == batch
+    return single, bulk
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=500, help="users created per creation run")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    store = build_store(args.users, args.seed)
+    print(f"{args.users:,} users")
+    print(f"{'listing':<26} {'scan':>10} {'indexed':>10} {'speedup':>8}  matches")
+    for label, kwargs in QUERIES:
+        expected = scan_users(store, **kwargs)
+        assert store.query_users(**kwargs) == expected, label
+        scan = time_call(scan_users, args.repeat, store=store, **kwargs)
+        indexed = time_call(store.query_users, args.repeat, **kwargs)
+        print(f"{label:<26} {scan * 1000:>7.2f} ms {indexed * 1000:>7.2f} ms {scan / indexed:>7.1f}x  {expected[1]:,}")
+
+    main.logger.stream = open(os.devnull, "w")
+    single, bulk = asyncio.run(time_creation(args.batch))
+    print(f"create {args.batch} users: one request each {single:.2f} s, one bulk request {bulk:.2f} s")
+
+
+if __name__ == "__main__":
+    cli()
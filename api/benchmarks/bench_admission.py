@@ -0,0 +1,183 @@
+"""Load test: a scripted client hammering logins and chat, with and without admission control.
+
+Run from the api directory:
+
+    python benchmarks/bench_admission.py
+    python benchmarks/bench_admission.py --attackers 64 --rate 1000 --duration 5
+
+Drives the app in-process over an ASGI transport. In each scenario
+``--attackers`` concurrent loops hammer one route as a single account,
+``--rate`` requests a second between them (the client shares the event loop
+with the app, so an unpaced attack would mostly measure the client):
+
+- login: POST /token for one account with a wrong password, while other
+  users each log in once from another client address, spread over
+  ``--duration`` seconds;
+- chat: POST /chat/sessions/{id}/messages as one user, while other users
+  send a chat message every 50 ms between them.
+
+Each scenario runs with admission control off, then on with the limits
+configured for the app (CHAT_RATE_LIMIT, LOGIN_RATE_LIMIT, LOGIN_FAILURE_RATE
+and so on). For
+the other users it reports latency and any failed requests, for the
+attacker how its requests were answered.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from admission import Budget, FailureLimit  # noqa: E402
+
+PASSWORD = "bench-password"
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def copy_budget(budget: Budget, enabled: bool) -> Budget:
+    """A fresh budget with the same limits, or none at all"""
+    if not enabled:
+        return Budget(budget.name)
+    return Budget(
+        budget.name,
+        rate=budget.limiter.rate,
+        burst=budget.limiter.burst,
+        max_in_flight=budget.max_in_flight,
+        max_queued=budget.max_queued,
+        queue_timeout=budget.queue_timeout,
+    )
+
+
+def copy_failure_limit(limit: FailureLimit, enabled: bool) -> FailureLimit:
+    if not enabled:
+        return FailureLimit(limit.name)
+    return FailureLimit(limit.name, rate=limit.limiter.rate, burst=limit.limiter.burst)
+
+
+async def hammer(client, stop: asyncio.Event, counts: dict, interval, method, url, **kwargs):
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+        # Also yields when a refused request completed without suspending
+        await asyncio.sleep(max(0.0, started + interval - time.perf_counter()))
+
+
+async def paced(client, requests, duration):
+    """Send ``requests`` (method, url, kwargs) evenly over ``duration`` seconds
+
+    Latency runs from when each request was due, so time spent waiting for a
+    busy event loop counts against it.
+    """
+    latencies, failures = [], {}
+    interval = duration / len(requests)
+    start = time.perf_counter()
+    for i, (method, url, kwargs) in enumerate(requests):
+        due = start + i * interval
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        response = await client.request(method, url, **kwargs)
+        latencies.append(time.perf_counter() - due)
+        if response.status_code >= 400:
+            failures[response.status_code] = failures.get(response.status_code, 0) + 1
+    return latencies, failures
+
+
+async def scenario(client, attacker_client, args, attack, requests):
+    stop = asyncio.Event()
+    counts: dict = {}
+    method, url, kwargs = attack
+    interval = args.attackers / args.rate
+    attackers = [
+        asyncio.create_task(hammer(attacker_client, stop, counts, interval, method, url, **kwargs))
+        for _ in range(args.attackers)
+    ]
+    await asyncio.sleep(0.1)  # let the attack build up
+    latencies, failures = await paced(client, requests, args.duration)
+    stop.set()
+    await asyncio.gather(*attackers)
+    return latencies, failures, counts
+
+
+def report(label, latencies, failures, counts):
+    print(
+        f"{label:<18} others p50 {statistics.median(latencies) * 1000:7.2f} ms"
+        f"  p99 {percentile(latencies, 0.99) * 1000:7.2f} ms"
+        f"  failed {sum(failures.values())}/{len(latencies)}"
+        f"  attacker " + ", ".join(f"{code}: {count}" for code, count in sorted(counts.items()))
+    )
+
+
+async def run(args):
+    # Other users, all with the same password so it is hashed only once
+    password_hash = main.password_hasher.hash_sync(PASSWORD)
+    others = [f"admission-bench-{i}@example.com" for i in range(args.users)]
+    for i, email in enumerate(others):
+        main.db.add_user({
+            "id": f"admission-bench-{i}", "name": f"Bench User {i}", "email": email, "role": "User",
+            "status": "Active", "lastActive": "2024-01-01T00:00:00", "password_hash": password_hash,
+        })
+    configured = {"chat_budget": main.chat_budget, "login_budget": main.login_budget}
+    failure_limit = main.login_failures
+
+    transport = httpx.ASGITransport(app=main.app)
+    # Logins are limited per client address, so the attacker gets its own
+    attacker_transport = httpx.ASGITransport(app=main.app, client=("203.0.113.7", 40000))
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client, \
+                httpx.AsyncClient(transport=attacker_transport, base_url="http://bench", timeout=120) as attacker:
+            # Sessions and tokens for the chat scenario, set up without limits
+            main.login_budget = copy_budget(configured["login_budget"], False)
+            chats = []
+            for email in others + ["john@example.com"]:
+                login = await client.post("/token", data={"username": email, "password": PASSWORD if email in others else "password123"})
+                headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+                session = (await client.post("/chat/sessions", json="Admission", headers=headers)).json()
+                chats.append((f"/chat/sessions/{session['id']}/messages", headers))
+            attacker_url, attacker_headers = chats.pop()
+
+            for enabled in (False, True):
+                mode = "on" if enabled else "off"
+                for name, budget in configured.items():
+                    setattr(main, name, copy_budget(budget, enabled))
+                main.login_failures = copy_failure_limit(failure_limit, enabled)
+                report(f"login, limits {mode}", *await scenario(
+                    client, attacker, args,
+                    ("POST", "/token", {"data": {"username": "john@example.com", "password": "wrong"}}),
+                    [("POST", "/token", {"data": {"username": email, "password": PASSWORD}}) for email in others],
+                ))
+                messages = int(args.duration / 0.05)
+                report(f"chat, limits {mode}", *await scenario(
+                    client, attacker, args,
+                    ("POST", attacker_url, {"json": "kubernetes rollout status", "headers": attacker_headers}),
+                    [("POST", url, {"json": "kubernetes rollout status", "headers": headers})
+                     for url, headers in (chats[i % len(chats)] for i in range(messages))],
+                ))
+    for name, budget in configured.items():
+        setattr(main, name, budget)
+    main.login_failures = failure_limit
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--attackers", type=int, default=32, help="concurrent loops of the hammering client")
+    parser.add_argument("--rate", type=float, default=500, help="attacker requests per second, at most")
+    parser.add_argument("--users", type=int, default=20, help="other users")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds timed per scenario")
+    args = parser.parse_args()
+
+    main.logger.stream = open(os.devnull, "w")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,144 @@
+"""Benchmark: resident memory of chat history, tiered vs. fully in memory.
+
+Run from the api directory:
+
+    python benchmarks/bench_history.py
+    python benchmarks/bench_history.py --sessions 100 --messages 1000
+
+Stores ``--sessions`` x ``--messages`` chat messages (1M by default) in
+three layouts, each in a fresh subprocess, and reports the growth in
+resident set size (RSS):
+
+- dicts: one dict per message in a list per session, the original layout
+  (no store, no search index)
+- all hot: InMemoryStore with tiering effectively off
+- tiered: InMemoryStore with the default hot window (HISTORY_HOT_MESSAGES)
+
+Both store layouts include the full-text search index. For the tiered store
+it also times paging back through sessions 50 messages at a time: pages of
+the hot tail, pages reaching into the archive (median and worst, the worst
+being a page that decompresses segments), and the same archive pages read
+again from the segment cache.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store import InMemoryStore  # noqa: E402
+
+MODES = ("dicts", "all hot", "tiered")
+PHRASES = (
+    "How do I roll back a Kubernetes deployment to the previous revision?",
+    "The Airflow scheduler shows the DAG as queued but no task instance starts.",
+    "To deploy a container to Kubernetes, create a deployment YAML file first.",
+    "Can you check why the MongoDB replica set lost its primary last night?",
+    "Here is the pod status: CrashLoopBackOff after the latest image push.",
+)
+
+
+def rss_bytes() -> int:
+    # Current RSS from /proc where available, else the peak from getrusage
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def message(session: int, i: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": str(session) if i % 2 == 0 else "system",
+        "content": f"{PHRASES[(session + i) % len(PHRASES)]} (ticket {i % 500})",
+        "timestamp": f"2024-01-{1 + i // 1440 % 28:02d}T{i // 60 % 24:02d}:{i % 60:02d}:00.{session:06d}",
+        "type": "user" if i % 2 == 0 else "bot",
+    }
+
+
+def child(mode: str, sessions: int, messages: int, hot: int) -> dict:
+    baseline = rss_bytes()
+    started = time.perf_counter()
+    if mode == "dicts":
+        store = [[message(s, i) for i in range(messages)] for s in range(sessions)]
+    else:
+        store = InMemoryStore(hot_messages=10 ** 9 if mode == "all hot" else hot)
+        for s in range(sessions):
+            store.add_session({
+                "id": f"s{s}", "user_id": str(s), "title": f"Session {s}",
+                "created_at": "2024-01-01T00:00:00", "updated_at": "2024-01-01T00:00:00", "messages": [],
+            })
+            for i in range(messages):
+                store.add_message(f"s{s}", message(s, i))
+    result = {"seconds": time.perf_counter() - started, "rss": rss_bytes() - baseline}
+
+    if mode == "tiered":
+        result["archive"] = store.history_stats()["archive"]["bytes"]
+        # Page back from the newest message to the oldest, 50 at a time,
+        # reading each page twice; the second read finds its segments cached
+        cold_count = max(0, (messages - hot) // store.segment_messages * store.segment_messages)
+        hot_reads, first, repeat = [], [], []
+        for s in range(min(sessions, 20)):
+            cursor, end = None, messages
+            while end > 0:
+                started = time.perf_counter()
+                page, _ = store.list_messages(f"s{s}", 50, cursor)
+                elapsed = time.perf_counter() - started
+                end -= len(page)
+                if end >= cold_count:
+                    hot_reads.append(elapsed)
+                else:
+                    first.append(elapsed)
+                    started = time.perf_counter()
+                    store.list_messages(f"s{s}", 50, cursor)
+                    repeat.append(time.perf_counter() - started)
+                cursor = page[0]["id"]
+        result["page_ms"] = {
+            "hot": statistics.median(hot_reads) * 1000,
+            "cold, median": statistics.median(first) * 1000 if first else None,
+            "cold, max": max(first) * 1000 if first else None,
+            "cold, cached": statistics.median(repeat) * 1000 if repeat else None,
+        }
+    return result
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=1000, help="messages per session")
+    parser.add_argument("--hot", type=int, default=256, help="hot messages per session in the tiered layout")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(child(args.mode, args.sessions, args.messages, args.hot)))
+        return
+
+    total = args.sessions * args.messages
+    print(f"{total:,} messages in {args.sessions:,} sessions, hot window {args.hot}")
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--mode", mode, "--sessions", str(args.sessions),
+             "--messages", str(args.messages), "--hot", str(args.hot)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output)
+        line = f"{mode:<8} RSS +{result['rss'] / 2 ** 20:>7.0f} MiB ({result['rss'] / total:>5.0f} B/message), built in {result['seconds']:.1f} s"
+        if "archive" in result:
+            line += f", archive file {result['archive'] / 2 ** 20:.0f} MiB"
+        print(line)
+        for label, value in result.get("page_ms", {}).items():
+            if value is not None:
+                print(f"  page of 50, {label:<17} {value:.3f} ms")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,95 @@
+"""Benchmark: compiled IntentMatcher vs. the old if/elif keyword chain.
+
+Run from the api directory:
+
+    python benchmarks/bench_intents.py
+    python benchmarks/bench_intents.py --rules 7 100 1000 --messages 5000
+
+The shipped rules (data/intents.json) are padded with synthetic intents to
+each rule count. Both classifiers see the same messages, and the chain is
+the old `any(word in input_lower for word in ...)` check per intent.
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intents import DEFAULT_INTENTS_PATH, IntentMatcher  # noqa: E402
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10)))
+
+
+def build_rules(base: list, count: int, rng: random.Random) -> list:
+    rules = list(base)
+    while len(rules) < count:
+        rules.append({
+            "name": f"synthetic_{len(rules)}",
+            "keywords": [random_word(rng) for _ in range(4)],
+            "response": "Synthetic response",
+        })
+    return rules[:count]
+
+
+def build_messages(rules: list, count: int, rng: random.Random) -> list:
+    keywords = [keyword.rstrip("*") for rule in rules for keyword in rule["keywords"]]
+    messages = []
+    for _ in range(count):
+        words = [random_word(rng) for _ in range(rng.randint(8, 25))]
+        # Roughly half of the messages mention a keyword somewhere
+        if rng.random() < 0.5:
+            words.insert(rng.randrange(len(words)), rng.choice(keywords))
+        messages.append(" ".join(words))
+    return messages
+
+
+def legacy_chain(rules: list):
+    chain = [[keyword.rstrip("*") for keyword in rule["keywords"]] for rule in rules]
+
+    def classify(message):
+        input_lower = message.lower()
+        for index, keywords in enumerate(chain):
+            if any(word in input_lower for word in keywords):
+                return index
+        return None
+    return classify
+
+
+def messages_per_second(classify, messages) -> float:
+    start = time.perf_counter()
+    for message in messages:
+        classify(message)
+    return len(messages) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rules", type=int, nargs="+", default=[7, 50, 200, 1000])
+    parser.add_argument("--messages", type=int, default=20_000)
+    args = parser.parse_args()
+
+    with open(DEFAULT_INTENTS_PATH, encoding="utf-8") as f:
+        shipped = json.load(f)
+    rng = random.Random(42)
+
+    print(f"{'rules':>6}  {'if/elif chain':>16}  {'compiled':>16}  speedup")
+    for count in args.rules:
+        rules = build_rules(shipped["intents"], count, rng)
+        messages = build_messages(rules, args.messages, rng)
+        matcher = IntentMatcher(rules, shipped["fallback"])
+        chain_rate = messages_per_second(legacy_chain(rules), messages)
+        compiled_rate = messages_per_second(matcher.match, messages)
+        print(
+            f"{count:>6}  {chain_rate:>10,.0f} msg/s  {compiled_rate:>10,.0f} msg/s"
+            f"  {compiled_rate / chain_rate:>6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
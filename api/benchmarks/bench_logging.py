@@ -0,0 +1,72 @@
+"""Benchmark: cost of logging a chat message on the request path.
+
+Run from the api directory:
+
+    python benchmarks/bench_logging.py
+    python benchmarks/bench_logging.py --records 200000 > /dev/null
+
+Compares the old print() of the raw message with EventLogger.info(), which
+only enqueues the record, and with the writer thread's work per record. Both write to stdout, so
+redirect it to see the cost of a fast sink, or leave it on a terminal to see
+a slow one. Then fills the queue with the writer stopped to show that records
+past ``--queue`` are dropped and counted instead of blocking.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eventlog import EventLogger  # noqa: E402
+
+ROUTE = "/chat/sessions/{session_id}/messages"
+CONTENT = "How do I roll back a Kubernetes deployment after a failed release?"
+
+
+def time_print(records: int) -> float:
+    started = time.perf_counter()
+    for i in range(records):
+        print(f"\n[USER INPUT] User John Doe (1) sent: {CONTENT}")
+    return time.perf_counter() - started
+
+
+def time_logger(logger: EventLogger, records: int) -> float:
+    started = time.perf_counter()
+    for i in range(records):
+        logger.info("chat.user_message", ROUTE, user_id="1", session_id="s1", content=CONTENT)
+    return time.perf_counter() - started
+
+
+def report(label: str, seconds: float, records: int):
+    print(f"{label:<36} {seconds / records * 1e9:8.0f} ns/record", file=sys.stderr)
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=50_000)
+    parser.add_argument("--queue", type=int, default=10_000)
+    args = parser.parse_args()
+
+    report("print()", time_print(args.records), args.records)
+
+    # Enqueue first, then let the writer thread catch up, so the two costs
+    # are timed separately
+    logger = EventLogger(max_queue=args.records)
+    report("EventLogger.info() enqueue", time_logger(logger, args.records), args.records)
+    started = time.perf_counter()
+    logger.start()
+    logger.stop(timeout=60)
+    report("writer thread: format + write", time.perf_counter() - started, args.records)
+
+    stalled = EventLogger(max_queue=args.queue)
+    report("EventLogger.info(), queue full", time_logger(stalled, args.records), args.records)
+    stats = stalled.stats()
+    print(f"stalled writer: queued {stats['queued']}, dropped {stats['dropped']}", file=sys.stderr)
+
+    sampled = EventLogger(max_queue=args.records, sample_rates={ROUTE: 0.1})
+    report("EventLogger.info(), 10% sampled", time_logger(sampled, args.records), args.records)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,119 @@
+"""Load test: chat latency while a storm of logins is hashing passwords.
+
+Run from the api directory:
+
+    python benchmarks/bench_login_storm.py
+    python benchmarks/bench_login_storm.py --logins 64 --duration 5
+
+Drives the app in-process over an ASGI transport. Chat messages are sent at
+a fixed rate for ``--duration`` seconds and timed on their own, then again
+while ``--logins`` clients log in over and over: first with password hashing on
+the worker pool, then with the same KDF run inline on the event loop (the
+behaviour this replaced).
+
+The KDF threads still need CPU time, so chat latency only stays flat when
+the machine has a spare core per hashing worker (PASSWORD_HASH_WORKERS).
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# The storm measures password hashing itself, so admission control is off
+os.environ.setdefault("CHAT_RATE_LIMIT", "0")
+os.environ.setdefault("LOGIN_RATE_LIMIT", "0")
+os.environ.setdefault("LOGIN_MAX_IN_FLIGHT", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from passwords import PasswordHasher  # noqa: E402
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def chat_latencies(client, url, headers, duration, interval=0.01):
+    """Send one chat message every ``interval`` seconds
+
+    Latency runs from when each message was due, so time the client spent
+    waiting for a blocked event loop counts against the request.
+    """
+    latencies = []
+    start = time.perf_counter()
+    while True:
+        due = start + len(latencies) * interval
+        if due - start >= duration or time.perf_counter() - start >= duration:
+            return latencies
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        response = await client.post(url, json=f"kubernetes question {len(latencies)}", headers=headers)
+        latencies.append(time.perf_counter() - due)
+        response.raise_for_status()
+
+
+async def login_loop(client, stop: asyncio.Event, counts: dict):
+    while not stop.is_set():
+        response = await client.post("/token", data={"username": "jane@example.com", "password": "password456"})
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+
+
+async def measure(client, url, headers, duration, logins):
+    stop = asyncio.Event()
+    counts: dict = {}
+    storm = [asyncio.create_task(login_loop(client, stop, counts)) for _ in range(logins)]
+    await asyncio.sleep(0.1)  # let the storm build up
+    latencies = await chat_latencies(client, url, headers, duration)
+    stop.set()
+    await asyncio.gather(*storm)
+    return latencies, counts
+
+
+def report(label, latencies, counts=None):
+    line = (
+        f"{label:<28} p50 {statistics.median(latencies) * 1000:7.2f} ms"
+        f"  p95 {percentile(latencies, 0.95) * 1000:7.2f} ms"
+        f"  p99 {percentile(latencies, 0.99) * 1000:7.2f} ms"
+        f"  sent {len(latencies)}"
+    )
+    if counts is not None:
+        line += "  logins " + ", ".join(f"{code}: {count}" for code, count in sorted(counts.items()))
+    print(line)
+
+
+async def run(args):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        login = await client.post("/token", data={"username": "john@example.com", "password": "password123"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        session = (await client.post("/chat/sessions", json="Login storm", headers=headers)).json()
+        url = f"/chat/sessions/{session['id']}/messages"
+
+        report("chat alone", await chat_latencies(client, url, headers, args.duration))
+
+        report("chat + logins (worker pool)", *await measure(client, url, headers, args.duration, args.logins))
+
+        pooled = main.password_hasher
+        main.password_hasher = PasswordHasher(
+            scrypt_n=pooled.scrypt_n, scrypt_r=pooled.scrypt_r, scrypt_p=pooled.scrypt_p,
+            workers=0, max_pending=pooled.max_pending,
+        )
+        report("chat + logins (inline)", *await measure(client, url, headers, args.duration, args.logins))
+        main.password_hasher = pooled
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=32, help="concurrent login clients")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds of chat timed per scenario")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    cli()
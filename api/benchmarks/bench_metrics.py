@@ -0,0 +1,102 @@
+"""Benchmark: overhead of the metrics middleware and hot-path timers.
+
+Run from the api directory:
+
+    python benchmarks/bench_metrics.py
+    python benchmarks/bench_metrics.py --requests 5000
+
+Requests GET /users/me and POST /chat/sessions/{id}/messages in-process over
+an ASGI transport, alternating between the app as shipped and the app with
+MetricsMiddleware taken out of the middleware stack, and reports the median
+latency of each. It also times the primitives the routes call directly
+(Histogram.observe, Counter.inc) and one /metrics render.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import timeit
+
+# Many requests per user by design: no per-user rate limits
+os.environ.setdefault("CHAT_RATE_LIMIT", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from metrics import MetricsMiddleware, Registry  # noqa: E402
+
+
+async def time_requests(client, method, url, headers, requests, **kwargs):
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = await client.request(method, url, headers=headers, **kwargs)
+        samples.append(time.perf_counter() - started)
+        response.raise_for_status()
+    return samples
+
+
+def use_middleware(enabled: bool, middleware: list):
+    main.app.user_middleware = middleware if enabled else [m for m in middleware if m.cls is not MetricsMiddleware]
+    main.app.middleware_stack = None  # rebuilt on the next request
+
+
+async def measure(requests: int, rounds: int):
+    """Median latency per route, with and without the middleware
+
+    The two configurations alternate over ``rounds`` rounds so that drift
+    (GC, growing chat history) affects both alike.
+    """
+    middleware = list(main.app.user_middleware)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        login = await client.post("/token", data={"username": "john@example.com", "password": "password123"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        session = (await client.post("/chat/sessions", json="Metrics benchmark", headers=headers)).json()
+        routes = (
+            ("GET /users/me", "GET", "/users/me", {}),
+            ("POST messages", "POST", f"/chat/sessions/{session['id']}/messages", {"json": "kubernetes rollout"}),
+        )
+        samples = {(label, enabled): [] for label, *_ in routes for enabled in (False, True)}
+        for _ in range(rounds):
+            for enabled in (False, True):
+                use_middleware(enabled, middleware)
+                for label, method, url, kwargs in routes:
+                    await time_requests(client, method, url, headers, 10, **kwargs)  # warm-up
+                    samples[label, enabled] += await time_requests(
+                        client, method, url, headers, requests // rounds, **kwargs
+                    )
+        use_middleware(True, middleware)
+    return {key: statistics.median(values) for key, values in samples.items()}
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000, help="requests per route and configuration")
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    medians = asyncio.run(measure(args.requests, args.rounds))
+    print(f"{'route':<16} {'no middleware':>14} {'with metrics':>14} {'overhead':>10}")
+    for label in dict.fromkeys(label for label, _ in medians):
+        bare, metered = medians[label, False], medians[label, True]
+        print(f"{label:<16} {bare * 1e6:>11.1f} us {metered * 1e6:>11.1f} us {(metered - bare) * 1e6:>7.1f} us")
+
+    registry = Registry()
+    histogram = registry.histogram("bench_seconds", "", ("route",))
+    counter = registry.counter("bench_total", "", ("route", "status"))
+    loops = 200_000
+    observe = timeit.timeit(lambda: histogram.observe(0.0042, "/users/me"), number=loops) / loops
+    inc = timeit.timeit(lambda: counter.inc("/users/me", "200"), number=loops) / loops
+    print(f"Histogram.observe {observe * 1e9:.0f} ns, Counter.inc {inc * 1e9:.0f} ns")
+
+    started = time.perf_counter()
+    body = asyncio.run(main.metrics.render())
+    print(f"/metrics render {(time.perf_counter() - started) * 1000:.2f} ms, {len(body.splitlines())} lines")
+
+
+if __name__ == "__main__":
+    cli()
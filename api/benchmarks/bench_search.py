@@ -0,0 +1,112 @@
+"""Benchmark: /chat/search queries against a large in-memory search index.
+
+Run from the api directory:
+
+    python benchmarks/bench_search.py
+    python benchmarks/bench_search.py --users 100 --messages 10000 --heavy 1000000
+
+Indexes ``--users`` x ``--messages`` synthetic chat messages (1M by default)
+drawn from a Zipf-like vocabulary, so a few words are in most messages and
+most words are rare, plus one user with a long history of ``--heavy``
+messages in sessions of 1000. It then times SearchIndex.search() for an
+ordinary user and for the heavy one with a rare word, a common word, a
+two-word query and a word the user never used, and reports the median and
+p99 latency of each and whether only the newest MAX_CANDIDATES matches
+were ranked. For the heavy user, common words match far more messages than
+that, so their queries show the cost of the cap.
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import SearchIndex  # noqa: E402
+
+HEAVY_SESSION = 1000
+QUERIES = ("term4000", "kubernetes", "kubernetes deployment", "term150 pod", "nosuchword")
+COMMON = ["kubernetes", "deployment", "pod", "the", "how", "do", "i", "my", "is", "failing"]
+
+
+def vocabulary(size: int, rng: random.Random):
+    words = COMMON + [f"term{i}" for i in range(size - len(COMMON))]
+    # Zipf-like weights: the n-th word is 1/n as likely as the first;
+    # cumulative so that choices() doesn't re-add them on every call
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    return words, cum_weights
+
+
+def build(args) -> SearchIndex:
+    rng = random.Random(args.seed)
+    words, cum_weights = vocabulary(args.vocabulary, rng)
+    # session_id -> messages, standing in for the store's history
+    histories = {}
+    index = SearchIndex(lambda session_id, position: histories[session_id][position])
+
+    def add_session(session_id: str, user_id: str, count: int):
+        index.add_session({"id": session_id, "user_id": user_id, "title": f"Session {session_id}"})
+        messages = histories[session_id] = []
+        for i in range(count):
+            content = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(5, 20)))
+            messages.append({
+                "id": f"m{session_id}-{i}",
+                "content": content,
+                "type": "user" if i % 2 == 0 else "bot",
+                "timestamp": "2024-01-01T00:00:00",
+            })
+            index.add_message(session_id, messages[-1], i)
+
+    for user in range(args.users):
+        add_session(f"s{user}", f"u{user}", args.messages)
+    for start in range(0, args.heavy, HEAVY_SESSION):
+        add_session(f"heavy{start // HEAVY_SESSION}", "heavy", min(HEAVY_SESSION, args.heavy - start))
+    return index
+
+
+def time_query(index: SearchIndex, user_id: str, query: str, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        hits, _, truncated = index.search(user_id, query, 20)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99)], len(hits), truncated
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=1000, help="messages per user")
+    parser.add_argument("--heavy", type=int, default=200000, help="messages of the user with a long history, 0 for none")
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    index = build(args)
+    elapsed = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    stats = index.stats()
+    print(
+        f"indexed {stats['documents']:,} messages for {stats['users']:,} users"
+        f" ({args.heavy:,} for the heavy one) in {elapsed:.1f} s"
+        f" ({stats['terms']:,} user terms, {memory / 2 ** 20:.0f} MiB incl. message dicts)"
+    )
+
+    print(f"{'user':<6} {'query':<28} {'p50':>10} {'p99':>10}  hits  truncated")
+    for user_id in ("u0", "heavy") if args.heavy else ("u0",):
+        for query in QUERIES:
+            p50, p99, hits, truncated = time_query(index, user_id, query, args.repeat)
+            print(f"{user_id:<6} {query:<28} {p50 * 1e6:>7.1f} us {p99 * 1e6:>7.1f} us  {hits:>4}  {truncated}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,144 @@
+"""Benchmark: FastJSONResponse listing routes vs. the old validated path.
+
+Run from the api directory:
+
+    python benchmarks/bench_serialization.py
+    python benchmarks/bench_serialization.py --users 50000 --sessions 500
+
+Seeds the in-memory store with ``--users`` users and gives the admin user
+``--sessions`` chat sessions of ``--messages`` messages each plus
+``--credentials`` credentials. Each route is requested in-process over an
+ASGI transport, both from the real app and from a copy of the old route
+bodies: a password_hash-stripping dict comprehension per user, returned as
+plain data for FastAPI to validate against response_model and encode. The
+last column repeats the real app's requests with If-None-Match set to the
+ETag of the first response, which it answers with a bodiless 304.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+from fastapi import Depends, FastAPI  # noqa: E402
+
+import main  # noqa: E402
+import serialization  # noqa: E402
+
+legacy = FastAPI()
+
+
+@legacy.get("/users", response_model=List[main.User])
+async def legacy_users(current_user: dict = Depends(main.get_current_active_user)):
+    users = await main.run_db(main.db.list_users)
+    return [{k: v for k, v in user.items() if k != "password_hash"} for user in users]
+
+
+@legacy.get("/chat/sessions", response_model=List[main.ChatSession])
+async def legacy_sessions(current_user: dict = Depends(main.get_current_active_user)):
+    return await main.run_db(main.db.list_sessions, current_user["id"])
+
+
+@legacy.get("/credentials", response_model=List[main.Credential])
+async def legacy_credentials(current_user: dict = Depends(main.get_current_active_user)):
+    return await main.run_db(main.db.list_credentials, current_user["id"])
+
+
+def seed(users: int, sessions: int, messages: int, credentials: int):
+    now = "2023-07-15T14:30:00"
+    for i in range(users):
+        main.db.add_user({
+            "id": str(uuid.uuid4()),
+            "name": f"Bench User {i}",
+            "email": f"bench{i}@example.com",
+            "role": "User",
+            "status": "Active",
+            "lastActive": now,
+            "password_hash": "x" * 64,
+        })
+    for i in range(sessions):
+        main.db.add_session({
+            "id": str(uuid.uuid4()),
+            "user_id": "1",
+            "title": f"Session {i}",
+            "created_at": now,
+            "updated_at": now,
+            "messages": [
+                {
+                    "id": str(uuid.uuid4()),
+                    "user_id": "1" if j % 2 == 0 else "system",
+                    "content": "How do I roll back a Kubernetes deployment after a failed release? " * 2,
+                    "timestamp": now,
+                    "type": "user" if j % 2 == 0 else "bot",
+                }
+                for j in range(messages)
+            ],
+        })
+    for i in range(credentials):
+        main.db.add_credential({
+            "id": str(uuid.uuid4()),
+            "user_id": "1",
+            "service": "airflow",
+            "details": {"url": f"https://airflow{i}.example.com", "username": "admin"},
+            "created_at": now,
+            "updated_at": now,
+        })
+
+
+async def time_route(app, path: str, headers: dict, requests: int, conditional: bool = False) -> List[float]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        response = await client.get(path, headers=headers)  # warm-up
+        if conditional:
+            headers = {**headers, "If-None-Match": response.headers["ETag"]}
+        samples = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            samples.append(time.perf_counter() - started)
+            if conditional:
+                assert response.status_code == 304, response.status_code
+            else:
+                response.raise_for_status()
+    return samples
+
+
+async def run(args):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        login = await client.post("/token", data={"username": "john@example.com", "password": "password123"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    print(f"{'route':<16} {'before p50':>12} {'after p50':>12}  speedup {'304 p50':>12}")
+    for path in ("/users", "/chat/sessions", "/credentials"):
+        before = statistics.median(await time_route(legacy, path, headers, args.requests))
+        after = statistics.median(await time_route(main.app, path, headers, args.requests))
+        cached = statistics.median(await time_route(main.app, path, headers, args.requests, conditional=True))
+        print(
+            f"{path:<16} {before * 1000:>9.2f} ms {after * 1000:>9.2f} ms  {before / after:>6.1f}x"
+            f" {cached * 1000:>9.2f} ms"
+        )
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--credentials", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=30)
+    args = parser.parse_args()
+
+    seed(args.users, args.sessions, args.messages, args.credentials)
+    print(f"encoder: {'orjson' if serialization.orjson else 'json (orjson not installed)'}")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    cli()
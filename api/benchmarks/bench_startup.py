@@ -0,0 +1,163 @@
+"""Benchmark: store startup time vs. dataset size, snapshot restore vs. full replay.
+
+Run from the api directory:
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --sizes 10000,100000 --tail 5000
+
+For each dataset size (total chat messages, 1000 per session, spread over
+``--users`` users) a subprocess fills an in-memory store that journals its
+writes, writes a snapshot, then makes ``--tail`` more writes and exits
+without another snapshot, like a crashed process. Fresh subprocesses then
+start the store two ways and report how long it takes:
+
+- replay: an empty store replaying every write from a journal, which is
+  what booting from a write log alone costs
+- snapshot: SnapshotManager.open(), mapping the snapshot and replaying only
+  the tail
+
+and, for the snapshot restore, how long the first requests take: the
+newest page of 50 messages in 20 sessions, one page from each session's
+oldest messages, and a search for each of 20 users (then the same searches
+again, with the users' postings decoded). Those decode the parts of the
+snapshot they touch. Also reported: the snapshot's size and the time to
+write it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from snapshot import JOURNALED, SnapshotManager, read_journal  # noqa: E402
+from store import InMemoryStore  # noqa: E402
+
+MESSAGES_PER_SESSION = 1000
+WORDS = (
+    "kubernetes deployment rollback revision airflow scheduler dag queued task mongodb replica "
+    "primary pod crashloopbackoff image push container yaml helm chart service ingress"
+).split()
+
+
+def fill(store: InMemoryStore, messages: int, users: int, rng: random.Random, prefix: str = ""):
+    for u in range(users):
+        store.add_user({
+            "id": f"{prefix}u{u}", "name": f"User {prefix}{u}", "email": f"{prefix}u{u}@example.com",
+            "role": "User", "status": "Active", "lastActive": "2024-01-01T00:00:00", "password_hash": "x" * 90,
+        })
+    for s in range(max(1, messages // MESSAGES_PER_SESSION)):
+        session_id, user_id = f"{prefix}s{s}", f"{prefix}u{s % users}"
+        store.add_session({
+            "id": session_id, "user_id": user_id, "title": f"Session {s}",
+            "created_at": "2024-01-01T00:00:00", "updated_at": "2024-01-01T00:00:00", "messages": [],
+        })
+        for i in range(min(messages, MESSAGES_PER_SESSION)):
+            store.add_message(session_id, {
+                "id": f"{session_id}-{i}", "user_id": user_id if i % 2 == 0 else "system",
+                "content": " ".join(rng.choices(WORDS, k=12)),
+                "timestamp": f"2024-01-02T{i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d}.{s:06d}",
+                "type": "user" if i % 2 == 0 else "bot",
+            })
+
+
+def build(directory: str, messages: int, users: int, tail: int) -> dict:
+    rng = random.Random(messages)
+    manager = SnapshotManager(os.path.join(directory, "state.snap"), interval=0)
+    store = manager.open()
+    fill(store, messages, users, rng)
+    # Keep the whole history as one journal for the replay timing
+    shutil.copy(manager.journal.path, os.path.join(directory, "full.journal"))
+    started = time.perf_counter()
+    asyncio.run(manager.save())
+    result = {"save_seconds": time.perf_counter() - started, "bytes": os.path.getsize(manager.path)}
+    fill(store, tail, 1, rng, prefix="tail-")
+    return result
+
+
+def replay(directory: str) -> dict:
+    started = time.perf_counter()
+    store = InMemoryStore()
+    for method, args in read_journal(os.path.join(directory, "full.journal")):
+        assert method in JOURNALED
+        getattr(store, method)(*args)
+    return {"seconds": time.perf_counter() - started, "messages": store.count_messages()}
+
+
+def restore(directory: str, users: int) -> dict:
+    started = time.perf_counter()
+    manager = SnapshotManager(os.path.join(directory, "state.snap"), interval=0)
+    store = manager.open()
+    result = {"seconds": time.perf_counter() - started, "replayed": len(manager.replayed)}
+
+    sessions = [session_id for session_id in list(store._sessions) if not session_id.startswith("tail-")][:20]
+    started = time.perf_counter()
+    for session_id in sessions:
+        store.list_messages(session_id, 50)
+    result["newest_pages"] = time.perf_counter() - started
+    started = time.perf_counter()
+    for session_id in sessions:
+        store.list_messages(session_id, 50, after=f"{session_id}-0")
+    result["oldest_pages"] = time.perf_counter() - started
+    for key in ("searches", "searches_again"):
+        started = time.perf_counter()
+        for u in range(min(users, 20)):
+            store.search_messages(f"u{u}", "kubernetes rollback", 20)
+        result[key] = time.perf_counter() - started
+    return result
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated message counts")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--tail", type=int, default=1000, help="messages written after the snapshot")
+    parser.add_argument("--mode", choices=("build", "replay", "restore"), help=argparse.SUPPRESS)
+    parser.add_argument("--dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        size = int(args.sizes)
+        if args.mode == "build":
+            result = build(args.dir, size, args.users, args.tail)
+        elif args.mode == "replay":
+            result = replay(args.dir)
+        else:
+            result = restore(args.dir, args.users)
+        print(json.dumps(result))
+        return
+
+    def child(mode: str, directory: str, size: int) -> dict:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--mode", mode, "--dir", directory, "--sizes", str(size),
+             "--users", str(args.users), "--tail", str(args.tail)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        return json.loads(output)
+
+    print(f"{'messages':>10} {'snapshot':>10} {'write':>8} {'replay':>9} {'restore':>9} {'20 newest':>10} {'20 oldest':>10} {'20 searches':>12} {'again':>9}")
+    for size in (int(value) for value in args.sizes.split(",")):
+        directory = tempfile.mkdtemp(prefix="bench-startup-")
+        try:
+            built = child("build", directory, size)
+            replayed = child("replay", directory, size)
+            restored = child("restore", directory, size)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        print(
+            f"{size:>10,} {built['bytes'] / 2 ** 20:>7.1f} MiB {built['save_seconds']:>7.2f}s"
+            f" {replayed['seconds']:>8.3f}s {restored['seconds']:>8.3f}s"
+            f" {restored['newest_pages'] * 1000:>7.1f} ms {restored['oldest_pages'] * 1000:>7.1f} ms"
+            f" {restored['searches'] * 1000:>9.1f} ms {restored['searches_again'] * 1000:>6.1f} ms"
+        )
+    print(f"restore includes replaying the {args.tail}-message tail journaled after the snapshot")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,128 @@
+"""Benchmark: indexed InMemoryStore lookups vs. the old linear list scans.
+
+Run from the api directory:
+
+    python benchmarks/bench_store.py
+    python benchmarks/bench_store.py --sizes 10000 100000
+
+For each dataset size the script builds the same users, chat sessions and
+credentials both as plain lists (the old mock_* layout) and in an
+InMemoryStore, then times the lookups the routes perform.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store import InMemoryStore  # noqa: E402
+
+
+def build_records(n: int):
+    users, sessions, credentials = [], [], []
+    for i in range(n):
+        uid = str(i)
+        users.append({
+            "id": uid,
+            "name": f"User {i}",
+            "email": f"user{i}@example.com",
+            "role": "User",
+            "status": "Active",
+            "lastActive": "2023-07-15T14:30:00",
+            "password_hash": "x",
+        })
+        sessions.append({
+            "id": f"s{i}",
+            "user_id": uid,
+            "title": "Session",
+            "created_at": "2023-07-15T14:30:00",
+            "updated_at": "2023-07-15T14:30:00",
+            "messages": [],
+        })
+        credentials.append({
+            "id": f"c{i}",
+            "user_id": uid,
+            "service": "airflow",
+            "details": {},
+            "created_at": "2023-07-15T14:30:00",
+            "updated_at": "2023-07-15T14:30:00",
+        })
+    return users, sessions, credentials
+
+
+def time_per_op(fn, keys) -> float:
+    start = time.perf_counter()
+    for key in keys:
+        fn(key)
+    return (time.perf_counter() - start) / len(keys)
+
+
+def scan_user_by_email(users):
+    def lookup(email):
+        for user in users:
+            if user["email"] == email:
+                return user
+        return None
+    return lookup
+
+
+def scan_session_by_id(sessions):
+    def lookup(session_id):
+        for session in sessions:
+            if session["id"] == session_id:
+                return session
+        return None
+    return lookup
+
+
+def scan_credentials_by_user(credentials):
+    def lookup(user_id):
+        return [cred for cred in credentials if cred["user_id"] == user_id]
+    return lookup
+
+
+def run(n: int, scan_ops: int, index_ops: int):
+    users, sessions, credentials = build_records(n)
+    db = InMemoryStore()
+    for user in users:
+        db.add_user(user)
+    for session in sessions:
+        db.add_session(session)
+    for credential in credentials:
+        db.add_credential(credential)
+
+    rng = random.Random(n)
+    ids = [str(rng.randrange(n)) for _ in range(index_ops)]
+    emails = [f"user{i}@example.com" for i in ids]
+    session_ids = [f"s{i}" for i in ids]
+
+    cases = [
+        ("user by email", scan_user_by_email(users), db.get_user_by_email, emails),
+        ("session by id", scan_session_by_id(sessions), db.get_session, session_ids),
+        ("credentials by user", scan_credentials_by_user(credentials), db.list_credentials, ids),
+    ]
+    for name, scan, indexed, keys in cases:
+        scan_s = time_per_op(scan, keys[:scan_ops])
+        index_s = time_per_op(indexed, keys)
+        print(
+            f"{n:>9,}  {name:<20} scan {scan_s * 1e6:>12.2f} us"
+            f"  indexed {index_s * 1e6:>8.3f} us  speedup {scan_s / index_s:>12,.0f}x"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--scan-ops", type=int, default=50, help="lookups timed for the list scans")
+    parser.add_argument("--index-ops", type=int, default=100_000, help="lookups timed for the indexes")
+    args = parser.parse_args()
+
+    print(f"{'records':>9}  {'lookup':<20} per-op latency")
+    for n in args.sizes:
+        run(n, args.scan_ops, args.index_ops)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Benchmark: time to first byte of streamed bot replies vs. the blocking POST.
+
+Run from the api directory:
+
+    python benchmarks/bench_streaming.py
+    python benchmarks/bench_streaming.py --tokens 100 --delay 0.01
+
+Starts the API on a local port with a fake responder that produces
+``--tokens`` tokens, ``--delay`` seconds apart. It then compares:
+
+- POST /chat/sessions/{id}/messages, which answers once the reply is done;
+- POST /chat/sessions/{id}/messages/stream, which sends chunks as they come,
+  while a second client listens on GET /chat/sessions/{id}/events.
+
+Finally it checks that a subscriber that never reads is dropped without
+slowing publishers down.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+# Many requests per user by design: no per-user rate limits
+os.environ.setdefault("CHAT_RATE_LIMIT", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+import main  # noqa: E402
+from streaming import SessionBroadcaster  # noqa: E402
+
+
+def slow_responder(tokens: int, delay: float):
+    async def respond(user_input: str):
+        for i in range(tokens):
+            await asyncio.sleep(delay)
+            yield f"token{i} "
+    return respond
+
+
+def start_server() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+
+async def read_events(response: httpx.Response, started: float, until_id=None):
+    """Collect (seconds since start, event, data) until the reply completes"""
+    events, event = [], None
+    async for line in response.aiter_lines():
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            data = json.loads(line[len("data: "):])
+            events.append((time.perf_counter() - started, event, data))
+            if event == "bot_message" and (until_id is None or data["id"] == until_id):
+                break
+    return events
+
+
+async def run(base_url: str, tokens: int):
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        login = await client.post("/token", data={"username": "john@example.com", "password": "password123"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        session = (await client.post("/chat/sessions", json="Streaming benchmark", headers=headers)).json()
+        messages_url = f"/chat/sessions/{session['id']}/messages"
+
+        started = time.perf_counter()
+        await client.post(messages_url, json="hello", headers=headers)
+        blocking_total = time.perf_counter() - started
+
+        async with client.stream("GET", f"/chat/sessions/{session['id']}/events", headers=headers) as listener:
+            started = time.perf_counter()
+            async with client.stream("POST", messages_url + "/stream", json="hello", headers=headers) as stream:
+                listener_task = asyncio.create_task(read_events(listener, started))
+                sender_events = await read_events(stream, started)
+            listener_events = await asyncio.wait_for(listener_task, 10)
+
+    first_chunk = next(t for t, event, _ in sender_events if event == "chunk")
+    stream_total = sender_events[-1][0]
+    listener_chunks = sum(1 for _, event, _ in listener_events if event == "chunk")
+    print(f"blocking POST     total {blocking_total * 1000:8.1f} ms")
+    print(f"streaming POST    first chunk {first_chunk * 1000:8.1f} ms   total {stream_total * 1000:8.1f} ms")
+    print(f"events listener   received {listener_chunks}/{tokens} chunks and the stored bot message: "
+          f"{listener_events[-1][1] == 'bot_message'}")
+
+
+async def check_backpressure(events: int):
+    broadcaster = SessionBroadcaster(queue_size=64)
+    stalled = broadcaster.subscribe("s")
+    reader = broadcaster.subscribe("s")
+    received = 0
+
+    async def drain():
+        nonlocal received
+        while received < events:
+            await reader.get()
+            received += 1
+
+    drain_task = asyncio.create_task(drain())
+    started = time.perf_counter()
+    for i in range(events):
+        broadcaster.publish("s", "chunk", {"id": "m", "delta": str(i)})
+        if i % 32 == 0:
+            await asyncio.sleep(0)
+    publish_time = time.perf_counter() - started
+    await drain_task
+    print(f"backpressure      {events} events published in {publish_time * 1000:.1f} ms; "
+          f"stalled subscriber dropped: {stalled.overflowed}; active reader received {received}")
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    main.reply_responder = slow_responder(args.tokens, args.delay)
+    base_url = start_server()
+    asyncio.run(run(base_url, args.tokens))
+    asyncio.run(check_backpressure(10_000))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,291 @@
+"""Load suite: throughput and latency of the main API scenarios.
+
+Run from the api directory:
+
+    python benchmarks/bench_suite.py
+    python benchmarks/bench_suite.py --users 50000 --requests 2000 --concurrency 32
+    python benchmarks/bench_suite.py --scenarios chat_send,admin_users --output results.json
+    python benchmarks/bench_suite.py --save-baseline benchmarks/baseline.json
+    python benchmarks/bench_suite.py --baseline benchmarks/baseline.json --threshold 0.15
+
+Drives main.app in-process over an ASGI transport (no sockets), with the
+app's startup and shutdown hooks run around the scenarios. The store
+(STORAGE_BACKEND as usual) is first seeded with ``--users`` users, and the
+admin gets ``--sessions`` chat sessions of ``--messages`` messages and
+``--credentials`` credentials. Generated data depends only on ``--seed``.
+
+Scenarios:
+
+- login: POST /token, cycling through the seeded users
+- chat_send: POST /chat/sessions/{id}/messages, one session per client
+- admin_users: GET /users as the admin
+- sessions: GET /chat/sessions for the admin
+- credential_crud: POST /credentials followed by DELETE of the new credential
+
+Each scenario runs ``--requests`` operations from ``--concurrency`` clients
+and reports throughput and p50/p95/p99 latency. With ``--baseline``, a
+scenario fails if its throughput drops or its p95 latency rises by more than
+``--threshold`` (a fraction) against the baseline; the exit status is 1 if
+any scenario fails. Baselines are machine specific: save one on the machine
+you compare on.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+# The suite drives a few users hard at high concurrency, and a refused
+# request fails it, so admission limits are off unless set explicitly
+os.environ.setdefault("CHAT_RATE_LIMIT", "0")
+os.environ.setdefault("LOGIN_RATE_LIMIT", "0")
+os.environ.setdefault("LOGIN_MAX_IN_FLIGHT", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+
+SCENARIOS = ("login", "chat_send", "admin_users", "sessions", "credential_crud")
+PASSWORD = "bench-password"
+QUESTIONS = (
+    "How do I roll back a Kubernetes deployment?",
+    "Why is my Airflow DAG stuck in queued?",
+    "What does a Jenkins pipeline stage do?",
+    "How can I monitor Prometheus targets?",
+    "Where are the docker build logs?",
+    "Can you explain this terraform plan?",
+)
+
+
+# Seeding
+def seed(args) -> list:
+    """Fill the store and return the emails of the seeded users"""
+    rng = random.Random(args.seed)
+    # One shared hash: hashing every seeded user would take minutes
+    password_hash = main.password_hasher.hash_sync(PASSWORD)
+    start = datetime(2024, 1, 1)
+    emails = []
+    for i in range(args.users):
+        email = f"bench{i}@example.com"
+        main.db.add_user({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "name": f"Bench User {i}",
+            "email": email,
+            "role": "User",
+            "status": "Active",
+            "lastActive": (start + timedelta(minutes=rng.randrange(60 * 24 * 30))).isoformat(),
+            "password_hash": password_hash,
+        })
+        emails.append(email)
+
+    for i in range(args.sessions):
+        created = start + timedelta(minutes=rng.randrange(60 * 24 * 30))
+        main.db.add_session({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "user_id": "1",
+            "title": f"Bench session {i}",
+            "created_at": created.isoformat(),
+            "updated_at": (created + timedelta(minutes=args.messages)).isoformat(),
+            "messages": [
+                {
+                    "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                    "user_id": "1" if j % 2 == 0 else "system",
+                    "content": rng.choice(QUESTIONS),
+                    "timestamp": (created + timedelta(minutes=j)).isoformat(),
+                    "type": "user" if j % 2 == 0 else "bot",
+                }
+                for j in range(args.messages)
+            ],
+        })
+
+    for i in range(args.credentials):
+        main.db.add_credential({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "user_id": "1",
+            "service": rng.choice(("airflow", "jenkins", "kubernetes")),
+            "details": {"url": f"https://service{i}.example.com", "username": "admin"},
+            "created_at": start.isoformat(),
+            "updated_at": start.isoformat(),
+        })
+    return emails
+
+
+# Scenarios: each returns an async operation taking (client, client index, iteration)
+async def login_admin(client) -> dict:
+    login = await client.post("/token", data={"username": "john@example.com", "password": "password123"})
+    login.raise_for_status()
+    return {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+
+async def prepare(name: str, client, headers: dict, emails: list, concurrency: int):
+    if name == "login":
+        accounts = emails or ["john@example.com"]
+
+        async def login(worker, i):
+            email = accounts[(worker + i * concurrency) % len(accounts)]
+            password = PASSWORD if emails else "password123"
+            (await client.post("/token", data={"username": email, "password": password})).raise_for_status()
+        return login
+
+    if name == "chat_send":
+        sessions = []
+        for worker in range(concurrency):
+            response = await client.post("/chat/sessions", json=f"Load client {worker}", headers=headers)
+            sessions.append(response.json()["id"])
+
+        async def send(worker, i):
+            url = f"/chat/sessions/{sessions[worker]}/messages"
+            (await client.post(url, json=QUESTIONS[i % len(QUESTIONS)], headers=headers)).raise_for_status()
+        return send
+
+    if name == "admin_users":
+        async def list_users(worker, i):
+            (await client.get("/users", headers=headers)).raise_for_status()
+        return list_users
+
+    if name == "sessions":
+        async def list_sessions(worker, i):
+            (await client.get("/chat/sessions", headers=headers)).raise_for_status()
+        return list_sessions
+
+    if name == "credential_crud":
+        async def crud(worker, i):
+            created = await client.post("/credentials", json={
+                "service": "jenkins",
+                "details": {"url": f"https://ci{worker}.example.com", "username": f"load{i}"},
+            }, headers=headers)
+            created.raise_for_status()
+            (await client.delete(f"/credentials/{created.json()['id']}", headers=headers)).raise_for_status()
+        return crud
+
+    raise ValueError(f"Unknown scenario {name!r}")
+
+
+async def run_scenario(operation, requests: int, concurrency: int, warmup: int) -> dict:
+    async def client_loop(worker: int, count: int, latencies: list):
+        for i in range(count):
+            started = time.perf_counter()
+            await operation(worker, i)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(client_loop(worker, warmup, []) for worker in range(concurrency)))
+
+    latencies: list = []
+    per_client = [requests // concurrency + (worker < requests % concurrency) for worker in range(concurrency)]
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop(worker, count, latencies) for worker, count in enumerate(per_client)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "seconds": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+# Baseline comparison
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Return a list of (scenario, reason) for every regression"""
+    failures = []
+    for name, current in results["scenarios"].items():
+        reference = baseline.get("scenarios", {}).get(name)
+        if reference is None:
+            continue
+        if current["throughput_rps"] < reference["throughput_rps"] * (1 - threshold):
+            failures.append((name, f"throughput {current['throughput_rps']:.1f}/s vs. {reference['throughput_rps']:.1f}/s"))
+        if current["p95_ms"] > reference["p95_ms"] * (1 + threshold):
+            failures.append((name, f"p95 {current['p95_ms']:.2f} ms vs. {reference['p95_ms']:.2f} ms"))
+    return failures
+
+
+async def run(args, scenarios) -> dict:
+    # Keep the app's log lines out of the report
+    main.logger.stream = open(os.devnull, "w")
+    emails = seed(args)
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "storage_backend": main.STORAGE_BACKEND,
+            "scale": {key: getattr(args, key) for key in ("users", "sessions", "messages", "credentials", "seed")},
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "scenarios": {},
+    }
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            headers = await login_admin(client)
+            for name in scenarios:
+                operation = await prepare(name, client, headers, emails, args.concurrency)
+                # Logins run the password KDF, so they get fewer iterations
+                requests = max(args.concurrency, args.requests // 10) if name == "login" else args.requests
+                result = await run_scenario(operation, requests, args.concurrency, args.warmup)
+                results["scenarios"][name] = result
+                print(
+                    f"{name:<16} {result['throughput_rps']:>10.1f} req/s"
+                    f"  p50 {result['p50_ms']:>8.2f} ms  p95 {result['p95_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms"
+                )
+    return results
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--credentials", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=1000, help="operations per scenario (login runs a tenth)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5, help="untimed operations per client before each scenario")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--save-baseline", help="write the results as the new baseline to this file")
+    parser.add_argument("--baseline", help="compare against this baseline file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression as a fraction (default 0.2)")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = asyncio.run(run(args, scenarios))
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare(results, json.load(f), args.threshold)
+        for name, reason in failures:
+            print(f"REGRESSION {name}: {reason}")
+        if failures:
+            sys.exit(1)
+        print(f"no regressions beyond {args.threshold:.0%} of {args.baseline}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,136 @@
+"""Check: the SQLite store's shared analytics report like the in-memory engine.
+
+Run from the api directory:
+
+    python benchmarks/check_analytics.py
+    python benchmarks/check_analytics.py --sessions 400 --days 30
+
+Writes the same users, sessions and messages, spread over the last
+``--days`` days, to an AnalyticsEngine and to a SQLiteStore in a temporary
+directory, and checks that StoreAnalytics reports the same figures for
+several ranges:
+
+- as counted with each write;
+- after AnalyticsEngine.from_records() and SQLiteStore.rebuild_analytics();
+- after a second store opened on the same database adds more messages, as
+  another worker would;
+- on a database whose buckets were dropped, which is backfilled on open.
+
+Exits with status 1 if any check fails.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import DAY, AnalyticsEngine, StoreAnalytics  # noqa: E402
+from sqlite_store import SQLiteStore  # noqa: E402
+
+RANGES = (1, 7, 30)
+
+
+def local(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+def run(args, directory: str) -> list:
+    failures = []
+
+    def expect(condition: bool, message: str):
+        print(("ok      " if condition else "FAILED  ") + message)
+        if not condition:
+            failures.append(message)
+
+    def compare(label: str, engine: AnalyticsEngine, store: SQLiteStore):
+        now = time.time()
+        differ = [days for days in RANGES if engine.report(days, now) != StoreAnalytics(store).report(days, now)]
+        expect(not differ, f"{label}: same report" + (f", except for {differ} days" if differ else ""))
+
+    rng = random.Random(args.seed)
+    now = time.time()
+    path = os.path.join(directory, "analytics.db")
+    engine, store = AnalyticsEngine(), SQLiteStore(path)
+    users = [
+        {
+            "id": f"u{u}", "name": f"User {u}", "email": f"u{u}@example.com", "role": "User", "status": "Active",
+            "lastActive": local(now - rng.uniform(0, args.days * DAY)), "password_hash": "-",
+        }
+        for u in range(args.users)
+    ]
+    for user in users:
+        store.add_user(user)
+    sessions = []
+
+    def add_messages(session: dict, store: SQLiteStore, count: int):
+        for _ in range(count):
+            # Mostly in order, sometimes earlier than the session's latest
+            sent = min(now, session["last"] + rng.uniform(-600, 3600))
+            session["last"] = max(session["last"], sent)
+            message = {
+                "id": f"m{rng.getrandbits(64):x}", "user_id": session["user_id"], "content": "kubernetes pod",
+                "timestamp": local(sent), "type": rng.choice(("user", "bot")),
+            }
+            store.add_message(session["id"], message)
+            engine.record_message(session["id"], message)
+            # The app marks the sender active as it authenticates them
+            user = users[int(session["user_id"][1:])]
+            if message["type"] == "user" and message["timestamp"] > user["lastActive"]:
+                user["lastActive"] = message["timestamp"]
+                store.update_last_active({user["id"]: user["lastActive"]})
+
+    for s in range(args.sessions):
+        created = now - rng.uniform(0, args.days * DAY)
+        session = {
+            "id": f"s{s}", "user_id": f"u{s % args.users}", "title": "t",
+            "created_at": local(created), "updated_at": local(created), "messages": [], "last": created,
+        }
+        record = {key: value for key, value in session.items() if key != "last"}
+        store.add_session(record)
+        engine.record_session(record)
+        add_messages(session, store, rng.randint(0, 6))
+        sessions.append(session)
+    for user in users:
+        engine.record_activity(user["id"], datetime.fromisoformat(user["lastActive"]).timestamp())
+    compare("counted with each write", engine, store)
+
+    engine = AnalyticsEngine.from_records(store.list_users(), store.iter_sessions())
+    store.rebuild_analytics()
+    compare("rebuilt from the records", engine, store)
+
+    other = SQLiteStore(path)
+    for session in rng.sample(sessions, len(sessions) // 4):
+        add_messages(session, other, rng.randint(1, 4))
+    compare("after writes through another store", engine, store)
+    other.close()
+
+    with store._connection() as conn, conn:
+        conn.execute("DROP TABLE analytics_buckets")
+    store.close()
+    store = SQLiteStore(path)
+    compare("backfilled on open", engine, store)
+    store.close()
+    return failures
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--days", type=int, default=20, help="days the records are spread over")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        failures = run(args, directory)
+    if failures:
+        sys.exit(1)
+    print("all checks passed")
+
+
+if __name__ == "__main__":
+    cli()
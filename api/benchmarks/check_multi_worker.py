@@ -0,0 +1,181 @@
+"""Check: several workers sharing one SQLite store and signing key.
+
+Run from the api directory:
+
+    python benchmarks/check_multi_worker.py
+    python benchmarks/check_multi_worker.py --workers 4 --requests 200
+
+Starts ``run.py --workers N`` against a temporary database and key file, then
+sends every request on a fresh connection so they spread across the workers:
+
+- GET /health reports which worker answered;
+- a user registered through one worker logs in, and the token works on all;
+- chat sessions and messages written through one worker are read back
+  through the others;
+- every worker returns the same /admin/analytics report and ETag, counting
+  the messages posted through all of them, also after a rebuild;
+- after one worker is killed the rest keep serving;
+- after the whole server restarts, the old token and data are still valid.
+
+Exits non-zero on the first failed check.
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers: int, port: int, env: dict) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, "run.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        cwd=API_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.kill()
+    sys.exit("server did not start")
+
+
+def stop_server(server: subprocess.Popen):
+    server.send_signal(signal.SIGINT)
+    server.wait(timeout=30)
+
+
+def request(base_url: str, method: str, path: str, **kwargs) -> httpx.Response:
+    # A new client per request means a new connection, so the kernel hands
+    # each one to whichever worker accepts first
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        return client.request(method, path, **kwargs)
+
+
+def check(condition: bool, message: str):
+    print(f"{'ok  ' if condition else 'FAIL'} {message}")
+    if not condition:
+        sys.exit(1)
+
+
+def spread(base_url: str, requests: int) -> Counter:
+    return Counter(request(base_url, "GET", "/health").json()["worker"] for _ in range(requests))
+
+
+def run(args, tmp: str):
+    env = dict(
+        os.environ,
+        STORAGE_BACKEND="sqlite",
+        SQLITE_PATH=os.path.join(tmp, "bot.db"),
+        SECRET_KEY_FILE=os.path.join(tmp, "bot.key"),
+        ACTIVITY_FLUSH_INTERVAL="1",
+        # --messages may exceed a user's chat burst
+        CHAT_RATE_LIMIT="0",
+    )
+    env.pop("SECRET_KEY", None)
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    server = start_server(args.workers, port, env)
+    try:
+        workers = spread(base_url, args.requests)
+        check(len(workers) > 1, f"{args.requests} connections answered by {len(workers)} workers: {dict(workers)}")
+
+        registered = request(base_url, "POST", "/register", json={
+            "name": "Multi Worker", "email": "multi@example.com", "role": "User",
+            "status": "Active", "password": "multiworker",
+        })
+        check(registered.status_code == 201, "register")
+        login = request(base_url, "POST", "/token", data={"username": "multi@example.com", "password": "multiworker"})
+        check(login.status_code == 200, "login as the new user")
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        statuses = Counter(request(base_url, "GET", "/users/me", headers=headers).status_code for _ in range(args.requests))
+        check(statuses == Counter({200: args.requests}), f"token accepted on every connection: {dict(statuses)}")
+
+        session = request(base_url, "POST", "/chat/sessions", json="Shared state", headers=headers).json()
+        messages_url = f"/chat/sessions/{session['id']}/messages"
+        statuses = Counter(
+            request(base_url, "POST", messages_url, json=f"kubernetes question {i}", headers=headers).status_code
+            for i in range(args.messages)
+        )
+        check(statuses == Counter({200: args.messages}), f"messages posted: {dict(statuses)}")
+        counts = Counter(
+            request(base_url, "GET", f"/chat/sessions/{session['id']}", headers=headers).json()["message_count"]
+            for _ in range(args.requests // 4)
+        )
+        check(counts == Counter({args.messages * 2: args.requests // 4}), f"every worker sees all messages: {dict(counts)}")
+
+        admin = request(base_url, "POST", "/token", data={"username": "john@example.com", "password": "password123"})
+        admin_headers = {"Authorization": f"Bearer {admin.json()['access_token']}"}
+
+        def analytics_agree(label: str):
+            # Let the admin's own activity reach the store first
+            request(base_url, "GET", "/admin/analytics", headers=admin_headers)
+            time.sleep(1.5)
+            reports = [
+                request(base_url, "GET", "/admin/analytics", headers=admin_headers) for _ in range(args.requests // 4)
+            ]
+            answers = {(report.headers["etag"], report.content) for report in reports}
+            totals = {report.json()["user_activity"]["total_messages"] for report in reports}
+            check(
+                len(answers) == 1 and min(totals) >= args.messages * 2,
+                f"{label}: {len(answers)} distinct report(s), total_messages {sorted(totals)}",
+            )
+
+        analytics_agree("analytics")
+        rebuilt = request(base_url, "POST", "/admin/analytics/rebuild", headers=admin_headers)
+        check(rebuilt.status_code == 200, "rebuild analytics")
+        analytics_agree("analytics after a rebuild")
+
+        victim = next(iter(workers))
+        os.kill(victim, signal.SIGKILL)
+        time.sleep(1)
+        statuses = Counter(request(base_url, "GET", "/users/me", headers=headers).status_code for _ in range(args.requests))
+        check(statuses == Counter({200: args.requests}), f"killed worker {victim}, others keep serving: {dict(statuses)}")
+        survivors = spread(base_url, args.requests)
+        print(f"     workers now: {dict(survivors)}")
+    finally:
+        stop_server(server)
+
+    server = start_server(args.workers, port, env)
+    try:
+        me = request(base_url, "GET", "/users/me", headers=headers)
+        check(me.status_code == 200, "token issued before the restart still works")
+        restored = request(base_url, "GET", f"/chat/sessions/{session['id']}", headers=headers).json()
+        check(restored["message_count"] == args.messages * 2, "chat history survived the restart")
+    finally:
+        stop_server(server)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=60, help="requests per spread check")
+    parser.add_argument("--messages", type=int, default=10)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="devops-bot-") as tmp:
+        run(args, tmp)
+
+
+if __name__ == "__main__":
+    main()
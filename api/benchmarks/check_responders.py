@@ -0,0 +1,283 @@
+"""Check: the bot reply pipeline against a slow local stand-in reply service.
+
+Run from the api directory:
+
+    python benchmarks/check_responders.py
+    python benchmarks/check_responders.py --tokens 40 --delay 0.02
+
+Starts an HTTP server on localhost standing in for a model server: it
+streams a reply of ``--tokens`` words, one every ``--delay`` seconds, and
+tracks how many requests it is serving at once. A ResponderPipeline built
+like the app's (keyword rules, the service, keyword fallback) is then
+checked for:
+
+- keyword matches answered without calling the service;
+- other messages streamed from the service, and repeats (in any case or
+  punctuation) answered from the reply cache;
+- a service slower than the timeout giving way to the fallback reply;
+- a reply that streams for longer than the timeout arriving whole, and one
+  that stalls partway raising ReplyInterrupted with what it sent;
+- no more than ``max_concurrent`` service calls at once under a burst of
+  distinct messages;
+- a CPU-bound backend on a process pool leaving the event loop responsive,
+  compared with the same function called inline;
+- a streamed reply whose backend fails sending an "error" event and
+  logging the exception, with none left unretrieved in the event loop.
+
+Exits with status 1 if any check fails.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from responders import FunctionBackend, HTTPBackend, PoolBackend, ReplyInterrupted, ResponderPipeline  # noqa: E402
+
+
+class StandInService:
+    """A local reply service: 204 for "decline", stalls on "stall" (after a few words on "halfway"), else streams words"""
+
+    def __init__(self, tokens: int, delay: float):
+        self.tokens = tokens
+        self.delay = delay
+        self.requests = 0
+        self.active = 0
+        self.peak = 0
+        self.server = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/reply"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                length = 0
+                while (line := (await reader.readline()).strip()):
+                    name, _, value = line.decode().partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                message = json.loads(await reader.readexactly(length))["message"]
+                await self._reply(reader, writer, message)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _reply(self, reader, writer, message: str):
+        self.requests += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            if "decline" in message:
+                writer.write(b"HTTP/1.1 204 No Content\r\n\r\n")
+                return
+            if "stall" in message:
+                await reader.read()  # until the client gives up and hangs up
+                return
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nTransfer-Encoding: chunked\r\n\r\n")
+            for i in range(self.tokens):
+                if i == 3 and "halfway" in message:
+                    await reader.read()
+                    return
+                await asyncio.sleep(self.delay)
+                word = f"word{i} ".encode()
+                writer.write(b"%x\r\n%s\r\n" % (len(word), word))
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+        finally:
+            self.active -= 1
+
+
+def cpu_reply(text: str) -> str:
+    """A CPU-bound stand-in backend: about 0.2 s of pure Python work"""
+    total = 0
+    for i in range(3_000_000):
+        total += i * i % 7
+    return f"Computed {total} for {text}"
+
+
+async def timed(pipeline: ResponderPipeline, text: str):
+    """(reply, seconds to first chunk, seconds in total)"""
+    started = time.perf_counter()
+    first = None
+    chunks = []
+    async for chunk in pipeline(text):
+        if first is None:
+            first = time.perf_counter() - started
+        chunks.append(chunk)
+    return "".join(chunks), first, time.perf_counter() - started
+
+
+async def loop_lag(start) -> float:
+    """Longest stall of a 10 ms ticker on the event loop while start() runs"""
+    worst = 0.0
+    done = asyncio.Event()
+
+    async def ticker():
+        nonlocal worst
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            worst = max(worst, time.perf_counter() - started - 0.01)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.02)
+    await start()
+    done.set()
+    await task
+    return worst
+
+
+def build(url: str, **options) -> ResponderPipeline:
+    return ResponderPipeline([
+        FunctionBackend("intents", main.match_intent),
+        HTTPBackend("service", url),
+        FunctionBackend("fallback", main.fallback_reply, cacheable=False),
+    ], **options)
+
+
+async def run(args) -> list:
+    failures = []
+
+    def expect(condition: bool, message: str):
+        print(("ok      " if condition else "FAILED  ") + message)
+        if not condition:
+            failures.append(message)
+
+    service = StandInService(args.tokens, args.delay)
+    url = await service.start()
+    stream_seconds = args.tokens * args.delay
+
+    pipeline = build(url, timeout=stream_seconds + 2)
+    reply, _, total = await timed(pipeline, "How do I deploy to kubernetes?")
+    expect(service.requests == 0 and "deploy" in reply.lower(),
+           f"keyword match answered in {total * 1000:.2f} ms without calling the service")
+
+    reply, first, total = await timed(pipeline, "What is the meaning of uptime?")
+    expect(service.requests == 1 and reply.startswith("word0") and len(reply.split()) == args.tokens,
+           f"service reply streamed: first chunk {first * 1000:.1f} ms, whole reply {total * 1000:.1f} ms")
+    reply2, _, total = await timed(pipeline, "  what is THE meaning of uptime ")
+    expect(service.requests == 1 and reply2 == reply, f"repeat answered from the cache in {total * 1000:.3f} ms")
+
+    reply, _, _ = await timed(pipeline, "please decline this one")
+    expect(service.requests == 2 and reply == main.fallback_reply("please decline this one"),
+           "declined by the service: keyword fallback reply")
+    reply, _, _ = await timed(pipeline, "please decline this one")
+    expect(service.requests == 3, "fallback replies are not cached")
+    await pipeline.close()
+
+    pipeline = build(url, timeout=0.5)
+    reply, _, total = await timed(pipeline, "stall forever")
+    expect(reply == main.fallback_reply("stall forever") and 0.5 <= total < 1.0
+           and pipeline.stats()["calls"]["service"]["timeout"] == 1,
+           f"stalled service timed out, fallback after {total:.2f} s")
+    await pipeline.close()
+
+    # A timeout a few word delays long, well short of a whole reply
+    timeout = args.delay * 5
+    pipeline = build(url, timeout=timeout)
+    reply, _, total = await timed(pipeline, "a long answer please")
+    expect(len(reply.split()) == args.tokens and total > timeout,
+           f"reply streamed for {total:.2f} s, past the {timeout:.2f} s timeout, arrived whole")
+    try:
+        await timed(pipeline, "stop halfway")
+        interrupted = None
+    except ReplyInterrupted as exc:
+        interrupted = exc
+    expect(interrupted is not None and interrupted.partial == "word0 word1 word2 ",
+           f"service stalling partway raised ReplyInterrupted with {interrupted and interrupted.partial!r}")
+    await pipeline.close()
+
+    service.peak = 0
+    pipeline = build(url, timeout=60, max_concurrent=args.max_concurrent)
+    started = time.perf_counter()
+    replies = await asyncio.gather(*(timed(pipeline, f"distinct question {i}") for i in range(args.burst)))
+    elapsed = time.perf_counter() - started
+    expect(service.peak == args.max_concurrent and all(r[0].startswith("word0") for r in replies),
+           f"{args.burst} concurrent questions: at most {service.peak} service calls at once "
+           f"(limit {args.max_concurrent}), all answered in {elapsed:.2f} s")
+    await pipeline.close()
+    await service.stop()
+
+    inline = ResponderPipeline([FunctionBackend("cpu", cpu_reply)])
+    inline_lag = await loop_lag(lambda: asyncio.gather(*(timed(inline, f"inline {i}") for i in range(4))))
+    pool = ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn"))
+    offloaded = ResponderPipeline([PoolBackend("cpu", cpu_reply, pool)], timeout=60)
+    # Start the workers before measuring
+    await asyncio.gather(*(timed(offloaded, f"warm {i}") for i in range(args.workers)))
+    pool_lag = await loop_lag(lambda: asyncio.gather(*(timed(offloaded, f"pooled {i}") for i in range(4))))
+    pool.shutdown()
+    expect(pool_lag < inline_lag / 4,
+           f"CPU-bound backend, worst event loop stall: inline {inline_lag * 1000:.0f} ms, "
+           f"process pool {pool_lag * 1000:.1f} ms")
+
+    unhandled, logged = [], []
+    asyncio.get_running_loop().set_exception_handler(lambda loop, context: unhandled.append(context["message"]))
+    log_error = main.logger.error
+    main.logger.error = lambda event, *args, **fields: logged.append(event)
+
+    async def failing_reply(content: str):
+        yield "partial "
+        raise RuntimeError("backend down")
+
+    responder, main.reply_responder = main.reply_responder, failing_reply
+    try:
+        await failing_stream(expect)
+    finally:
+        main.reply_responder = responder
+        main.logger.error = log_error
+    gc.collect()
+    await asyncio.sleep(0)
+    expect("chat.reply_failed" in logged and not unhandled,
+           f"failed streamed reply logged as {logged}, unretrieved task exceptions: {unhandled}")
+    return failures
+
+
+async def failing_stream(expect):
+    import httpx
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://check") as client:
+            login = await client.post("/token", data={"username": "john@example.com", "password": "password123"})
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+            session_id = (await client.post("/chat/sessions", json="Failing", headers=headers)).json()["id"]
+            response = await client.post(f"/chat/sessions/{session_id}/messages/stream", json="hello", headers=headers)
+            expect("event: error" in response.text, "streamed reply from a failing backend ends with an error event")
+            # Unlike gather(), wait() leaves the task's exception unretrieved
+            if main.reply_tasks:
+                await asyncio.wait(set(main.reply_tasks))
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=20, help="words in a stand-in service reply")
+    parser.add_argument("--delay", type=float, default=0.01, help="seconds between streamed words")
+    parser.add_argument("--burst", type=int, default=32, help="concurrent distinct questions")
+    parser.add_argument("--max-concurrent", type=int, default=4, help="concurrent service calls allowed")
+    parser.add_argument("--workers", type=int, default=2, help="process pool size for the CPU-bound backend")
+    args = parser.parse_args()
+
+    main.logger.stream = open(os.devnull, "w")
+    failures = asyncio.run(run(args))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,142 @@
+"""Check: chat search ranks alike with the in-memory and SQLite stores.
+
+Run from the api directory:
+
+    python benchmarks/check_search.py
+    python benchmarks/check_search.py --sessions 60 --messages 100
+
+Writes the same chat history to an InMemoryStore and to a SQLiteStore in a
+temporary directory, from a small vocabulary with accented words, and then
+checks that:
+
+- both stores return the same hits with the same scores, pages and flags;
+- they still do after some sessions are deleted, both before and after
+  the in-memory index compacts them away, and the in-memory index holds at
+  most twice as many documents as are live;
+- the in-memory index keeps no documents of a user whose sessions are all
+  deleted;
+- a query matching more than MAX_CANDIDATES messages ranks the newest of
+  them and says so in both stores;
+- the in-memory index restored from a snapshot searches like the original.
+
+Exits with status 1 if any check fails.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import MAX_CANDIDATES  # noqa: E402
+from snapshot import SnapshotReader, SnapshotWriter  # noqa: E402
+from sqlite_store import SQLiteStore  # noqa: E402
+from store import InMemoryStore  # noqa: E402
+
+WORDS = ["kubernetes", "pod", "deploy", "crash", "rollback", "image", "node", "helm", "café", "cafe", "naïve"]
+QUERIES = ["kubernetes", "pod crash", "rollback helm node", "café", "cafe naïve", "w7 w8", "w49"]
+
+
+def session(session_id: str, user_id: str, contents) -> dict:
+    return {
+        "id": session_id, "user_id": user_id, "title": session_id,
+        "created_at": "2024-01-01T00:00:00", "updated_at": "2024-01-01T00:00:00",
+        "messages": [
+            {"id": f"{session_id}-{i}", "user_id": user_id, "content": content,
+             "timestamp": f"2024-01-02T00:00:{i % 60:02d}", "type": "user"}
+            for i, content in enumerate(contents)
+        ],
+    }
+
+
+def results(store, user_id: str, query: str, offset: int = 0):
+    hits, has_more, truncated = store.search_messages(user_id, query, 20, offset)
+    return [(hit["message_id"], hit["score"]) for hit in hits], has_more, truncated
+
+
+def run(args, directory: str) -> list:
+    failures = []
+
+    def expect(condition: bool, message: str):
+        print(("ok      " if condition else "FAILED  ") + message)
+        if not condition:
+            failures.append(message)
+
+    def compare(label: str, queries=QUERIES):
+        differ = [query for query in queries if results(memory, "u1", query) != results(sqlite, "u1", query)]
+        expect(not differ, f"{label}: same hits and scores" + (f", except for {differ}" if differ else ""))
+
+    rng = random.Random(args.seed)
+    words = WORDS + [f"w{i}" for i in range(50)]
+    memory, sqlite = InMemoryStore(), SQLiteStore(os.path.join(directory, "search.db"))
+    for s in range(args.sessions):
+        record = session(f"s{s}", "u1", [" ".join(rng.choices(words, k=rng.randint(3, 15))) for _ in range(args.messages)])
+        memory.add_session(record)
+        sqlite.add_session(record)
+    compare("fresh index")
+    expect(results(memory, "u1", "kubernetes", 40) == results(sqlite, "u1", "kubernetes", 40), "later pages agree")
+
+    index = memory._search
+    user = index._users["u1"]
+    for s in range(args.sessions // 4):
+        memory.delete_session(f"s{s}")
+        sqlite.delete_session(f"s{s}")
+    expect(user.dead > 0, f"deleted documents not yet compacted: {user.dead}")
+    compare("after deleting a quarter of the sessions")
+
+    image = index.capture()
+    path = os.path.join(directory, "search.snap")
+    writer = SnapshotWriter(path)
+    writer.finish({"search": image(writer.blob)})
+    reader = SnapshotReader(path)
+    restored = type(index).restore(memory._load_message, reader.manifest["search"], memory._sessions, reader.read)
+    expect(
+        all(restored.search("u1", query, 20) == index.search("u1", query, 20) for query in QUERIES),
+        "index restored from a snapshot searches alike",
+    )
+    reader.close()
+
+    for s in range(args.sessions // 4, args.sessions * 3 // 4):
+        memory.delete_session(f"s{s}")
+        sqlite.delete_session(f"s{s}")
+    expect(
+        len(user.doc_sessions) == user.live + user.dead <= 2 * user.live,
+        f"compaction keeps {len(user.doc_sessions)} documents for {user.live} live ones",
+    )
+    compare("after compaction")
+    for s in range(args.sessions * 3 // 4, args.sessions):
+        memory.delete_session(f"s{s}")
+        sqlite.delete_session(f"s{s}")
+    expect("u1" not in index._users, "a user without sessions leaves no index behind")
+
+    record = session("many", "u2", [f"common word{i}" for i in range(MAX_CANDIDATES + 5)])
+    memory.add_session(record)
+    sqlite.add_session(record)
+    for store in (memory, sqlite):
+        hits, has_more, truncated = results(store, "u2", "common", MAX_CANDIDATES - 20)
+        expect(
+            truncated and not has_more and hits[-1][0] == "many-5",
+            f"{type(store).__name__}: {MAX_CANDIDATES + 5} matches, the newest {MAX_CANDIDATES} ranked and flagged",
+        )
+        expect(not results(store, "u2", "word7")[2], f"{type(store).__name__}: a narrow query is not flagged")
+    sqlite.close()
+    return failures
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=40, help="sessions of the searching user")
+    parser.add_argument("--messages", type=int, default=60, help="messages per session")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        failures = run(args, directory)
+    if failures:
+        sys.exit(1)
+    print("all checks passed")
+
+
+if __name__ == "__main__":
+    cli()
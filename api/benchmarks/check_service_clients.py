@@ -0,0 +1,220 @@
+"""Check: pooled service clients against local stand-in HTTP and TCP servers.
+
+Run from the api directory:
+
+    python benchmarks/check_service_clients.py
+    python benchmarks/check_service_clients.py --calls 500
+
+Starts a keep-alive HTTP server (standing in for Airflow or Kubernetes) and
+a plain TCP server (standing in for MongoDB) on localhost. Both count the
+connections they accept. The script then checks that:
+
+- repeated calls for one credential reuse a single connection, and time the
+  first call against the later ones;
+- the pool closes the least recently used client when it is full;
+- a sweep closes idle clients, and drops clients whose service went away;
+- credentials pointing at localhost are refused unless the pool allows
+  private addresses, and only admins may check a credential through the API;
+- a host that resolves to a public address when the pool checks it and to
+  localhost when the client connects (DNS rebinding) is never connected to;
+- deleting a credential through the API closes its client.
+
+Exits with status 1 if any check fails.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from clients import ClientManager  # noqa: E402
+
+
+class StandIn:
+    """A local server that counts accepted and open connections"""
+
+    def __init__(self, http: bool):
+        self.http = http
+        self.accepted = 0
+        self.open = 0
+        self.server = None
+        self._writers = set()
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        # Hang up on open connections too, like a service going down
+        self.server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.accepted += 1
+        self.open += 1
+        self._writers.add(writer)
+        try:
+            while self.http:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()).strip():
+                    pass
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nContent-Type: text/plain\r\n\r\nok")
+                await writer.drain()
+            else:
+                await reader.read()  # hold the connection until the client closes it
+        except ConnectionError:
+            pass
+        finally:
+            self.open -= 1
+            self._writers.discard(writer)
+            writer.close()
+
+
+def credential(credential_id: str, service: str, **details) -> dict:
+    return {"id": credential_id, "user_id": "1", "service": service, "details": details}
+
+
+async def timed_checks(pool: ClientManager, cred: dict, calls: int):
+    samples = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        client = await pool.get(cred)
+        ok = await client.check()
+        samples.append(time.perf_counter() - started)
+        assert ok
+    return samples
+
+
+async def run(calls: int) -> list:
+    failures = []
+
+    def expect(condition: bool, message: str):
+        print(("ok      " if condition else "FAILED  ") + message)
+        if not condition:
+            failures.append(message)
+
+    http_server, tcp_server = StandIn(http=True), StandIn(http=False)
+    http_port, tcp_port = await http_server.start(), await tcp_server.start()
+    airflow = credential("c-airflow", "airflow", url=f"http://127.0.0.1:{http_port}", username="admin")
+    mongodb = credential("c-mongo", "mongodb", uri=f"mongodb://127.0.0.1:{tcp_port}")
+
+    # The stand-ins listen on localhost, which a default pool refuses
+    try:
+        await ClientManager().get(airflow)
+        refused = False
+    except ValueError:
+        refused = True
+    expect(refused, "default pool refused a credential pointing at localhost")
+
+    # DNS rebinding: public for the pool's check, localhost afterwards
+    answers = {}
+    getaddrinfo = socket.getaddrinfo
+
+    def rebinding_getaddrinfo(host, port, *args, **kwargs):
+        if host != "rebind.example":
+            return getaddrinfo(host, port, *args, **kwargs)
+        address = "127.0.0.1" if answers else "93.184.216.34"
+        answers[address] = answers.get(address, 0) + 1
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port or 0))]
+
+    socket.getaddrinfo = rebinding_getaddrinfo
+    pool = ClientManager()
+    for label, server, cred in (
+        ("HTTP", http_server, credential("c-rebind-http", "airflow", url=f"http://rebind.example:{http_port}")),
+        ("TCP", tcp_server, credential("c-rebind-tcp", "mongodb", uri=f"mongodb://rebind.example:{tcp_port}")),
+    ):
+        answers.clear()
+        healthy = await (await pool.get(cred)).check()
+        expect(
+            not healthy and answers.get("127.0.0.1") and server.accepted == 0,
+            f"{label}: host rebound to localhost after the check was not connected to",
+        )
+    await pool.stop()
+    socket.getaddrinfo = getaddrinfo
+
+    # Reuse
+    pool = ClientManager(max_size=2, idle_timeout=60, allow_private=True)
+    for label, server, cred in (("HTTP", http_server, airflow), ("TCP", tcp_server, mongodb)):
+        samples = await timed_checks(pool, cred, calls)
+        print(
+            f"{label}: first call {samples[0] * 1e6:.0f} us, later calls p50"
+            f" {statistics.median(samples[1:]) * 1e6:.0f} us over {calls} calls"
+        )
+        expect(server.accepted == 1, f"{label}: {calls} calls used {server.accepted} connection(s)")
+
+    # Size limit: a third credential pushes out the least recently used one
+    await pool.get(airflow)
+    await pool.get(credential("c-k8s", "kubernetes", url=f"http://127.0.0.1:{http_port}"))
+    await asyncio.sleep(0.05)
+    expect(pool.stats()["size"] == 2 and tcp_server.open == 0, "full pool closed the least recently used client")
+
+    # Idle eviction and failed health checks
+    await pool.sweep()
+    expect(pool.stats()["size"] == 2, "sweep kept healthy clients")
+    pool.idle_timeout = 0
+    await pool.sweep()
+    await asyncio.sleep(0.05)
+    expect(pool.stats()["size"] == 0 and http_server.open == 0, "sweep closed idle clients")
+
+    pool.idle_timeout = 60
+    await (await pool.get(mongodb)).check()
+    await tcp_server.stop()
+    await asyncio.sleep(0.05)
+    await pool.sweep()
+    expect(pool.stats()["failed_checks"] == 1 and pool.stats()["size"] == 0, "sweep dropped a client whose service went away")
+    await pool.stop()
+
+    # Invalidation through the API
+    accepted = http_server.accepted
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://check") as client:
+            login = await client.post("/token", data={"username": "john@example.com", "password": "password123"})
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+            created = await client.post("/credentials", json={
+                "service": "airflow", "details": {"url": f"http://127.0.0.1:{http_port}", "username": "admin"},
+            }, headers=headers)
+            credential_id = created.json()["id"]
+            refused = await client.post(f"/credentials/{credential_id}/check", headers=headers)
+            expect(refused.status_code == 400, f"API refused to check a localhost credential: {refused.status_code}")
+            login = await client.post("/token", data={"username": "jane@example.com", "password": "password456"})
+            forbidden = await client.post(f"/credentials/{credential_id}/check",
+                                          headers={"Authorization": f"Bearer {login.json()['access_token']}"})
+            expect(forbidden.status_code == 403, f"non-admin may not check credentials: {forbidden.status_code}")
+            main.service_clients.allow_private = True
+            for _ in range(3):
+                result = (await client.post(f"/credentials/{credential_id}/check", headers=headers)).json()
+            expect(result["healthy"] and http_server.accepted == accepted + 1, "API checks reused one connection")
+            await client.delete(f"/credentials/{credential_id}", headers=headers)
+            await asyncio.sleep(0.05)
+            expect(http_server.open == 0 and main.service_clients.stats()["size"] == 0,
+                   "deleting the credential closed its client")
+    await http_server.stop()
+    return failures
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200, help="calls per credential in the reuse check")
+    args = parser.parse_args()
+
+    main.logger.stream = open(os.devnull, "w")
+    failures = asyncio.run(run(args.calls))
+    if failures:
+        sys.exit(1)
+    print("all checks passed")
+
+
+if __name__ == "__main__":
+    cli()
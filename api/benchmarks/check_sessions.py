@@ -0,0 +1,122 @@
+"""Check: chat session routes return the newest messages and say when there are more.
+
+Run from the api directory:
+
+    python benchmarks/check_sessions.py
+    python benchmarks/check_sessions.py --backend sqlite --messages 500
+
+Runs the app in-process over an ASGI transport, once with the in-memory
+store and once with SQLite in a temporary directory (or with ``--backend``
+only). For a session with more than RECENT_MESSAGES messages and one with
+fewer, it checks that GET /chat/sessions and GET /chat/sessions/{id}:
+
+- report the session's message_count;
+- return its newest RECENT_MESSAGES messages in order, with
+  has_more_messages set only when there are older ones;
+- leave the older messages to GET /chat/sessions/{id}/messages with
+  ``before`` set to the oldest id returned.
+
+Exits with status 1 if any check fails.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+
+def message(session_id: str, i: int) -> dict:
+    return {
+        "id": f"{session_id}-{i}", "user_id": "1", "content": f"message {i}",
+        "timestamp": f"2024-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}", "type": "user" if i % 2 == 0 else "bot",
+    }
+
+
+async def run(args) -> list:
+    import httpx
+    import main
+    from store import RECENT_MESSAGES
+
+    failures = []
+
+    def expect(condition: bool, label: str):
+        print(("ok      " if condition else "FAILED  ") + f"{main.STORAGE_BACKEND}: {label}")
+        if not condition:
+            failures.append(label)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://check") as client:
+            login = await client.post("/token", data={"username": "john@example.com", "password": "password123"})
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+            counts = {}
+            for title, count in (("Long", args.messages), ("Short", RECENT_MESSAGES // 2)):
+                session_id = (await client.post("/chat/sessions", json=title, headers=headers)).json()["id"]
+                for i in range(count):
+                    await main.run_db(main.db.add_message, session_id, message(session_id, i))
+                counts[session_id] = count
+
+            listed = {session["id"]: session for session in (await client.get("/chat/sessions", headers=headers)).json()}
+            for session_id, count in counts.items():
+                single = (await client.get(f"/chat/sessions/{session_id}", headers=headers)).json()
+                expected = [message(session_id, i)["id"] for i in range(max(0, count - RECENT_MESSAGES), count)]
+                for route, session in (("GET /chat/sessions", listed[session_id]), ("GET /chat/sessions/{id}", single)):
+                    expect(
+                        session["message_count"] == count
+                        and [m["id"] for m in session["messages"]] == expected
+                        and session["has_more_messages"] == (count > RECENT_MESSAGES),
+                        f"{route}, {count} messages: newest {len(expected)},"
+                        f" has_more_messages {session['has_more_messages']}",
+                    )
+                if count > RECENT_MESSAGES:
+                    older, before = [], single["messages"][0]["id"]
+                    while before is not None:
+                        page = (await client.get(
+                            f"/chat/sessions/{session_id}/messages", params={"before": before, "limit": 200}, headers=headers,
+                        )).json()
+                        older = page["messages"] + older
+                        before = page["messages"][0]["id"] if page["has_more"] else None
+                    expect(
+                        [m["id"] for m in older] == [message(session_id, i)["id"] for i in range(count - RECENT_MESSAGES)],
+                        f"the {len(older)} older messages page back from the oldest one returned",
+                    )
+                await client.delete(f"/chat/sessions/{session_id}", headers=headers)
+    return failures
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=("memory", "sqlite"), help="check one store only, in this process")
+    parser.add_argument("--messages", type=int, default=120, help="messages in the long session")
+    args = parser.parse_args()
+
+    if args.backend is None:
+        # The store is picked when main is imported, so each gets a process
+        failed = False
+        for backend in ("memory", "sqlite"):
+            command = [sys.executable, os.path.abspath(__file__), "--backend", backend, "--messages", str(args.messages)]
+            failed |= subprocess.run(command, cwd=API_DIR).returncode != 0
+        if failed:
+            sys.exit(1)
+        print("all checks passed")
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["STORAGE_BACKEND"] = args.backend
+        os.environ["SQLITE_PATH"] = os.path.join(directory, "sessions.db")
+        os.environ.pop("SNAPSHOT_PATH", None)
+        import main
+        main.logger.stream = open(os.devnull, "w")
+        failures = asyncio.run(run(args))
+        if args.backend == "sqlite":
+            main.db.close()
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,331 @@
+import asyncio
+import functools
+import ipaddress
+import socket
+import ssl
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+
+import httpcore
+import httpx
+
+# Pooled service clients
+#
+# The bot reaches Airflow, Kubernetes, MongoDB and the like with the details
+# users store as credentials. Building a client means a TCP (and maybe TLS)
+# handshake, so ClientManager builds one per credential on first use and
+# hands the same client back afterwards. Credentials with a "url" get an
+# HTTPServiceClient, an httpx.AsyncClient with keep-alive connections.
+# Credentials with only a "uri" (e.g. mongodb://host:port) get a
+# TCPServiceClient that keeps one connection open.
+#
+# The pool is an LRU keyed by credential id. The least recently used client
+# is closed when the pool is full. A background task closes clients idle for
+# longer than ``idle_timeout`` and health checks the others every
+# ``health_interval`` seconds. A client that fails its check is dropped and
+# rebuilt on next use. Deleting a credential must call invalidate().
+#
+# Credentials are user input, so before building a client the pool resolves
+# its host and refuses addresses that are not globally routable (private,
+# loopback, link-local, reserved, multicast): otherwise any user could make
+# the server connect to its own internal network. Deployments whose
+# services live on a private network set ``allow_private``. A host's DNS
+# answer can change between that check and a connection, so clients also
+# resolve and check the host each time they connect and connect to the
+# address they checked; HTTP requests still name the host in their Host
+# header and TLS SNI.
+
+# Health check path per service for HTTP clients; others use "/"
+HEALTH_PATHS = {"airflow": "/health", "kubernetes": "/healthz", "jenkins": "/login"}
+# Port used when a "uri" names none
+DEFAULT_PORTS = {"mongodb": 27017, "redis": 6379, "postgres": 5432, "postgresql": 5432}
+
+
+class ServiceClient:
+    """A reusable connection to one service"""
+
+    async def check(self) -> bool:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+@functools.lru_cache(maxsize=None)
+def ssl_context() -> ssl.SSLContext:
+    """The TLS settings of every HTTP client; loading the CA bundle takes tens of ms"""
+    return httpx.create_ssl_context()
+
+
+class PublicAddressBackend(httpcore.AsyncNetworkBackend):
+    """httpcore network backend connecting only to globally routable addresses"""
+
+    def __init__(self):
+        self.backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host: str, port: int, timeout=None, local_address=None, socket_options=None):
+        try:
+            address = await resolve_public(host)
+        except ValueError as exc:
+            raise httpcore.ConnectError(str(exc)) from None
+        return await self.backend.connect_tcp(
+            address, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+        )
+
+    async def connect_unix_socket(self, path: str, timeout=None, socket_options=None):
+        raise httpcore.ConnectError("Unix sockets are not public addresses")
+
+    async def sleep(self, seconds: float):
+        await self.backend.sleep(seconds)
+
+
+class HTTPServiceClient(ServiceClient):
+    def __init__(self, credential: dict, timeout: float = 5.0, keepalive: float = 300.0, allow_private: bool = False):
+        details = credential["details"]
+        headers = {}
+        auth = None
+        if details.get("token"):
+            headers["Authorization"] = f"Bearer {details['token']}"
+        elif details.get("username") and details.get("password"):
+            auth = (details["username"], details["password"])
+        self.health_path = HEALTH_PATHS.get(credential["service"], "/")
+        transport = httpx.AsyncHTTPTransport(verify=ssl_context())
+        # httpx has no option for a network backend, so the transport gets
+        # a connection pool built with one
+        transport._pool = httpcore.AsyncConnectionPool(
+            ssl_context=ssl_context(),
+            max_connections=10,
+            max_keepalive_connections=2,
+            keepalive_expiry=keepalive,
+            network_backend=None if allow_private else PublicAddressBackend(),
+        )
+        self.http = httpx.AsyncClient(
+            base_url=details["url"],
+            headers=headers,
+            auth=auth,
+            timeout=timeout,
+            transport=transport,
+        )
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        return await self.http.request(method, path, **kwargs)
+
+    async def check(self) -> bool:
+        try:
+            response = await self.http.get(self.health_path)
+        except httpx.HTTPError:
+            return False
+        return response.status_code < 500
+
+    async def close(self):
+        await self.http.aclose()
+
+
+class TCPServiceClient(ServiceClient):
+    def __init__(self, credential: dict, timeout: float = 5.0, allow_private: bool = False):
+        parts = urlsplit(credential["details"]["uri"])
+        if not parts.hostname:
+            raise ValueError(f"No host in {credential['service']} uri")
+        self.host = parts.hostname
+        self.port = parts.port or DEFAULT_PORTS.get(parts.scheme or credential["service"], 0)
+        if not self.port:
+            raise ValueError(f"No port in {credential['service']} uri")
+        self.timeout = timeout
+        self.allow_private = allow_private
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    async def connection(self):
+        """The open (reader, writer) pair, reconnecting if it was closed"""
+        async with self._lock:
+            if not self._is_open():
+                await self._close_streams()
+                host = self.host if self.allow_private else await resolve_public(self.host)
+                self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(host, self.port), self.timeout)
+            return self.reader, self.writer
+
+    async def check(self) -> bool:
+        try:
+            await self.connection()
+        except (OSError, asyncio.TimeoutError, ValueError):
+            return False
+        return True
+
+    async def close(self):
+        async with self._lock:
+            await self._close_streams()
+
+    def _is_open(self) -> bool:
+        # A peer that hung up leaves EOF in the reader
+        return self.writer is not None and not self.writer.is_closing() and not self.reader.at_eof()
+
+    async def _close_streams(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+
+def target_host(credential: dict) -> str:
+    """The host a credential's client would connect to"""
+    details = credential["details"]
+    host = urlsplit(details.get("url") or details.get("uri") or "").hostname
+    if not host:
+        raise ValueError(f"No host in {credential['service']} url or uri")
+    return host
+
+
+async def resolve_public(host: str) -> str:
+    """An address of host to connect to
+
+    Raises ValueError unless every address host resolves to is globally
+    routable.
+    """
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        raise ValueError(f"Cannot resolve {host}") from None
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f"{host} resolves to a non-public address")
+    return infos[0][4][0]
+
+
+async def check_public(host: str):
+    """Raise ValueError unless every address host resolves to is globally routable"""
+    await resolve_public(host)
+
+
+def build_client(
+    credential: dict, timeout: float = 5.0, keepalive: float = 300.0, allow_private: bool = False,
+) -> ServiceClient:
+    details = credential["details"]
+    if details.get("url"):
+        return HTTPServiceClient(credential, timeout, keepalive, allow_private)
+    if details.get("uri"):
+        return TCPServiceClient(credential, timeout, allow_private)
+    raise ValueError(f"Credential for {credential['service']} has no url or uri")
+
+
+class _Entry:
+    __slots__ = ("client", "last_used")
+
+    def __init__(self, client: ServiceClient):
+        self.client = client
+        self.last_used = time.monotonic()
+
+
+class ClientManager:
+    def __init__(
+        self,
+        max_size: int = 100,
+        idle_timeout: float = 300.0,
+        health_interval: float = 30.0,
+        factory: Optional[Callable[[dict], ServiceClient]] = None,
+        allow_private: bool = False,
+        on_error: Optional[Callable[[BaseException], None]] = None,
+    ):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_interval = health_interval
+        self.allow_private = allow_private
+        # Called with the exception when a background sweep fails
+        self.on_error = on_error
+        self._factory = factory or (
+            lambda credential: build_client(credential, keepalive=idle_timeout, allow_private=self.allow_private)
+        )
+        # credential_id -> entry, least recently used first
+        self._clients: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+        self.failed_checks = 0
+
+    async def get(self, credential: dict) -> ServiceClient:
+        """The pooled client for a credential, built on first use"""
+        credential_id = credential["id"]
+        entry = self._clients.get(credential_id)
+        if entry is None and not self.allow_private:
+            await check_public(target_host(credential))
+            # Another request may have built the client while this one resolved
+            entry = self._clients.get(credential_id)
+        if entry is not None:
+            self._clients.move_to_end(credential_id)
+            entry.last_used = time.monotonic()
+            self.reused += 1
+            return entry.client
+
+        # Building a client doesn't connect (that happens on its first
+        # request), so nothing can interleave between the lookup and insert
+        client = self._factory(credential)
+        self.created += 1
+        self._clients[credential_id] = _Entry(client)
+        while len(self._clients) > self.max_size:
+            _, oldest = self._clients.popitem(last=False)
+            self.evicted += 1
+            await oldest.client.close()
+        return client
+
+    async def invalidate(self, credential_id: str):
+        """Close and forget the client of a deleted or changed credential"""
+        entry = self._clients.pop(credential_id, None)
+        if entry is not None:
+            await entry.client.close()
+
+    async def sweep(self):
+        """Close idle clients and drop the ones failing their health check"""
+        now = time.monotonic()
+        idle = [(key, entry) for key, entry in self._clients.items() if now - entry.last_used > self.idle_timeout]
+        active = [(key, entry) for key, entry in self._clients.items() if now - entry.last_used <= self.idle_timeout]
+        healthy = await asyncio.gather(*(entry.client.check() for _, entry in active))
+        failed = [item for item, ok in zip(active, healthy) if not ok]
+        self.evicted += len(idle)
+        self.failed_checks += len(failed)
+        for credential_id, entry in idle + failed:
+            # The credential may have been invalidated during the checks
+            if self._clients.get(credential_id) is entry:
+                del self._clients[credential_id]
+                await entry.client.close()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._clients:
+            _, entry = self._clients.popitem()
+            await entry.client.close()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.sweep()
+            except Exception as exc:
+                if self.on_error is not None:
+                    self.on_error(exc)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._clients),
+            "max_size": self.max_size,
+            "created": self.created,
+            "reused": self.reused,
+            "evicted": self.evicted,
+            "failed_checks": self.failed_checks,
+        }
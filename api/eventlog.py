@@ -0,0 +1,164 @@
+import json
+import random
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, Optional, TextIO
+
+from serialization import dumps
+
+# Structured event log
+#
+# Route handlers call logger.info("event", field=value, ...). That only checks
+# the level and the route's sample rate and appends a tuple to a bounded
+# deque; a background thread formats records as JSON lines and writes them in
+# batches. When the queue is full the record is dropped and counted rather
+# than blocking the event loop.
+#
+# Fields named in ``redact`` (message bodies by default) are written as their
+# length only. Warnings and errors are never sampled out.
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {number: name for name, number in LEVELS.items()}
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """Parse "route=rate,route=rate" as used by LOG_SAMPLE_RATES"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route, _, rate = item.rpartition("=")
+        rates[route.strip()] = float(rate)
+    return rates
+
+
+class EventLogger:
+    def __init__(
+        self,
+        stream: Optional[TextIO] = None,
+        level: str = "info",
+        max_queue: int = 10000,
+        sample_rates: Optional[Dict[str, float]] = None,
+        redact: Iterable[str] = ("content",),
+        flush_interval: float = 0.2,
+    ):
+        self.stream = stream or sys.stdout
+        self.level = LEVELS[level.lower()]
+        self.max_queue = max_queue
+        self.sample_rates = dict(sample_rates or {})
+        self.redact = frozenset(redact)
+        self.flush_interval = flush_interval
+        # (unix time, level, event, route, fields)
+        self._queue: deque = deque()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        # Writer thread only: formatted timestamp of the current second
+        self._second = None
+        self._second_text = ""
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+
+    # Request path
+    def debug(self, event: str, route: Optional[str] = None, **fields):
+        if DEBUG >= self.level:
+            self._enqueue(DEBUG, event, route, fields)
+
+    def info(self, event: str, route: Optional[str] = None, **fields):
+        if INFO >= self.level:
+            self._enqueue(INFO, event, route, fields)
+
+    def warning(self, event: str, route: Optional[str] = None, **fields):
+        if WARNING >= self.level:
+            self._enqueue(WARNING, event, route, fields)
+
+    def error(self, event: str, route: Optional[str] = None, **fields):
+        if ERROR >= self.level:
+            self._enqueue(ERROR, event, route, fields)
+
+    def _enqueue(self, level: int, event: str, route: Optional[str], fields: dict):
+        if route is not None and level < WARNING and route in self.sample_rates:
+            if random.random() >= self.sample_rates[route]:
+                self.sampled_out += 1
+                return
+        queue = self._queue
+        if len(queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        queue.append((time.time(), level, event, route, fields))
+        if len(queue) == 1:
+            self._wakeup.set()
+
+    # Writer thread
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="eventlog", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Write out whatever is queued and stop the writer thread"""
+        if self._thread is not None:
+            self._stopping = True
+            self._wakeup.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.drain()
+            if self._stopping:
+                return
+
+    def drain(self) -> int:
+        """Format and write every queued record; returns how many were written"""
+        lines = []
+        while self._queue:
+            lines.append(self.format(*self._queue.popleft()))
+        if lines:
+            try:
+                self.stream.write("".join(lines))
+                self.stream.flush()
+            except (OSError, ValueError):
+                # Closed or broken stream; the records are lost either way
+                self.dropped += len(lines)
+                return 0
+            self.written += len(lines)
+        return len(lines)
+
+    def format(self, timestamp: float, level: int, event: str, route: Optional[str], fields: dict) -> str:
+        second = int(timestamp)
+        if second != self._second:
+            self._second = second
+            self._second_text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+        record = {
+            "ts": f"{self._second_text}.{int((timestamp - second) * 1000):03d}Z",
+            "level": LEVEL_NAMES[level],
+            "event": event,
+        }
+        if route is not None:
+            record["route"] = route
+        for name, value in fields.items():
+            if name in self.redact and isinstance(value, str):
+                record[name] = f"<redacted {len(value)} chars>"
+            else:
+                record[name] = value
+        try:
+            return dumps(record).decode() + "\n"
+        except TypeError:
+            # A field value the encoder does not know; fall back to str()
+            return json.dumps(record, default=str, ensure_ascii=False) + "\n"
+
+    def stats(self) -> dict:
+        return {
+            "level": LEVEL_NAMES[self.level],
+            "queued": len(self._queue),
+            "max_queue": self.max_queue,
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+        }
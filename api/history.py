@@ -0,0 +1,292 @@
+import bisect
+import json
+import mmap
+import tempfile
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Tiered chat history for the in-memory store
+#
+# A session's newest messages are "hot": tuples in a list, with the fields
+# in MESSAGE_FIELDS order, which is far smaller than one dict per message.
+# Once a session holds ``hot_limit + segment_size`` hot messages, the oldest
+# ``segment_size`` of them are written to the SegmentLog and leave memory.
+# The log is an append-only file of zlib-compressed JSON segments.
+#
+# What stays in memory for the cold part is one (offset, length) pair per
+# segment and a 4-byte CRC-32 per message id (stable across processes,
+# unlike hash(), so snapshots can keep them). Reading old messages loads
+# their segments back. The log keeps the most recently decoded segments in
+# a small LRU cache, so a client paging back through one segment
+# decompresses it only once.
+#
+# Pagination cursors are message ids. A cold id is found through a sorted
+# index of (hash << 32 | position), built from the hashes the first time a
+# cursor points into the cold part and kept as a few sorted runs that merge
+# as segments are added, so a lookup is a handful of bisects; only the
+# segment holding a matching hash is read to confirm the id.
+#
+# The log is scratch space: an anonymous temporary file (in ``directory``,
+# if given) that disappears when it is closed or the process exits.
+# Segments of deleted sessions stay in it until then.
+#
+# A store restored from a snapshot (see snapshot.py) reads the segments it
+# had then from the memory-mapped snapshot, the log's ``base``: offsets
+# below the base's length are in the snapshot, later ones in the file. A
+# restored session's hot tail also stays in the snapshot, compressed like a
+# segment, until the session is first read or written.
+
+MESSAGE_FIELDS = ("id", "user_id", "content", "timestamp", "type")
+
+
+def pack_message(message: dict) -> tuple:
+    return tuple(message[field] for field in MESSAGE_FIELDS)
+
+
+def unpack_message(record: tuple) -> dict:
+    return dict(zip(MESSAGE_FIELDS, record))
+
+
+def message_hash(message_id: str) -> int:
+    return zlib.crc32(message_id.encode())
+
+
+def encode_segment(records: List[tuple], level: int = 6) -> bytes:
+    return zlib.compress(json.dumps(records, separators=(",", ":")).encode(), level)
+
+
+def decode_segment(blob: bytes) -> List[tuple]:
+    return [tuple(record) for record in json.loads(zlib.decompress(blob))]
+
+
+class SegmentLog:
+    def __init__(self, directory: Optional[str] = None, cache_size: int = 64, level: int = 6, base: Optional[mmap.mmap] = None):
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self._base = base
+        self._base_size = len(base) if base is not None else 0
+        self._size = self._base_size
+        self._level = level
+        self._lock = threading.Lock()
+        # offset -> decoded records, least recently used first
+        self._cache: "OrderedDict[int, List[tuple]]" = OrderedDict()
+        self.cache_size = cache_size
+        self.segments_written = 0
+        self.segments_read = 0
+
+    def append(self, records: List[tuple]) -> Tuple[int, int]:
+        """Write a segment and return its (offset, length) in the file"""
+        blob = encode_segment(records, self._level)
+        with self._lock:
+            offset = self._size
+            self._file.seek(offset - self._base_size)
+            self._file.write(blob)
+            self._size += len(blob)
+            self.segments_written += 1
+        return offset, len(blob)
+
+    def read(self, offset: int, length: int) -> List[tuple]:
+        with self._lock:
+            records = self._cache.get(offset)
+            if records is not None:
+                self._cache.move_to_end(offset)
+                return records
+            blob = self._read_blob(offset, length)
+            self.segments_read += 1
+        records = decode_segment(blob)
+        with self._lock:
+            self._cache[offset] = records
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return records
+
+    def read_raw(self, offset: int, length: int) -> bytes:
+        """A segment as stored, still compressed"""
+        with self._lock:
+            return self._read_blob(offset, length)
+
+    def _read_blob(self, offset: int, length: int) -> bytes:
+        if offset < self._base_size:
+            return self._base[offset:offset + length]
+        self._file.seek(offset - self._base_size)
+        return self._file.read(length)
+
+    def close(self):
+        self._file.close()
+        self._base = None
+
+    def stats(self) -> dict:
+        return {
+            "bytes": self._size - self._base_size,
+            "segments_written": self.segments_written,
+            "segments_read": self.segments_read,
+            "cached_segments": len(self._cache),
+        }
+
+
+class MessageHistory:
+    """One session's messages: cold segments on disk, then the hot tail"""
+
+    __slots__ = (
+        "log", "segment_size", "hot_limit", "segments", "_hot", "_hot_ids", "hashes", "_pending_hot",
+        "_cold_runs", "_indexed_segments",
+    )
+
+    def __init__(self, log: SegmentLog, hot_limit: int, segment_size: int):
+        self.log = log
+        self.hot_limit = hot_limit
+        self.segment_size = segment_size
+        # (offset, length) of each cold segment, segment_size messages each
+        self.segments: List[Tuple[int, int]] = []
+        self._hot: List[tuple] = []
+        # message id -> position, for hot messages only
+        self._hot_ids: Dict[str, int] = {}
+        # message_hash(message id) for every message, in order
+        self.hashes = array("I")
+        # For a restored session, returns its hot tail as an encoded segment
+        self._pending_hot: Optional[Callable[[], bytes]] = None
+        # Sorted runs of hash << 32 | position over the first
+        # _indexed_segments cold segments, see _cold_index()
+        self._cold_runs: List[array] = []
+        self._indexed_segments = 0
+
+    @classmethod
+    def restored(
+        cls,
+        log: SegmentLog,
+        hot_limit: int,
+        segment_size: int,
+        segments: List[Tuple[int, int]],
+        hashes: array,
+        load_hot: Callable[[], bytes],
+    ) -> "MessageHistory":
+        """A session's history as of a snapshot; the hot tail is decoded on first use"""
+        history = cls(log, hot_limit, segment_size)
+        history.segments = segments
+        history.hashes = hashes
+        history._pending_hot = load_hot
+        return history
+
+    @property
+    def hot(self) -> List[tuple]:
+        if self._pending_hot is not None:
+            self._load_hot()
+        return self._hot
+
+    @property
+    def hot_ids(self) -> Dict[str, int]:
+        if self._pending_hot is not None:
+            self._load_hot()
+        return self._hot_ids
+
+    def _load_hot(self):
+        self._hot = decode_segment(self._pending_hot())
+        self._pending_hot = None
+        cold = self.cold_count
+        self._hot_ids = {record[0]: cold + i for i, record in enumerate(self._hot)}
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    @property
+    def cold_count(self) -> int:
+        return len(self.segments) * self.segment_size
+
+    def append(self, message: dict):
+        hot = self.hot
+        self._hot_ids[message["id"]] = len(self.hashes)
+        self.hashes.append(message_hash(message["id"]))
+        hot.append(pack_message(message))
+        if len(hot) >= self.hot_limit + self.segment_size:
+            # A new list, so a snapshot being written keeps the one it captured
+            spilled, self._hot = hot[:self.segment_size], hot[self.segment_size:]
+            self.segments.append(self.log.append(spilled))
+            for record in spilled:
+                del self._hot_ids[record[0]]
+
+    def capture(self) -> Tuple[List[Tuple[int, int]], array, Callable[[], bytes]]:
+        """This history's segments, hashes and encoded hot tail as of now
+
+        Cheap enough to call on the event loop: the hot tail is encoded when
+        the returned function is called, from the list as it is now (appends
+        only ever add to it past the captured length, and spills replace it).
+        """
+        segments, hashes = list(self.segments), array("I", self.hashes)
+        if self._pending_hot is not None:
+            return segments, hashes, self._pending_hot
+        hot, length = self._hot, len(self._hot)
+        return segments, hashes, lambda: encode_segment(hot[:length])
+
+    def last(self) -> Optional[dict]:
+        hot = self.hot
+        return unpack_message(hot[-1]) if hot else None
+
+    def position(self, message_id: str) -> Optional[int]:
+        """Position of a message id in the session, or None"""
+        position = self.hot_ids.get(message_id)
+        if position is not None:
+            return position
+        # Cold: look the id's hash up in the index, then confirm each match
+        # (almost always one) against the stored record
+        target = message_hash(message_id)
+        candidates = []
+        for run in self._cold_index():
+            i = bisect.bisect_left(run, target << 32)
+            while i < len(run) and run[i] >> 32 == target:
+                candidates.append(run[i] & 0xFFFFFFFF)
+                i += 1
+        for position in sorted(candidates):
+            if self.slice(position, position + 1)[0]["id"] == message_id:
+                return position
+        return None
+
+    def _cold_index(self) -> List[array]:
+        """Sorted runs of hash << 32 | position that cover every cold message"""
+        segments = len(self.segments)
+        if self._indexed_segments < segments:
+            # One run for every segment added since the last lookup
+            hashes = self.hashes
+            start, end = self._indexed_segments * self.segment_size, segments * self.segment_size
+            run = array("Q", sorted(hashes[p] << 32 | p for p in range(start, end)))
+            # Merge runs no longer than the new one, like carries in a binary
+            # counter: O(log n) runs, each entry merged O(log n) times
+            while self._cold_runs and len(self._cold_runs[-1]) <= len(run):
+                run = array("Q", sorted(self._cold_runs.pop() + run))
+            self._cold_runs.append(run)
+            self._indexed_segments = segments
+        return self._cold_runs
+
+    def slice(self, start: int, end: int) -> List[dict]:
+        """Messages in positions [start, end) as dicts"""
+        start, end = max(start, 0), min(end, len(self.hashes))
+        records: List[tuple] = []
+        cold = self.cold_count
+        if start < cold:
+            first, last = start // self.segment_size, (min(end, cold) - 1) // self.segment_size
+            for index in range(first, last + 1):
+                records += self.log.read(*self.segments[index])
+            skip = start - first * self.segment_size
+            records = records[skip:skip + min(end, cold) - start]
+        if end > cold:
+            records += self.hot[max(start, cold) - cold:end - cold]
+        return [unpack_message(record) for record in records]
+
+    def tail(self, limit: int) -> List[dict]:
+        """The newest ``limit`` messages"""
+        return self.slice(len(self.hashes) - limit, len(self.hashes))
+
+    def __iter__(self) -> Iterator[dict]:
+        """Every message in order, for rebuilding derived data
+
+        Cold segments are decoded one at a time and bypass the log's cache,
+        so a full pass holds one segment in memory and leaves the cache to
+        clients paging through recent history.
+        """
+        segments, hot = list(self.segments), list(self.hot)
+        for offset, length in segments:
+            for record in decode_segment(self.log.read_raw(offset, length)):
+                yield unpack_message(record)
+        for record in hot:
+            yield unpack_message(record)
@@ -0,0 +1,133 @@
+import json
+import os
+import re
+from typing import Dict, List, Optional
+
+# Intent rules
+#
+# Rules are loaded from a JSON file (data/intents.json by default):
+#
+#     {
+#       "fallback": "... {message} ...",
+#       "intents": [
+#         {"name": "greeting", "keywords": ["hello", "hi"], "response": "..."},
+#         ...
+#       ]
+#     }
+#
+# Keywords match whole words, case-insensitively. A trailing "*" makes a
+# keyword match any word starting with it ("container*" matches
+# "containers"), and spaces match any run of whitespace. When a message
+# contains keywords of several intents, the intent listed first wins.
+#
+# All keywords are compiled into a single trie-shaped regex, so classifying
+# a message is one scan of the text no matter how many rules are loaded.
+
+DEFAULT_INTENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "intents.json")
+
+_EXACT = 1
+_PREFIX = 2
+
+
+class Intent:
+    __slots__ = ("name", "keywords", "response", "priority")
+
+    def __init__(self, name: str, keywords: List[str], response: str, priority: int):
+        self.name = name
+        self.keywords = keywords
+        self.response = response
+        self.priority = priority
+
+
+class _TrieNode:
+    __slots__ = ("children", "terminal")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.terminal = 0
+
+
+class IntentMatcher:
+    def __init__(self, intents: List[dict], fallback: str):
+        self.fallback = fallback
+        self.intents: List[Intent] = []
+        self._exact: Dict[str, Intent] = {}
+        self._prefix: Dict[str, Intent] = {}
+
+        root = _TrieNode()
+        for priority, rule in enumerate(intents):
+            intent = Intent(rule["name"], list(rule["keywords"]), rule["response"], priority)
+            self.intents.append(intent)
+            for keyword in intent.keywords:
+                keyword = " ".join(keyword.lower().split())
+                if keyword.endswith("*"):
+                    keyword, kind, table = keyword[:-1], _PREFIX, self._prefix
+                else:
+                    kind, table = _EXACT, self._exact
+                if not keyword:
+                    raise ValueError(f"Empty keyword in intent {intent.name!r}")
+                # An earlier intent keeps a keyword shared with a later one
+                table.setdefault(keyword, intent)
+                node = root
+                for char in keyword:
+                    node = node.children.setdefault(char, _TrieNode())
+                node.terminal |= kind
+
+        self._pattern = (
+            re.compile(rf"(?<!\w)(?:{_trie_pattern(root)})(?!\w)", re.IGNORECASE)
+            if root.children
+            else None
+        )
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_INTENTS_PATH) -> "IntentMatcher":
+        with open(path, encoding="utf-8") as f:
+            rules = json.load(f)
+        return cls(rules["intents"], rules["fallback"])
+
+    def match(self, text: str) -> Optional[Intent]:
+        """Return the highest-priority intent whose keywords occur in text"""
+        if self._pattern is None:
+            return None
+        best = None
+        for found in self._pattern.finditer(text):
+            intent = self._lookup(found.group())
+            if intent is not None and (best is None or intent.priority < best.priority):
+                best = intent
+                if best.priority == 0:
+                    break
+        return best
+
+    def respond(self, text: str) -> str:
+        intent = self.match(text)
+        if intent is None:
+            return self.fallback.format(message=text)
+        return intent.response
+
+    def _lookup(self, word: str) -> Optional[Intent]:
+        word = " ".join(word.lower().split())
+        intent = self._exact.get(word)
+        if intent is not None:
+            return intent
+        # Longest matching prefix keyword
+        for end in range(len(word), 0, -1):
+            intent = self._prefix.get(word[:end])
+            if intent is not None:
+                return intent
+        return None
+
+
+def _trie_pattern(node: _TrieNode) -> str:
+    # Longer continuations come first so the regex prefers the longest
+    # keyword at a position and only backtracks to shorter ones.
+    branches = []
+    for char in sorted(node.children):
+        token = r"\s+" if char == " " else re.escape(char)
+        branches.append(token + _trie_pattern(node.children[char]))
+    if node.terminal & _PREFIX:
+        branches.append(r"\w*")
+    elif node.terminal & _EXACT:
+        branches.append("")
+    if len(branches) == 1:
+        return branches[0]
+    return "(?:" + "|".join(branches) + ")"
@@ -1,22 +1,66 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Header, Body
+from fastapi import FastAPI, HTTPException, Depends, status, Header, Body, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union, Literal
 from datetime import datetime, timedelta
-import uuid
-import json
-import hashlib
+import asyncio
 import base64
+import functools
+import json
+import math
+import os
+import time
+import uuid
 import secrets
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from store import InMemoryStore, public_view
+from sqlite_store import SQLiteStore
+from snapshot import SnapshotManager
+from intents import DEFAULT_INTENTS_PATH, IntentMatcher
+from auth import TokenCache, create_token, load_secret_key, verify_token
+from activity import ActivityTracker
+from streaming import SessionBroadcaster, sse_stream
+from serialization import FastJSONResponse, etag_matches, make_etag, not_modified
+from analytics import HOUR, AnalyticsEngine, StoreAnalytics
+from passwords import HasherBusy, PasswordHasher
+from eventlog import EventLogger, parse_sample_rates
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, Registry, serve_local
+from clients import ClientManager
+from admission import AdmissionMiddleware, AdmissionRejected, Budget, FailureLimit, InFlightLimit
+from responders import FunctionBackend, HTTPBackend, PoolBackend, ReplyInterrupted, ResponderPipeline, load_function
 
 # Security configuration
-SECRET_KEY = secrets.token_hex(32)  # Generate a random secret key
+# Tokens stay valid across workers and restarts only if every process signs
+# with the same key: set SECRET_KEY, or SECRET_KEY_FILE to a key file that is
+# created on first start. Without either, each process makes up its own key.
+if os.environ.get("SECRET_KEY"):
+    SECRET_KEY = os.environ["SECRET_KEY"]
+elif os.environ.get("SECRET_KEY_FILE"):
+    SECRET_KEY = load_secret_key(os.environ["SECRET_KEY_FILE"])
+else:
+    SECRET_KEY = secrets.token_hex(32)
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Cache of verified tokens -> users, invalidated when a user is deleted or
+# their status changes
+token_cache = TokenCache(
+    max_size=int(os.environ.get("TOKEN_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("TOKEN_CACHE_TTL", "300")),
+)
+
 # Initialize FastAPI app
 app = FastAPI(title="DevOps Bot API")
 
+# Admission control: past ADMISSION_MAX_IN_FLIGHT requests being handled at
+# once, new ones get 429 (0 turns the cap off). Added before CORS so those
+# responses still carry CORS headers.
+in_flight_limit = InFlightLimit(int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "512")))
+app.add_middleware(AdmissionMiddleware, limit=in_flight_limit, exempt=("/health",))
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -24,7 +68,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "Retry-After", "ETag"],
+)
+
+# Metrics, served at /metrics to admins and, if METRICS_PORT is set, without
+# authentication on METRICS_HOST:METRICS_PORT (127.0.0.1 by default)
+metrics = Registry()
+http_requests = metrics.counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_latency = metrics.histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+auth_latency = metrics.histogram(
+    "auth_resolution_seconds", "Time to resolve a bearer token to a user", ("outcome",),
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1),
+)
+intent_latency = metrics.histogram(
+    "intent_match_seconds", "Time to match a chat message against the bot intents", ("matched",),
+    buckets=(0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005),
 )
+app.add_middleware(MetricsMiddleware, requests=http_requests, latency=http_latency)
 
 # Simple token generation
 # Change the tokenUrl to match what the frontend expects
@@ -61,6 +121,32 @@ class User(UserBase):
 class UserInDB(User):
     password_hash: str
 
+# Bulk user management: every item gets its own result, so one bad row
+# doesn't fail the batch
+BULK_MAX_ITEMS = 1000
+
+class BulkUserCreate(BaseModel):
+    users: List[UserCreate] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+class BulkUserIds(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+class BulkUserStatus(BulkUserIds):
+    # Set every user to this status, or toggle each one if omitted
+    status: Optional[Literal["Active", "Inactive"]] = None
+
+class BulkItemResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    status: int
+    user: Optional[User] = None
+    detail: Optional[str] = None
+
+class BulkResult(BaseModel):
+    results: List[BulkItemResult]
+    succeeded: int
+    failed: int
+
 # Chat models
 class Message(BaseModel):
     id: str
@@ -75,8 +161,49 @@ class ChatSession(BaseModel):
     title: str
     created_at: str
     updated_at: str
+    # The newest messages only, and whether there are older ones, which are
+    # paged through /chat/sessions/{id}/messages?before=<oldest id here>
+    message_count: int = 0
+    has_more_messages: bool = False
     messages: List[Message] = []
 
+class ChatSessionSummary(BaseModel):
+    id: str
+    user_id: str
+    title: str
+    created_at: str
+    updated_at: str
+    message_count: int
+    last_message: Optional[str] = None
+
+class ChatSessionSummaryPage(BaseModel):
+    sessions: List[ChatSessionSummary]
+    next_cursor: Optional[str] = None
+
+class SearchHit(BaseModel):
+    session_id: str
+    session_title: str
+    message_id: str
+    type: str
+    timestamp: str
+    snippet: str
+    score: float
+
+class SearchPage(BaseModel):
+    results: List[SearchHit]
+    next_offset: Optional[int] = None
+    # True when the query matched more messages than are ranked, so only
+    # the newest of them are in the results
+    truncated: bool = False
+
+class MessagePage(BaseModel):
+    messages: List[Message]
+    has_more: bool
+
+class MessageExchange(BaseModel):
+    user_message: Message
+    bot_message: Message
+
 # Credential models
 class Credential(BaseModel):
     id: str
@@ -86,15 +213,26 @@ class Credential(BaseModel):
     created_at: str
     updated_at: str
 
-# Simple password hashing
-def hash_password(password: str) -> str:
-    return hashlib.sha256((password + SECRET_KEY).encode()).hexdigest()
+# Password hashing (salted scrypt by default) on a bounded worker pool.
+# Unsalted SHA-256 hashes from older versions still verify and are replaced
+# on the next successful login.
+password_hasher = PasswordHasher(
+    algorithm=os.environ.get("PASSWORD_HASH_ALGORITHM", "scrypt"),
+    scrypt_n=int(os.environ.get("PASSWORD_SCRYPT_N", str(2 ** 14))),
+    scrypt_r=int(os.environ.get("PASSWORD_SCRYPT_R", "8")),
+    scrypt_p=int(os.environ.get("PASSWORD_SCRYPT_P", "1")),
+    pbkdf2_iterations=int(os.environ.get("PASSWORD_PBKDF2_ITERATIONS", "600000")),
+    workers=int(os.environ.get("PASSWORD_HASH_WORKERS", "4")),
+    max_pending=int(os.environ.get("PASSWORD_HASH_MAX_PENDING", "64")),
+    legacy_secret=SECRET_KEY,
+)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return hash_password(plain_password) == hashed_password
+def hash_password(password: str) -> str:
+    # Blocking; only for startup seeding. Routes await password_hasher.hash().
+    return password_hasher.hash_sync(password)
 
-# Mock database
-mock_users = [
+# Seed data; the passwords are hashed only when a fresh store is seeded
+seed_users = [
     {
         "id": "1",
         "name": "John Doe",
@@ -102,7 +240,7 @@ mock_users = [
         "role": "Admin",
         "status": "Active",
         "lastActive": "2023-07-15T14:30:00",
-        "password_hash": hash_password("password123")
+        "password": "password123"
     },
     {
         "id": "2",
@@ -111,7 +249,7 @@ mock_users = [
         "role": "User",
         "status": "Active",
         "lastActive": "2023-07-15T10:15:00",
-        "password_hash": hash_password("password456")
+        "password": "password456"
     },
     {
         "id": "3",
@@ -120,7 +258,7 @@ mock_users = [
         "role": "User",
         "status": "Inactive",
         "lastActive": "2023-07-10T09:45:00",
-        "password_hash": hash_password("password789")
+        "password": "password789"
     },
     {
         "id": "4",
@@ -129,7 +267,7 @@ mock_users = [
         "role": "User",
         "status": "Active",
         "lastActive": "2023-07-14T16:20:00",
-        "password_hash": hash_password("passwordabc")
+        "password": "passwordabc"
     },
     {
         "id": "5",
@@ -138,12 +276,12 @@ mock_users = [
         "role": "User",
         "status": "Active",
         "lastActive": "2023-07-15T11:05:00",
-        "password_hash": hash_password("passworddef")
+        "password": "passworddef"
     },
 ]
 
-# Mock chat sessions
-mock_chat_sessions = [
+# Seed chat sessions
+seed_chat_sessions = [
     {
         "id": "1",
         "user_id": "1",
@@ -192,8 +330,8 @@ mock_chat_sessions = [
     }
 ]
 
-# Mock credentials
-mock_credentials = [
+# Seed credentials
+seed_credentials = [
     {
         "id": "1",
         "user_id": "1",
@@ -218,40 +356,184 @@ mock_credentials = [
     }
 ]
 
-# Analytics data for admin dashboard
-mock_analytics = {
-    "daily_sessions": [
-        {"day": "Mon", "count": 24},
-        {"day": "Tue", "count": 18},
-        {"day": "Wed", "count": 30},
-        {"day": "Thu", "count": 26},
-        {"day": "Fri", "count": 32},
-        {"day": "Sat", "count": 15},
-        {"day": "Sun", "count": 10}
-    ],
-    "user_activity": {
-        "active_users": 42,
-        "total_messages": 256,
-        "average_session_duration": "12m 30s"
-    },
-    "system_metrics": {
-        "cpu_usage": 42,
-        "memory_usage": 65,
-        "storage_usage": 37,
-        "network_bandwidth": 28
-    }
-}
+# Usage analytics keep this many days of counters
+ANALYTICS_RETENTION_DAYS = int(os.environ.get("ANALYTICS_RETENTION_DAYS", "90"))
+
+# Data store: "memory" (default) or "sqlite" for a durable WAL database
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "memory")
+snapshots = None
+if STORAGE_BACKEND == "sqlite":
+    db = SQLiteStore(
+        os.environ.get("SQLITE_PATH", "devops_bot.db"),
+        pool_size=int(os.environ.get("SQLITE_POOL_SIZE", "4")),
+        analytics_retention_days=ANALYTICS_RETENTION_DAYS,
+    )
+else:
+    # Chat history beyond HISTORY_HOT_MESSAGES per session is compressed
+    # into a temporary archive file (in HISTORY_ARCHIVE_DIR, if set) and
+    # read back when a client pages that far
+    _store_options = dict(
+        hot_messages=int(os.environ.get("HISTORY_HOT_MESSAGES", "256")),
+        segment_messages=int(os.environ.get("HISTORY_SEGMENT_MESSAGES", "128")),
+        archive_dir=os.environ.get("HISTORY_ARCHIVE_DIR") or None,
+    )
+    if os.environ.get("SNAPSHOT_PATH"):
+        # Restored from the snapshot at SNAPSHOT_PATH plus the writes
+        # journaled since; a new snapshot is written every SNAPSHOT_INTERVAL
+        # seconds if anything changed, and at shutdown
+        snapshots = SnapshotManager(
+            os.environ["SNAPSHOT_PATH"],
+            interval=float(os.environ.get("SNAPSHOT_INTERVAL", "300")),
+            on_error=lambda exc: logger.error("snapshot.failed", error=repr(exc)),
+        )
+        db = snapshots.open(**_store_options)
+    else:
+        db = InMemoryStore(**_store_options)
+
+# Populate a fresh store from the seed data. Workers starting together on
+# one database race to do this; seed records have fixed ids, so the losers
+# stop at their first duplicate.
+if db.count_users() == 0:
+    try:
+        for _seed in seed_users:
+            _user = {field: value for field, value in _seed.items() if field != "password"}
+            _user["password_hash"] = hash_password(_seed["password"])
+            db.add_user(_user)
+        for _session in seed_chat_sessions:
+            db.add_session(_session)
+        for _credential in seed_credentials:
+            db.add_credential(_credential)
+    except KeyError:
+        pass
+
+# Usage analytics for the admin dashboard, kept up to date by the routes.
+# A SQLite database is shared by every worker, so it keeps the counters
+# itself and each worker reports the same figures from them.
+def build_analytics():
+    if STORAGE_BACKEND == "sqlite":
+        return StoreAnalytics(db).rebuild()
+    return AnalyticsEngine.from_records(db.list_users(), db.iter_sessions(), ANALYTICS_RETENTION_DAYS)
+
+if STORAGE_BACKEND == "sqlite":
+    analytics = StoreAnalytics(db)
+elif snapshots is not None and "analytics" in snapshots.extras:
+    # Saved with the snapshot, so a restart doesn't read every message
+    analytics = AnalyticsEngine.from_state(snapshots.extras["analytics"], ANALYTICS_RETENTION_DAYS)
+    for _method, _args in snapshots.replayed:
+        analytics.replay_store_write(_method, _args)
+else:
+    analytics = build_analytics()
+if snapshots is not None:
+    snapshots.extra_state["analytics"] = lambda: analytics.state()
+
+# Keyword intent rules for the bot
+intent_matcher = IntentMatcher.from_file(os.environ.get("INTENTS_PATH", DEFAULT_INTENTS_PATH))
 
-# Simple token generation and validation
+async def run_db(fn, *args):
+    """Call a store method, off the event loop if the backend blocks"""
+    if db.executor is None:
+        return fn(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db.executor, functools.partial(fn, *args))
+
+async def flush_last_active(updates: Dict[str, str]):
+    await run_db(db.update_last_active, updates)
+
+# lastActive timestamps are batched here and written to the store every
+# ACTIVITY_FLUSH_INTERVAL seconds
+activity_tracker = ActivityTracker(
+    flush_last_active,
+    interval=float(os.environ.get("ACTIVITY_FLUSH_INTERVAL", "5")),
+    on_error=lambda exc: logger.warning("activity.flush_failed", error=repr(exc)),
+)
+
+# Structured JSON-lines log, written to stdout by a background thread.
+# LOG_SAMPLE_RATES keeps a fraction of a route's records, e.g.
+# "/chat/sessions/{session_id}/messages=0.1"; LOG_REDACT lists the fields
+# written as their length only ("" logs them in full).
+logger = EventLogger(
+    level=os.environ.get("LOG_LEVEL", "info"),
+    max_queue=int(os.environ.get("LOG_QUEUE_SIZE", "10000")),
+    sample_rates=parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", "")),
+    redact=[field for field in os.environ.get("LOG_REDACT", "content").split(",") if field],
+)
+
+# Connections to the services in users' credentials, built on first use and
+# reused; idle ones are closed and the rest health checked in the background.
+# Hosts on private networks are refused unless CLIENT_ALLOW_PRIVATE=1.
+service_clients = ClientManager(
+    max_size=int(os.environ.get("CLIENT_POOL_SIZE", "100")),
+    idle_timeout=float(os.environ.get("CLIENT_IDLE_TIMEOUT", "300")),
+    health_interval=float(os.environ.get("CLIENT_HEALTH_INTERVAL", "30")),
+    allow_private=os.environ.get("CLIENT_ALLOW_PRIVATE") == "1",
+    on_error=lambda exc: logger.warning("clients.sweep_failed", error=repr(exc)),
+)
+
+# Budgets for the expensive routes. Each user may post CHAT_RATE_LIMIT chat
+# messages a second (bursts of CHAT_BURST), and at most REPLY_MAX_IN_FLIGHT
+# bot replies are generated at once. Each client address may try to log into
+# an account (or register) LOGIN_RATE_LIMIT times a second (bursts of
+# LOGIN_BURST), and at most LOGIN_MAX_IN_FLIGHT logins hash passwords at
+# once. Keying logins on the client too means nobody can lock an account's
+# owner out by knowing their email. Each client address may also fail
+# LOGIN_FAILURE_BURST logins, then LOGIN_FAILURE_RATE a second, whichever
+# accounts it tries. A rate of 0 turns a rate limit off. Requests over a cap
+# wait up to ADMISSION_QUEUE_TIMEOUT seconds for a slot.
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "1"))
+chat_budget = Budget(
+    "chat",
+    rate=float(os.environ.get("CHAT_RATE_LIMIT", "2")),
+    burst=float(os.environ.get("CHAT_BURST", "10")),
+    max_in_flight=int(os.environ.get("REPLY_MAX_IN_FLIGHT", "64")),
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+)
+login_budget = Budget(
+    "login",
+    rate=float(os.environ.get("LOGIN_RATE_LIMIT", "0.2")),
+    burst=float(os.environ.get("LOGIN_BURST", "5")),
+    max_in_flight=int(os.environ.get("LOGIN_MAX_IN_FLIGHT", "16")),
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+)
+login_failures = FailureLimit(
+    "login_failures",
+    rate=float(os.environ.get("LOGIN_FAILURE_RATE", "0.1")),
+    burst=float(os.environ.get("LOGIN_FAILURE_BURST", "10")),
+)
+
+@app.on_event("startup")
+async def start_background_tasks():
+    logger.start()
+    activity_tracker.start()
+    service_clients.start()
+    if snapshots is not None:
+        snapshots.start()
+
+@app.on_event("shutdown")
+async def close_store():
+    await service_clients.stop()
+    # Write out pending activity before the store goes away
+    await activity_tracker.stop()
+    if snapshots is not None:
+        await snapshots.stop()
+    db.close()
+    password_hasher.close()
+    logger.stop()
+
+# Fan-out of new chat messages and reply chunks to open session streams
+broadcaster = SessionBroadcaster(queue_size=int(os.environ.get("STREAM_QUEUE_SIZE", "256")))
+reply_tasks = set()
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def public_user(user: dict) -> dict:
+    """User record as returned by the API: no password hash, freshest lastActive"""
+    if "password_hash" in user:
+        user = public_view(user)
+    return activity_tracker.apply(user)
+
+# Signed token generation and validation
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
-    to_encode = data.copy()
-    to_encode.update({"exp": int(expire.timestamp())})
-    
-    # Convert token data to string and encode
-    token_data = json.dumps(to_encode).encode()
-    token = base64.urlsafe_b64encode(token_data).decode()
-    return token
+    expires_delta = expires_delta or timedelta(minutes=15)
+    return create_token(data, SECRET_KEY, expires_delta.total_seconds())
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
@@ -260,42 +542,50 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    started = time.perf_counter()
+    outcome = "rejected"
     try:
-        # Decode the token
-        token_bytes = base64.urlsafe_b64decode(token)
-        payload = json.loads(token_bytes.decode())
-        
-        # Check token expiration
-        if "exp" not in payload or datetime.utcnow().timestamp() > payload["exp"]:
-            raise credentials_exception
+        # Tokens seen recently skip verification and the user lookup
+        user = token_cache.get(token)
+        if user is None:
+            payload = verify_token(token, SECRET_KEY)
+            if payload is None:
+                raise credentials_exception
+                
+            username = payload.get("sub")
+            if not isinstance(username, str):
+                raise credentials_exception
             
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except Exception:
-        raise credentials_exception
+            user = await get_user(username)
+            if user is None:
+                raise credentials_exception
+            token_cache.put(token, user, payload["exp"])
+            outcome = "verified"
+        else:
+            outcome = "cached"
+    finally:
+        auth_latency.observe(time.perf_counter() - started, outcome)
         
-    user = get_user(username)
-    if user is None:
-        raise credentials_exception
-        
-    # Update lastActive timestamp
-    user["lastActive"] = datetime.now().isoformat()
+    # Record activity; the store is updated in batches by activity_tracker
+    activity_tracker.touch(user["id"])
+    analytics.record_activity(user["id"])
     return user
 
 # Security helper functions
-def get_user(email: str):
-    for user in mock_users:
-        if user["email"] == email:
-            return user
-    return None
-
-def authenticate_user(email: str, password: str):
-    user = get_user(email)
+async def get_user(email: str):
+    return await run_db(db.get_user_by_email, email)
+
+async def authenticate_user(email: str, password: str):
+    user = await get_user(email)
     if not user:
         return False
-    if not verify_password(password, user["password_hash"]):
+    matches, needs_rehash = await password_hasher.verify(password, user["password_hash"])
+    if not matches:
         return False
+    if needs_rehash:
+        # Upgrade legacy or outdated hashes while we have the plain password
+        new_hash = await password_hasher.hash(password)
+        user = await run_db(db.update_user, user["id"], {"password_hash": new_hash}) or user
     return user
 
 async def get_current_active_user(current_user: dict = Depends(get_current_user)):
@@ -303,16 +593,57 @@ async def get_current_active_user(current_user: dict = Depends(get_current_user)
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
+@app.exception_handler(HasherBusy)
+async def password_hasher_busy(request: Request, exc: HasherBusy):
+    # Shed logins and sign-ups instead of queueing them without bound
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Too many concurrent password operations, please retry"},
+        headers={"Retry-After": "1"},
+    )
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    if exc.reason == "rate_limited":
+        detail = "Too many requests, please retry later"
+    else:
+        detail = "Server busy, please retry"
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": detail},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+async def versions_etag(*keys: str, params: tuple = ()) -> str:
+    """ETag for a response covered by the store's version counters ``keys``"""
+    # Read before the data, so a write landing in between only makes the
+    # next request miss
+    return make_etag(db.epoch, keys, await run_db(db.versions, keys), params)
+
 # API Routes
+#
+# GET routes that return store records unchanged wrap them in
+# FastJSONResponse, which skips response_model re-validation. The ones
+# clients poll send an ETag and answer a matching If-None-Match with 304.
 @app.get("/")
 def read_root():
     return {"message": "Welcome to DevOps Bot API"}
 
+@app.get("/health")
+def health():
+    # Liveness probe; "worker" shows which process of a multi-worker
+    # deployment answered
+    return {"status": "ok", "worker": os.getpid()}
+
 # Authentication routes
 @app.post("/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    client = f"client:{request.client.host if request.client else ''}"
+    login_failures.check(client)
+    async with login_budget.admit(f"{client}|{form_data.username.lower()}"):
+        user = await authenticate_user(form_data.username, form_data.password)
     if not user:
+        login_failures.failed(client)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -332,9 +663,9 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     }
 
 @app.post("/register", response_model=User, status_code=status.HTTP_201_CREATED)
-async def register_user(user: UserCreate):
+async def register_user(user: UserCreate, request: Request):
     # Check if email already exists
-    if get_user(user.email):
+    if await get_user(user.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
@@ -344,28 +675,51 @@ async def register_user(user: UserCreate):
     new_user = user.dict()
     new_user["id"] = str(uuid.uuid4())
     new_user["lastActive"] = datetime.now().isoformat()
-    new_user["password_hash"] = hash_password(user.password)
+    # Every sign-up is a new email, so sign-ups are limited per client address
+    async with login_budget.admit(f"client:{request.client.host if request.client else ''}"):
+        new_user["password_hash"] = await password_hasher.hash(user.password)
     del new_user["password"]  # Remove plain password
     
-    mock_users.append(new_user)
+    await run_db(db.add_user, new_user)
     
     # Return user without password_hash
-    user_response = {k: v for k, v in new_user.items() if k != "password_hash"}
-    return user_response
+    return public_user(new_user)
 
 # User management routes
 @app.get("/users", response_model=List[User])
-async def get_users(current_user: dict = Depends(get_current_active_user)):
+async def get_users(
+    role: Optional[str] = None,
+    status: Optional[str] = None,
+    name: Optional[str] = Query(None, max_length=100, description="Name prefix, case-insensitive"),
+    sort: Optional[Literal["name", "email", "lastActive"]] = None,
+    order: Literal["asc", "desc"] = "asc",
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_active_user)
+):
     # Only admin users can view all users
     if current_user["role"] != "Admin":
         raise HTTPException(status_code=403, detail="Not authorized to view all users")
     
-    # Return users without password_hash
-    return [{k: v for k, v in user.items() if k != "password_hash"} for user in mock_users]
+    # Activity not yet flushed to the store doesn't move the version, so a
+    # 304 may hold lastActive values up to ACTIVITY_FLUSH_INTERVAL behind
+    etag = await versions_etag("users", params=(role, status, name, sort, order, limit, offset))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    # Filtered, sorted and paged by the store's indexes; without parameters
+    # this is every user in creation order. X-Total-Count is the number of
+    # matches before paging. Public views come precomputed (no password_hash).
+    users, total = await run_db(db.query_users, role, status, name, sort, order == "desc", limit, offset)
+    return FastJSONResponse(
+        [public_user(user) for user in users],
+        headers={"X-Total-Count": str(total), "ETag": etag},
+    )
 
 @app.get("/users/me", response_model=User)
 async def get_current_user_profile(current_user: dict = Depends(get_current_active_user)):
-    return {k: v for k, v in current_user.items() if k != "password_hash"}
+    return FastJSONResponse(public_user(current_user))
 
 @app.get("/users/{user_id}", response_model=User)
 async def get_user_by_id(user_id: str, current_user: dict = Depends(get_current_active_user)):
@@ -373,9 +727,9 @@ async def get_user_by_id(user_id: str, current_user: dict = Depends(get_current_
     if current_user["role"] != "Admin" and current_user["id"] != user_id:
         raise HTTPException(status_code=403, detail="Not authorized to view this user")
     
-    for user in mock_users:
-        if user["id"] == user_id:
-            return {k: v for k, v in user.items() if k != "password_hash"}
+    user = await run_db(db.get_public_user, user_id)
+    if user is not None:
+        return FastJSONResponse(public_user(user))
     
     raise HTTPException(status_code=404, detail="User not found")
 
@@ -386,7 +740,7 @@ async def create_user(user: UserCreate, current_user: dict = Depends(get_current
         raise HTTPException(status_code=403, detail="Not authorized to create users")
     
     # Check if email already exists
-    if get_user(user.email):
+    if await get_user(user.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
@@ -396,14 +750,13 @@ async def create_user(user: UserCreate, current_user: dict = Depends(get_current
     new_user = user.dict()
     new_user["id"] = str(uuid.uuid4())
     new_user["lastActive"] = datetime.now().isoformat()
-    new_user["password_hash"] = hash_password(user.password)
+    new_user["password_hash"] = await password_hasher.hash(user.password)
     del new_user["password"]  # Remove plain password
     
-    mock_users.append(new_user)
+    await run_db(db.add_user, new_user)
     
     # Return user without password_hash
-    user_response = {k: v for k, v in new_user.items() if k != "password_hash"}
-    return user_response
+    return public_user(new_user)
 
 @app.delete("/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user(user_id: str, current_user: dict = Depends(get_current_active_user)):
@@ -411,10 +764,11 @@ async def delete_user(user_id: str, current_user: dict = Depends(get_current_act
     if current_user["role"] != "Admin":
         raise HTTPException(status_code=403, detail="Not authorized to delete users")
     
-    for i, user in enumerate(mock_users):
-        if user["id"] == user_id:
-            mock_users.pop(i)
-            return
+    if await run_db(db.delete_user, user_id) is not None:
+        token_cache.invalidate_user(user_id)
+        activity_tracker.forget(user_id)
+        analytics.forget_user(user_id)
+        return
     
     raise HTTPException(status_code=404, detail="User not found")
 
@@ -424,26 +778,167 @@ async def update_user_status(user_id: str, current_user: dict = Depends(get_curr
     if current_user["role"] != "Admin":
         raise HTTPException(status_code=403, detail="Not authorized to update user status")
     
-    for user in mock_users:
-        if user["id"] == user_id:
-            user["status"] = "Inactive" if user["status"] == "Active" else "Active"
-            return {k: v for k, v in user.items() if k != "password_hash"}
+    user = await run_db(db.get_user, user_id)
+    if user is not None:
+        new_status = "Inactive" if user["status"] == "Active" else "Active"
+        user = await run_db(db.update_user, user_id, {"status": new_status})
+        token_cache.invalidate_user(user_id)
+        return public_user(user)
     
     raise HTTPException(status_code=404, detail="User not found")
 
+def bulk_result(results: List[dict]) -> dict:
+    succeeded = sum(1 for result in results if result["status"] < 400)
+    return {"results": results, "succeeded": succeeded, "failed": len(results) - succeeded}
+
+@app.post("/users/bulk", response_model=BulkResult)
+async def create_users_bulk(batch: BulkUserCreate, current_user: dict = Depends(get_current_active_user)):
+    # Only admin users can create new users
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Not authorized to create users")
+    
+    # Emails already registered or repeated in the batch fail without
+    # spending a password hash on them
+    registered = await run_db(db.registered_emails, [user.email for user in batch.users])
+    results: List[Optional[dict]] = [None] * len(batch.users)
+    accepted, seen = [], set()
+    for index, user in enumerate(batch.users):
+        if user.email in registered or user.email in seen:
+            results[index] = {"index": index, "status": 400, "detail": "Email already registered"}
+        else:
+            seen.add(user.email)
+            accepted.append(index)
+    
+    hashes = await password_hasher.hash_many([batch.users[index].password for index in accepted])
+    now = datetime.now().isoformat()
+    new_users = []
+    for index, password_hash in zip(accepted, hashes):
+        new_user = batch.users[index].dict(exclude={"password"})
+        new_user.update(id=str(uuid.uuid4()), lastActive=now, password_hash=password_hash)
+        new_users.append(new_user)
+    
+    # One store round trip for the whole batch
+    errors = await run_db(db.add_users, new_users)
+    for index, new_user, error in zip(accepted, new_users, errors):
+        if error is None:
+            results[index] = {"index": index, "id": new_user["id"], "status": 201, "user": public_user(new_user)}
+        else:
+            results[index] = {"index": index, "status": 400, "detail": "Email already registered"}
+    return bulk_result(results)
+
+@app.post("/users/bulk/delete", response_model=BulkResult)
+async def delete_users_bulk(batch: BulkUserIds, current_user: dict = Depends(get_current_active_user)):
+    # Only admin users can delete users
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Not authorized to delete users")
+    
+    deleted = await run_db(db.delete_users, batch.ids)
+    for user_id in deleted:
+        token_cache.invalidate_user(user_id)
+        activity_tracker.forget(user_id)
+        analytics.forget_user(user_id)
+    return bulk_result([
+        {"index": index, "id": user_id, "status": 204}
+        if user_id in deleted else
+        {"index": index, "id": user_id, "status": 404, "detail": "User not found"}
+        for index, user_id in enumerate(batch.ids)
+    ])
+
+@app.post("/users/bulk/status", response_model=BulkResult)
+async def update_users_status_bulk(batch: BulkUserStatus, current_user: dict = Depends(get_current_active_user)):
+    # Only admin users can update user status
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Not authorized to update user status")
+    
+    users = await run_db(db.get_users, batch.ids)
+    updates = {
+        user_id: {"status": batch.status or ("Inactive" if user["status"] == "Active" else "Active")}
+        for user_id, user in users.items()
+    }
+    updated = await run_db(db.update_users, updates)
+    for user_id in updated:
+        token_cache.invalidate_user(user_id)
+    return bulk_result([
+        {"index": index, "id": user_id, "status": 200, "user": public_user(updated[user_id])}
+        if user_id in updated else
+        {"index": index, "id": user_id, "status": 404, "detail": "User not found"}
+        for index, user_id in enumerate(batch.ids)
+    ])
+
 # Chat routes
 @app.get("/chat/sessions", response_model=List[ChatSession])
-async def get_chat_sessions(current_user: dict = Depends(get_current_active_user)):
-    user_sessions = [session for session in mock_chat_sessions if session["user_id"] == current_user["id"]]
-    return user_sessions
+async def get_chat_sessions(
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_active_user)
+):
+    etag = await versions_etag(f"sessions:{current_user['id']}")
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    sessions = await run_db(db.list_sessions, current_user["id"])
+    return FastJSONResponse(sessions, headers={"ETag": etag})
+
+def encode_session_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+def decode_session_cursor(cursor: str):
+    try:
+        updated_at, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(updated_at), str(session_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/chat/sessions/summary", response_model=ChatSessionSummaryPage)
+async def get_chat_session_summaries(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    order: Literal["desc", "asc"] = "desc",
+    current_user: dict = Depends(get_current_active_user)
+):
+    # Lightweight listing for the sidebar: no messages, ordered by updated_at
+    key = decode_session_cursor(cursor) if cursor else None
+    summaries, next_key = await run_db(
+        db.list_session_summaries, current_user["id"], limit, key, order == "desc"
+    )
+    return FastJSONResponse({
+        "sessions": summaries,
+        "next_cursor": encode_session_cursor(next_key) if next_key else None,
+    })
+
+@app.get("/chat/search", response_model=SearchPage)
+async def search_chat_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    current_user: dict = Depends(get_current_active_user)
+):
+    # Ranked full-text search over the user's own messages and bot replies
+    hits, has_more, truncated = await run_db(db.search_messages, current_user["id"], q, limit, offset)
+    return FastJSONResponse({
+        "results": hits,
+        "next_offset": offset + limit if has_more else None,
+        "truncated": truncated,
+    })
 
 @app.get("/chat/sessions/{session_id}", response_model=ChatSession)
-async def get_chat_session(session_id: str, current_user: dict = Depends(get_current_active_user)):
-    for session in mock_chat_sessions:
-        if session["id"] == session_id and session["user_id"] == current_user["id"]:
-            return session
+async def get_chat_session(
+    session_id: str,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_active_user)
+):
+    # Check ownership on the bare session row before comparing versions
+    session = await run_db(db.get_session, session_id, False)
+    if session is None or session["user_id"] != current_user["id"]:
+        raise HTTPException(status_code=404, detail="Chat session not found")
     
-    raise HTTPException(status_code=404, detail="Chat session not found")
+    etag = await versions_etag(f"session:{session_id}")
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    session = await run_db(db.get_session, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return FastJSONResponse(session, headers={"ETag": etag})
 
 @app.post("/chat/sessions", response_model=ChatSession, status_code=status.HTTP_201_CREATED)
 async def create_chat_session(title: str = Body(...), current_user: dict = Depends(get_current_active_user)):
@@ -456,30 +951,50 @@ async def create_chat_session(title: str = Body(...), current_user: dict = Depen
         "messages": []
     }
     
-    mock_chat_sessions.append(new_session)
+    await run_db(db.add_session, new_session)
+    analytics.record_session(new_session)
     return new_session
 
-@app.post("/chat/sessions/{session_id}/messages", response_model=Message)
-async def add_chat_message(
-    session_id: str, 
-    content: str = Body(...), 
+@app.delete("/chat/sessions/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_chat_session(session_id: str, current_user: dict = Depends(get_current_active_user)):
+    session = await run_db(db.get_session, session_id, False)
+    if session is not None and session["user_id"] == current_user["id"]:
+        await run_db(db.delete_session, session_id)
+        analytics.forget_session(session_id)
+        return
+    
+    raise HTTPException(status_code=404, detail="Chat session not found")
+
+@app.get("/chat/sessions/{session_id}/messages", response_model=MessagePage)
+async def get_chat_messages(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
     current_user: dict = Depends(get_current_active_user)
 ):
-    # Find the session
-    session = None
-    for s in mock_chat_sessions:
-        if s["id"] == session_id and s["user_id"] == current_user["id"]:
-            session = s
-            break
-    
-    if not session:
+    # Page back through history with `before`, or fetch only what arrived
+    # since the last message the client has with `after`
+    session = await run_db(db.get_session, session_id, False)
+    if not session or session["user_id"] != current_user["id"]:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    
+    page = await run_db(db.list_messages, session_id, limit, before, after)
+    if page is None:
+        raise HTTPException(status_code=400, detail="Unknown message cursor")
+    
+    messages, has_more = page
+    return FastJSONResponse({"messages": messages, "has_more": has_more})
+
+async def post_user_message(session_id: str, content: str, current_user: dict, route: str) -> dict:
+    """Validate the session, store the user's message and announce it to listeners"""
+    session = await run_db(db.get_session, session_id, False)
+    
+    if not session or session["user_id"] != current_user["id"]:
         raise HTTPException(status_code=404, detail="Chat session not found")
     
-    # Log user input to console for debugging and processing
-    print(f"\n[USER INPUT] User {current_user['name']} ({current_user['id']}) sent: {content}")
+    logger.info("chat.user_message", route, user_id=current_user["id"], session_id=session_id, content=content)
     
-    # Process the user message based on content
-    # Add user message
     user_message = {
         "id": str(uuid.uuid4()),
         "user_id": current_user["id"],
@@ -488,65 +1003,179 @@ async def add_chat_message(
         "type": "user"
     }
     
-    session["messages"].append(user_message)
-    session["updated_at"] = datetime.now().isoformat()
-    
-    # Generate bot response based on user input
-    bot_response = process_user_input(content)
+    await run_db(db.add_message, session_id, user_message)
+    analytics.record_message(session_id, user_message)
+    broadcaster.publish(session_id, "user_message", user_message)
+    return user_message
+
+# Appended to a reply whose backend failed partway, so neither listeners
+# nor the stored history take it for a complete answer
+INTERRUPTED_REPLY_NOTE = "\n\n[Reply interrupted]"
+
+async def generate_bot_reply(session_id: str, content: str, message_id: str) -> dict:
+    """Run the responder, fan its chunks out to session listeners and store the reply"""
+    chunks = []
+    try:
+        async for delta in reply_responder(content):
+            chunks.append(delta)
+            broadcaster.publish(session_id, "chunk", {"id": message_id, "delta": delta})
+    except ReplyInterrupted:
+        chunks.append(INTERRUPTED_REPLY_NOTE)
+        broadcaster.publish(session_id, "chunk", {"id": message_id, "delta": INTERRUPTED_REPLY_NOTE})
+    except Exception:
+        broadcaster.publish(session_id, "error", {"id": message_id, "detail": "Failed to generate a reply"})
+        raise
     
-    # Add bot response
     bot_message = {
-        "id": str(uuid.uuid4()),
+        "id": message_id,
         "user_id": "system",
-        "content": bot_response,
+        "content": "".join(chunks),
         "timestamp": datetime.now().isoformat(),
         "type": "bot"
     }
     
-    session["messages"].append(bot_message)
+    await run_db(db.add_message, session_id, bot_message)
+    analytics.record_message(session_id, bot_message)
+    broadcaster.publish(session_id, "bot_message", bot_message)
+    return bot_message
+
+def log_reply_failure(task: asyncio.Task):
+    """Log the exception a streamed reply's task ended with, as nothing awaits it"""
+    # Its listeners already got an "error" event
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("chat.reply_failed", "/chat/sessions/{session_id}/messages/stream", error=repr(task.exception()))
+
+@app.post("/chat/sessions/{session_id}/messages", response_model=Union[MessageExchange, Message])
+async def add_chat_message(
+    session_id: str, 
+    content: str = Body(...), 
+    include_reply: bool = False,
+    current_user: dict = Depends(get_current_active_user)
+):
+    async with chat_budget.admit(current_user["id"]):
+        user_message = await post_user_message(session_id, content, current_user, "/chat/sessions/{session_id}/messages")
+        
+        # Generate bot response based on user input
+        bot_message = await generate_bot_reply(session_id, content, str(uuid.uuid4()))
     
+    # Return both messages so the client does not need to refetch the session
+    if include_reply:
+        return {"user_message": user_message, "bot_message": bot_message}
     return user_message
 
-def process_user_input(user_input: str) -> str:
-    """Process user input and generate an appropriate response"""
-    # Convert to lowercase for easier matching
-    input_lower = user_input.lower()
-    
-    # Log the processing
-    print(f"[PROCESSING] Processing user input: '{user_input}'")
-    
-    # Simple keyword-based responses
-    if any(word in input_lower for word in ["hello", "hi", "hey", "greetings"]):
-        return "Hello! I'm your DevOps assistant. How can I help you today?"
-    
-    elif any(word in input_lower for word in ["kubernetes", "k8s", "cluster"]):
-        return "I see you're asking about Kubernetes. I can help with cluster management, pod deployment, and troubleshooting. What specific aspect are you interested in?"
-    
-    elif any(word in input_lower for word in ["docker", "container", "image"]):
-        return "Docker containers are a core part of modern DevOps. I can help with container creation, management, and optimization. What are you trying to accomplish?"
-    
-    elif any(word in input_lower for word in ["mongodb", "database", "nosql"]):
-        return "MongoDB is a popular NoSQL database. I can help with connection issues, query optimization, and data modeling. What's your specific question?"
+@app.post("/chat/sessions/{session_id}/messages/stream")
+async def stream_chat_message(
+    session_id: str,
+    content: str = Body(...),
+    current_user: dict = Depends(get_current_active_user)
+):
+    # Server-Sent Events: "user_message", then "chunk" events as the reply is
+    # produced, then the stored "bot_message". Other listeners on the session
+    # receive the same events.
+    bot_message_id = str(uuid.uuid4())
+    await chat_budget.acquire(current_user["id"])
+    subscriber = broadcaster.subscribe(session_id)
+    try:
+        await post_user_message(session_id, content, current_user, "/chat/sessions/{session_id}/messages/stream")
+    except Exception:
+        broadcaster.unsubscribe(subscriber)
+        chat_budget.release()
+        raise
     
-    elif any(word in input_lower for word in ["ci", "cd", "pipeline", "jenkins", "github actions"]):
-        return "Continuous Integration and Deployment pipelines are essential for modern development. Would you like help setting up a pipeline or troubleshooting an existing one?"
+    # The reply is generated in its own task, so it is still stored if the
+    # client disconnects mid-stream. It keeps its chat_budget slot until done.
+    task = asyncio.create_task(generate_bot_reply(session_id, content, bot_message_id))
+    reply_tasks.add(task)
+    task.add_done_callback(reply_tasks.discard)
+    task.add_done_callback(lambda _: chat_budget.release())
+    task.add_done_callback(log_reply_failure)
     
-    elif any(word in input_lower for word in ["error", "issue", "problem", "bug", "fix"]):
-        return "I'm sorry to hear you're experiencing an issue. Could you provide more details about the error message or symptoms you're seeing?"
+    return StreamingResponse(
+        sse_stream(broadcaster, subscriber, until_message_id=bot_message_id),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+@app.get("/chat/sessions/{session_id}/events")
+async def chat_session_events(session_id: str, current_user: dict = Depends(get_current_active_user)):
+    # Live Server-Sent Events for every new message in the session
+    session = await run_db(db.get_session, session_id, False)
+    if not session or session["user_id"] != current_user["id"]:
+        raise HTTPException(status_code=404, detail="Chat session not found")
     
-    elif any(word in input_lower for word in ["thanks", "thank you", "thx"]):
-        return "You're welcome! Is there anything else I can help you with?"
+    subscriber = broadcaster.subscribe(session_id)
+    return StreamingResponse(sse_stream(broadcaster, subscriber), media_type="text/event-stream", headers=SSE_HEADERS)
+
+def match_intent(user_input: str) -> Optional[str]:
+    """The keyword rules' reply to a message, or None if no intent matches"""
+    logger.debug("chat.processing", content=user_input)
     
-    # If no specific keywords are matched, provide a general response
-    else:
-        print(f"[NO MATCH] No specific pattern matched for: '{user_input}'")
-        return f"I've received your message about '{user_input}'. Can you provide more details so I can assist you better?"
+    # Keyword-based responses, matched in a single pass over the message
+    started = time.perf_counter()
+    intent = intent_matcher.match(user_input)
+    intent_latency.observe(time.perf_counter() - started, "false" if intent is None else "true")
+    return None if intent is None else intent.response
+
+def fallback_reply(user_input: str) -> str:
+    """General response for a message no backend answered"""
+    logger.info("chat.no_match", content=user_input)
+    return intent_matcher.fallback.format(message=user_input)
+
+def log_responder_failure(backend: str, outcome: str, exc: BaseException):
+    logger.warning("chat.responder_failed", backend=backend, outcome=outcome, error=repr(exc))
+
+# Bot replies come from a chain of backends: the keyword rules first, then
+# RESPONDER_URL (a reply service, see HTTPBackend) and the RESPONDER_FUNCTIONS
+# ("module:function,..." returning a reply or None, run on a pool of
+# RESPONDER_WORKERS processes), then the keyword fallback. The services and
+# functions get RESPONDER_TIMEOUT seconds to start replying and then as long
+# between chunks, and at most RESPONDER_MAX_CONCURRENT calls run at once. Up
+# to REPLY_CACHE_SIZE replies are cached for REPLY_CACHE_TTL seconds, keyed on
+# the message's words.
+responder_backends = [FunctionBackend("intents", match_intent)]
+if os.environ.get("RESPONDER_URL"):
+    responder_backends.append(HTTPBackend("service", os.environ["RESPONDER_URL"]))
+responder_pool = None
+RESPONDER_FUNCTIONS = [spec.strip() for spec in os.environ.get("RESPONDER_FUNCTIONS", "").split(",") if spec.strip()]
+if RESPONDER_FUNCTIONS:
+    # Spawned rather than forked: the app process has threads running
+    responder_pool = ProcessPoolExecutor(
+        int(os.environ.get("RESPONDER_WORKERS", "2")), mp_context=multiprocessing.get_context("spawn")
+    )
+    for spec in RESPONDER_FUNCTIONS:
+        responder_backends.append(PoolBackend(spec, load_function(spec), responder_pool))
+responder_backends.append(FunctionBackend("fallback", fallback_reply, cacheable=False))
+
+responder_pipeline = ResponderPipeline(
+    responder_backends,
+    timeout=float(os.environ.get("RESPONDER_TIMEOUT", "10")),
+    max_concurrent=int(os.environ.get("RESPONDER_MAX_CONCURRENT", "16")),
+    cache_size=int(os.environ.get("REPLY_CACHE_SIZE", "1024")),
+    cache_ttl=float(os.environ.get("REPLY_CACHE_TTL", "3600")),
+    on_failure=log_responder_failure,
+)
+
+# Produces bot replies as an async iterator of text chunks
+reply_responder = responder_pipeline
+
+@app.on_event("shutdown")
+async def close_responders():
+    await responder_pipeline.close()
+    if responder_pool is not None:
+        responder_pool.shutdown(cancel_futures=True)
 
 # Credential management routes
 @app.get("/credentials", response_model=List[Credential])
-async def get_credentials(current_user: dict = Depends(get_current_active_user)):
-    user_credentials = [cred for cred in mock_credentials if cred["user_id"] == current_user["id"]]
-    return user_credentials
+async def get_credentials(
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_active_user)
+):
+    etag = await versions_etag(f"credentials:{current_user['id']}")
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    credentials = await run_db(db.list_credentials, current_user["id"])
+    return FastJSONResponse(credentials, headers={"ETag": etag})
 
 @app.post("/credentials", response_model=Credential, status_code=status.HTTP_201_CREATED)
 async def add_credential(
@@ -563,25 +1192,220 @@ async def add_credential(
         "updated_at": datetime.now().isoformat()
     }
     
-    mock_credentials.append(new_credential)
+    await run_db(db.add_credential, new_credential)
     return new_credential
 
 @app.delete("/credentials/{credential_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_credential(credential_id: str, current_user: dict = Depends(get_current_active_user)):
-    for i, cred in enumerate(mock_credentials):
-        if cred["id"] == credential_id and cred["user_id"] == current_user["id"]:
-            mock_credentials.pop(i)
-            return
+    cred = await run_db(db.get_credential, credential_id)
+    if cred is not None and cred["user_id"] == current_user["id"]:
+        await run_db(db.delete_credential, credential_id)
+        await service_clients.invalidate(credential_id)
+        return
     
     raise HTTPException(status_code=404, detail="Credential not found")
 
+@app.post("/credentials/{credential_id}/check")
+async def check_credential(credential_id: str, current_user: dict = Depends(get_current_active_user)):
+    # Only admin users can make the server connect out; the pool also
+    # refuses hosts on private networks unless CLIENT_ALLOW_PRIVATE is set
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Not authorized to check credentials")
+    
+    # Reach the service through its pooled client; after the first call
+    # this reuses the open connection
+    cred = await run_db(db.get_credential, credential_id)
+    if cred is None or cred["user_id"] != current_user["id"]:
+        raise HTTPException(status_code=404, detail="Credential not found")
+    
+    try:
+        client = await service_clients.get(cred)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    started = time.perf_counter()
+    healthy = await client.check()
+    return {"healthy": healthy, "latency_ms": round((time.perf_counter() - started) * 1000, 3)}
+
 # Admin analytics routes
 @app.get("/admin/analytics")
-async def get_admin_analytics(current_user: dict = Depends(get_current_active_user)):
+async def get_admin_analytics(
+    days: int = Query(7, ge=1, le=ANALYTICS_RETENTION_DAYS),
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_active_user)
+):
     # Only admin users can access analytics
     if current_user["role"] != "Admin":
         raise HTTPException(status_code=403, detail="Not authorized to access analytics")
     
-    return mock_analytics
+    # The report's time buckets move on every hour
+    hour = int(time.time() // HOUR)
+    if isinstance(analytics, StoreAnalytics):
+        # Active users come from lastActive, so write this worker's batch
+        await activity_tracker.flush()
+        etag = await versions_etag("analytics", "users", params=(days, hour))
+    else:
+        etag = make_etag(analytics.epoch, analytics.version, days, hour)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    return FastJSONResponse(await run_db(analytics.report, days), headers={"ETag": etag})
+
+@app.post("/admin/analytics/rebuild")
+async def rebuild_admin_analytics(current_user: dict = Depends(get_current_active_user)):
+    # Recompute all counters from storage, e.g. after an import or restore
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Not authorized to rebuild analytics")
+    
+    global analytics
+    analytics = await run_db(build_analytics)
+    return FastJSONResponse(await run_db(analytics.report))
+
+@app.get("/admin/token-cache")
+async def get_token_cache_stats(current_user: dict = Depends(get_current_active_user)):
+    # Only admin users can inspect the token cache
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Not authorized to access cache statistics")
+    
+    return token_cache.stats()
+
+@app.get("/admin/admission")
+async def get_admission_stats(current_user: dict = Depends(get_current_active_user)):
+    # Only admin users can inspect admission control
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Not authorized to access admission statistics")
+    
+    return {
+        "in_flight": in_flight_limit.stats(),
+        "budgets": {budget.name: budget.stats() for budget in (chat_budget, login_budget)},
+        "login_failures": login_failures.stats(),
+    }
+
+@app.get("/admin/responders")
+async def get_responder_stats(current_user: dict = Depends(get_current_active_user)):
+    # Only admin users can inspect the reply pipeline
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Not authorized to access responder statistics")
+    
+    return responder_pipeline.stats()
+
+@app.get("/admin/snapshots")
+async def get_snapshot_stats(current_user: dict = Depends(get_current_active_user)):
+    # Only admin users can inspect snapshots
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Not authorized to access snapshot statistics")
+    if snapshots is None:
+        raise HTTPException(status_code=404, detail="Snapshots are not enabled")
+    
+    return snapshots.stats()
+
+@app.post("/admin/snapshots")
+async def save_snapshot(current_user: dict = Depends(get_current_active_user)):
+    # Only admin users can write a snapshot on demand, e.g. before a deploy
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Not authorized to write snapshots")
+    if snapshots is None:
+        raise HTTPException(status_code=404, detail="Snapshots are not enabled")
+    
+    if not await snapshots.save():
+        raise HTTPException(status_code=409, detail="A snapshot is already being written")
+    return snapshots.stats()
+
+@app.get("/admin/logging")
+async def get_logging_stats(current_user: dict = Depends(get_current_active_user)):
+    # Only admin users can inspect the log queue
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Not authorized to access logging statistics")
+    
+    return logger.stats()
+
+# Metrics
+store_records = metrics.gauge("store_records", "Records in the data store", ("kind",))
+token_cache_lookups = metrics.counter("token_cache_lookups_total", "Token cache lookups", ("result",))
+log_records = metrics.counter("log_records_total", "Log records by outcome", ("outcome",))
+password_hashes_pending = metrics.gauge("password_hashes_pending", "Password hashes queued or running")
+password_hashes_rejected = metrics.counter("password_hashes_rejected_total", "Password hashes refused because the queue was full")
+stream_subscribers = metrics.gauge("stream_subscribers", "Open chat event streams")
+service_clients_open = metrics.gauge("service_clients", "Pooled service clients")
+service_client_events = metrics.counter("service_client_events_total", "Service client pool events", ("event",))
+admission_requests = metrics.counter("admission_requests_total", "Admission decisions by budget", ("budget", "outcome"))
+admission_in_flight = metrics.gauge("admission_in_flight", "Requests holding an admission slot", ("budget",))
+rate_limit_buckets = metrics.gauge("rate_limit_buckets", "Active rate limit buckets", ("budget",))
+responder_calls = metrics.counter("responder_calls_total", "Reply backend calls by outcome", ("backend", "outcome"))
+responder_in_flight = metrics.gauge("responder_in_flight", "Reply backend calls holding a concurrency slot")
+reply_cache_lookups = metrics.counter("reply_cache_lookups_total", "Reply cache lookups", ("result",))
+
+def count_records() -> Dict[str, int]:
+    return {
+        "users": db.count_users(),
+        "chat_sessions": db.count_sessions(),
+        "messages": db.count_messages(),
+        "credentials": db.count_credentials(),
+    }
+
+@metrics.collector
+async def collect_gauges():
+    for kind, count in (await run_db(count_records)).items():
+        store_records.set(count, kind)
+    cache = token_cache.stats()
+    token_cache_lookups.set(cache["hits"], "hit")
+    token_cache_lookups.set(cache["misses"], "miss")
+    log = logger.stats()
+    log_records.set(log["written"], "written")
+    log_records.set(log["dropped"], "dropped")
+    log_records.set(log["sampled_out"], "sampled_out")
+    hasher = password_hasher.stats()
+    password_hashes_pending.set(hasher["pending"])
+    password_hashes_rejected.set(hasher["rejected"])
+    stream_subscribers.set(broadcaster.subscriber_count())
+    pool = service_clients.stats()
+    service_clients_open.set(pool["size"])
+    for event in ("created", "reused", "evicted", "failed_checks"):
+        service_client_events.set(pool[event], event)
+    admission_in_flight.set(in_flight_limit.in_flight, "global")
+    admission_requests.set(in_flight_limit.shed, "global", "shed")
+    for budget in (chat_budget, login_budget):
+        budget_stats = budget.stats()
+        admission_in_flight.set(budget_stats["in_flight"], budget.name)
+        rate_limit_buckets.set(budget_stats["buckets"], budget.name)
+        for outcome in ("admitted", "queued", "rate_limited", "busy"):
+            admission_requests.set(budget_stats[outcome], budget.name, outcome)
+    failure_stats = login_failures.stats()
+    rate_limit_buckets.set(failure_stats["buckets"], login_failures.name)
+    admission_requests.set(failure_stats["rate_limited"], login_failures.name, "rate_limited")
+    responders = responder_pipeline.stats()
+    responder_in_flight.set(responders["in_flight"])
+    for backend, outcomes in responders["calls"].items():
+        for outcome, count in outcomes.items():
+            responder_calls.set(count, backend, outcome)
+    reply_cache_lookups.set(responders["cache"]["hits"], "hit")
+    reply_cache_lookups.set(responders["cache"]["misses"], "miss")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(current_user: dict = Depends(get_current_active_user)):
+    # Only admin users can scrape metrics over the public port
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Not authorized to access metrics")
+    
+    return PlainTextResponse(await metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+metrics_server = None
+
+@app.on_event("startup")
+async def start_metrics_server():
+    global metrics_server
+    port = os.environ.get("METRICS_PORT")
+    if not port:
+        return
+    try:
+        metrics_server = await serve_local(os.environ.get("METRICS_HOST", "127.0.0.1"), int(port), metrics.render)
+    except OSError as exc:
+        # e.g. another worker already listens on the port
+        logger.warning("metrics.port_unavailable", port=port, error=str(exc))
+
+@app.on_event("shutdown")
+async def stop_metrics_server():
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
 
 # Run with: uvicorn main:app --reload
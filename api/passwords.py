@@ -0,0 +1,148 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+# Password hashing
+#
+# Hashes are salted scrypt (default) or PBKDF2-SHA256 strings that carry
+# their own parameters:
+#
+#     scrypt$<n>$<r>$<p>$<salt>$<hash>
+#     pbkdf2_sha256$<iterations>$<salt>$<hash>
+#
+# Both KDFs release the GIL, so hashing runs on a small thread pool and never
+# blocks the event loop. The number of hashes queued or running is capped;
+# past the cap, hash()/verify() raise HasherBusy instead of letting a login
+# storm build an unbounded backlog.
+#
+# verify() also reports whether a stored hash should be replaced: the
+# unsalted SHA-256 hashes from before this module, and hashes made with
+# other parameters than the current ones.
+
+SALT_BYTES = 16
+
+
+class HasherBusy(Exception):
+    """Too many password hashes are already queued"""
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        algorithm: str = "scrypt",
+        scrypt_n: int = 2 ** 14,
+        scrypt_r: int = 8,
+        scrypt_p: int = 1,
+        pbkdf2_iterations: int = 600_000,
+        workers: int = 4,
+        max_pending: int = 64,
+        legacy_secret: Optional[str] = None,
+    ):
+        if algorithm not in ("scrypt", "pbkdf2_sha256"):
+            raise ValueError(f"Unsupported password hash algorithm {algorithm!r}")
+        self.algorithm = algorithm
+        self.scrypt_n = scrypt_n
+        self.scrypt_r = scrypt_r
+        self.scrypt_p = scrypt_p
+        self.pbkdf2_iterations = pbkdf2_iterations
+        self.max_pending = max_pending
+        self.legacy_secret = legacy_secret
+        # workers=0 hashes inline on the calling thread
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="passwords") if workers else None
+        self.pending = 0
+        self.rejected = 0
+
+    # Async API for route handlers
+    async def hash(self, password: str) -> str:
+        return await self._run(self.hash_sync, password)
+
+    async def hash_many(self, passwords: List[str], batch: int = 4) -> List[str]:
+        """Hash passwords ``batch`` at a time, leaving the queue to logins"""
+        hashes: List[str] = []
+        for start in range(0, len(passwords), batch):
+            hashes += await asyncio.gather(*(self.hash(password) for password in passwords[start:start + batch]))
+        return hashes
+
+    async def verify(self, password: str, stored: str) -> Tuple[bool, bool]:
+        """Return (matches, needs_rehash)"""
+        return await self._run(self.verify_sync, password, stored)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    # Blocking implementation
+    def hash_sync(self, password: str) -> str:
+        salt = os.urandom(SALT_BYTES)
+        if self.algorithm == "scrypt":
+            params = (self.scrypt_n, self.scrypt_r, self.scrypt_p)
+            digest = _scrypt(password, salt, *params)
+        else:
+            params = (self.pbkdf2_iterations,)
+            digest = _pbkdf2(password, salt, *params)
+        return "$".join([self.algorithm, *map(str, params), _b64(salt), _b64(digest)])
+
+    def verify_sync(self, password: str, stored: str) -> Tuple[bool, bool]:
+        parts = stored.split("$")
+        try:
+            if parts[0] == "scrypt" and len(parts) == 6:
+                n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+                expected = _unb64(parts[5])
+                ok = hmac.compare_digest(_scrypt(password, _unb64(parts[4]), n, r, p), expected)
+                current = self.algorithm == "scrypt" and (n, r, p) == (self.scrypt_n, self.scrypt_r, self.scrypt_p)
+                return ok, ok and not current
+            if parts[0] == "pbkdf2_sha256" and len(parts) == 4:
+                iterations = int(parts[1])
+                expected = _unb64(parts[3])
+                ok = hmac.compare_digest(_pbkdf2(password, _unb64(parts[2]), iterations), expected)
+                current = self.algorithm == "pbkdf2_sha256" and iterations == self.pbkdf2_iterations
+                return ok, ok and not current
+        except ValueError:
+            return False, False
+        if len(stored) == 64 and self.legacy_secret is not None:
+            # Unsalted sha256(password + secret) from the original API
+            legacy = hashlib.sha256((password + self.legacy_secret).encode()).hexdigest()
+            ok = hmac.compare_digest(legacy, stored)
+            return ok, ok
+        return False, False
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HasherBusy()
+        self.pending += 1
+        try:
+            if self._executor is None:
+                return fn(*args)
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "algorithm": self.algorithm,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+        }
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # maxmem leaves headroom above the 128 * n * r bytes scrypt needs
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 2 ** 20, dklen=32)
+
+
+def _pbkdf2(password: str, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+
+def _b64(raw: bytes) -> str:
+    return base64.b64encode(raw).decode()
+
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text.encode(), validate=True)
@@ -0,0 +1,274 @@
+import asyncio
+import importlib
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+import httpx
+
+# Bot reply pipeline
+#
+# A reply is an async iterator of text chunks, so backends that produce text
+# gradually can stream it. ResponderPipeline asks its backends in order and
+# the first one to produce any text answers. A backend that produces nothing
+# declines, and one that fails or runs out of time before its first chunk is
+# skipped. Once text has gone out, a failure raises ReplyInterrupted, so the
+# caller can mark the partial reply instead of keeping it as a whole one.
+#
+# Backends marked ``slow`` (anything beyond the keyword rules: a model, a
+# retrieval step, a remote service) get ``timeout`` seconds to produce their
+# first chunk, counting any wait for a turn, and then ``timeout`` seconds
+# between chunks, so a long reply that keeps streaming is never cut off. At
+# most ``max_concurrent`` of their calls run at once. Blocking, CPU-bound
+# functions run on an executor through PoolBackend, off the event loop.
+#
+# Complete replies from cacheable backends are kept in an LRU cache keyed on
+# the message's lowercased words, so a repeated question is answered without
+# asking any backend.
+
+# Longest normalized message whose reply is cached
+MAX_CACHED_INPUT = 500
+
+
+def cache_key(text: str) -> Optional[str]:
+    """The message as lowercase words separated by single spaces, if short enough to cache"""
+    key = " ".join(re.findall(r"\w+", text.lower()))
+    return key if 0 < len(key) <= MAX_CACHED_INPUT else None
+
+
+def load_function(spec: str) -> Callable[[str], Optional[str]]:
+    """Import a "module:function" reference"""
+    module, _, name = spec.partition(":")
+    if not name:
+        raise ValueError(f"Expected module:function, got {spec!r}")
+    return getattr(importlib.import_module(module), name)
+
+
+class Backend:
+    """One way of answering a chat message"""
+
+    # Slow backends run under the pipeline's deadline and concurrency limit
+    slow = True
+    # Whether complete replies go into the reply cache
+    cacheable = True
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def stream(self, text: str) -> AsyncIterator[str]:
+        """Reply chunks; none at all declines the message"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class FunctionBackend(Backend):
+    """Answers inline with a quick function of the message; None declines"""
+
+    slow = False
+
+    def __init__(self, name: str, fn: Callable[[str], Optional[str]], cacheable: bool = True):
+        super().__init__(name)
+        self.fn = fn
+        self.cacheable = cacheable
+
+    async def stream(self, text: str) -> AsyncIterator[str]:
+        reply = self.fn(text)
+        if reply:
+            yield reply
+
+
+class PoolBackend(Backend):
+    """Runs a blocking function of the message on an executor; None declines"""
+
+    def __init__(self, name: str, fn: Callable[[str], Optional[str]], executor: Executor):
+        super().__init__(name)
+        # With a process pool, fn must be importable by reference
+        self.fn = fn
+        self.executor = executor
+
+    async def stream(self, text: str) -> AsyncIterator[str]:
+        reply = await asyncio.get_running_loop().run_in_executor(self.executor, self.fn, text)
+        if reply:
+            yield reply
+
+
+class HTTPBackend(Backend):
+    """POSTs {"message": ...} to a reply service and streams back the response body
+
+    The service declines with 204 or an empty body.
+    """
+
+    def __init__(self, name: str, url: str, timeout: float = 30.0):
+        super().__init__(name)
+        self.url = url
+        self.http = httpx.AsyncClient(timeout=timeout)
+
+    async def stream(self, text: str) -> AsyncIterator[str]:
+        async with self.http.stream("POST", self.url, json={"message": text}) as response:
+            if response.status_code == 204:
+                return
+            response.raise_for_status()
+            async for chunk in response.aiter_text():
+                if chunk:
+                    yield chunk
+
+    async def close(self):
+        await self.http.aclose()
+
+
+class ReplyCache:
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0):
+        # max_size=0 turns the cache off
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (expires_at, reply), least recently used first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() >= entry[0]:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, reply: str):
+        if not self.max_size:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, reply)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+OUTCOMES = ("answered", "declined", "timeout", "busy", "failed")
+
+
+class ResponderPipeline:
+    def __init__(
+        self,
+        backends: List[Backend],
+        timeout: float = 10.0,
+        max_concurrent: int = 16,
+        cache_size: int = 1024,
+        cache_ttl: float = 3600.0,
+        on_failure: Optional[Callable[[str, str, BaseException], None]] = None,
+    ):
+        self.backends = backends
+        # Called with (backend name, "timeout" or "failed", exception)
+        self.on_failure = on_failure
+        self.timeout = timeout
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self.cache = ReplyCache(cache_size, cache_ttl)
+        self.in_flight = 0
+        # backend name -> outcome -> calls
+        self.calls: Dict[str, Dict[str, int]] = {backend.name: dict.fromkeys(OUTCOMES, 0) for backend in backends}
+
+    def __call__(self, text: str) -> AsyncIterator[str]:
+        return self.reply(text)
+
+    async def reply(self, text: str) -> AsyncIterator[str]:
+        key = cache_key(text)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        for backend in self.backends:
+            counts = self.calls[backend.name]
+            chunks: List[str] = []
+            try:
+                async for chunk in self._call(backend, text):
+                    chunks.append(chunk)
+                    yield chunk
+            except _Busy:
+                counts["busy"] += 1
+                continue
+            except Exception as exc:
+                outcome = "timeout" if isinstance(exc, asyncio.TimeoutError) else "failed"
+                counts[outcome] += 1
+                if self.on_failure is not None:
+                    self.on_failure(backend.name, outcome, exc)
+                if chunks:
+                    raise ReplyInterrupted(backend.name, "".join(chunks)) from exc
+                continue
+            if not chunks:
+                counts["declined"] += 1
+                continue
+            counts["answered"] += 1
+            if backend.cacheable and key is not None:
+                self.cache.put(key, "".join(chunks))
+            return
+
+    async def _call(self, backend: Backend, text: str) -> AsyncIterator[str]:
+        if not backend.slow:
+            async for chunk in backend.stream(text):
+                yield chunk
+            return
+
+        loop = asyncio.get_running_loop()
+        # The first chunk is due within timeout of the call, later ones
+        # within timeout of the chunk before
+        deadline = loop.time() + self.timeout
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise _Busy() from None
+        self.in_flight += 1
+        stream = backend.stream(text)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), deadline - loop.time())
+                except StopAsyncIteration:
+                    return
+                yield chunk
+                deadline = loop.time() + self.timeout
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+            await stream.aclose()
+
+    async def close(self):
+        for backend in self.backends:
+            await backend.close()
+
+    def stats(self) -> dict:
+        return {
+            "backends": [backend.name for backend in self.backends],
+            "timeout": self.timeout,
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "cache": self.cache.stats(),
+        }
+
+
+class ReplyInterrupted(Exception):
+    """A backend failed after part of its reply went out; ``partial`` is that part"""
+
+    def __init__(self, backend: str, partial: str):
+        super().__init__(f"{backend}: reply interrupted")
+        self.backend = backend
+        self.partial = partial
+
+
+class _Busy(Exception):
+    """No concurrency slot came free before the deadline"""
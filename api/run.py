@@ -1,6 +1,48 @@
+import argparse
+import os
+import sys
 
 import uvicorn
 
+# Run modes
+#
+# Without --workers the API runs as a single auto-reloading dev server.
+# With --workers N it runs N production workers that must share their state
+# and signing key, so it needs STORAGE_BACKEND=sqlite and uses SECRET_KEY (or
+# a SECRET_KEY_FILE, devops_bot.key by default) to sign tokens. Each worker
+# keeps a verified-token cache, so TOKEN_CACHE_TTL defaults to a few seconds
+# to bound how long a deleted or deactivated user stays signed in on the
+# other workers.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the DevOps Bot API")
+    parser.add_argument("--host", default=os.environ.get("API_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("API_PORT", "8000")))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ["API_WORKERS"]) if os.environ.get("API_WORKERS") else None,
+        help="number of production worker processes (default: one reloading dev server)",
+    )
+    args = parser.parse_args()
+
+    if args.workers is None:
+        print(f"Starting DevOps Bot API on http://localhost:{args.port}")
+        uvicorn.run("main:app", host=args.host, port=args.port, reload=True)
+        return
+
+    if args.workers > 1 and os.environ.get("STORAGE_BACKEND", "memory") != "sqlite":
+        sys.exit("--workers > 1 needs a shared store: set STORAGE_BACKEND=sqlite")
+    if not os.environ.get("SECRET_KEY"):
+        os.environ.setdefault("SECRET_KEY_FILE", "devops_bot.key")
+    if args.workers > 1:
+        os.environ.setdefault("TOKEN_CACHE_TTL", "5")
+
+    # Workers are spawned with this environment
+    print(f"Starting DevOps Bot API on http://localhost:{args.port} with {args.workers} workers")
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+
+
 if __name__ == "__main__":
-    print("Starting DevOps Bot API on http://localhost:8000")
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    main()
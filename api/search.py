@@ -0,0 +1,421 @@
+import functools
+import json
+import math
+import re
+import struct
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Per-user inverted index over chat messages
+#
+# Every message is indexed under the owner of its session, bot replies
+# included, so a user only ever searches their own history. Each user
+# numbers their documents in the order they were indexed and maps term ->
+# postings, one array of 64-bit entries, each the document number shifted
+# left by 8 bits plus the term's count in that message (capped at 255).
+#
+# A query ANDs its terms. The rarest term's postings are walked newest first
+# and the other terms are probed by binary search. Matches are ranked with
+# BM25, newer messages first on ties. Only the newest MAX_CANDIDATES matches
+# are ranked, so a query for a very common word costs no more than that;
+# search() says when it left older matches out.
+#
+# Deleting a session drops its documents at once; their postings entries are
+# skipped by queries, and the session's messages are tokenized again to take
+# them out of the per-term counts of live documents that BM25 weighs terms
+# by, so scores never count deleted messages. Once a user's deleted documents outnumber the live
+# ones, the user's index is compacted: the live documents are renumbered and
+# everything about the deleted ones dropped, so the index stays proportional
+# to the messages that still exist.
+#
+# Documents refer to messages by (session id, position in the session), and
+# only the messages on the returned page are loaded through ``load_message``,
+# so the index holds no message text.
+#
+# An index restored from a snapshot (see snapshot.py) decodes a user's
+# postings and documents the first time that user's index is used.
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+MAX_QUERY_TERMS = 8
+MAX_CANDIDATES = 1000
+SEARCH_SNIPPET_LENGTH = 160
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def query_terms(query: str) -> List[str]:
+    """Distinct terms of a search query, in order, capped at MAX_QUERY_TERMS"""
+    return list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+
+
+def make_snippet(content: str, terms: List[str], length: int = SEARCH_SNIPPET_LENGTH) -> str:
+    """The part of content around the first query term"""
+    lowered = content.lower()
+    found = [position for position in (lowered.find(term) for term in terms) if position >= 0]
+    start = max(0, min(found, default=0) - length // 4)
+    snippet = content[start:start + length]
+    if start > 0:
+        snippet = "…" + snippet
+    if start + length < len(content):
+        snippet += "…"
+    return snippet
+
+
+def search_hit(session: dict, message: dict, terms: List[str], score: float) -> dict:
+    return {
+        "session_id": session["id"],
+        "session_title": session["title"],
+        "message_id": message["id"],
+        "type": message["type"],
+        "timestamp": message["timestamp"],
+        "snippet": make_snippet(message["content"], terms),
+        "score": round(score, 4),
+    }
+
+
+def bm25_idf(documents: int, matching: int) -> float:
+    """Weight of a term found in ``matching`` of a user's ``documents`` messages"""
+    return math.log(1 + max(0.0, documents - matching + 0.5) / (matching + 0.5))
+
+
+def bm25_score(counts: List[int], idfs: List[float], length: int, average_length: float) -> float:
+    """BM25 score of a message of ``length`` tokens holding each term ``counts`` times
+
+    SearchIndex.search() inlines the same sum; SQLiteStore ranks with this
+    so both backends score a message alike.
+    """
+    norm = K1 * (1 - B) + K1 * B / average_length * length
+    return sum(idf * count / (count + norm) for count, idf in zip(counts, idfs)) * (K1 + 1)
+
+
+def encode_user(
+    postings: Dict[str, array],
+    frequencies: Dict[str, int],
+    doc_sessions: List[Optional[str]],
+    positions: array,
+    lengths: array,
+) -> bytes:
+    """A user's index: terms, postings lengths, live document counts and
+    session ids as compressed JSON, then the postings back to back and the
+    document tables, compressed"""
+    session_ids = list(dict.fromkeys(session_id for session_id in doc_sessions if session_id is not None))
+    numbers = {session_id: number for number, session_id in enumerate(session_ids)}
+    header = zlib.compress(json.dumps([
+        list(postings), [len(entries) for entries in postings.values()],
+        [frequencies.get(term, 0) for term in postings], session_ids, len(doc_sessions),
+    ]).encode())
+    body = array("Q")
+    for entries in postings.values():
+        body.extend(entries)
+    docs = array("i", (-1 if session_id is None else numbers[session_id] for session_id in doc_sessions))
+    tables = body.tobytes() + docs.tobytes() + positions.tobytes() + lengths.tobytes()
+    return struct.pack("<I", len(header)) + header + zlib.compress(tables, 1)
+
+
+def decode_user(blob: bytes) -> Tuple[Dict[str, array], Dict[str, int], List[Optional[str]], array, array]:
+    (header_length,) = struct.unpack_from("<I", blob)
+    terms, lengths, frequencies, session_ids, count = json.loads(zlib.decompress(blob[4:4 + header_length]))
+    tables = memoryview(zlib.decompress(blob[4 + header_length:]))
+    body = array("Q")
+    body.frombytes(tables[:sum(lengths) * body.itemsize])
+    tables = tables[len(body) * body.itemsize:]
+    docs, doc_positions, doc_lengths = array("i"), array("I"), array("I")
+    for table in (docs, doc_positions, doc_lengths):
+        table.frombytes(tables[:count * table.itemsize])
+        tables = tables[count * table.itemsize:]
+    postings, start = {}, 0
+    for term, length in zip(terms, lengths):
+        postings[term] = body[start:start + length]
+        start += length
+    doc_sessions = [None if number < 0 else session_ids[number] for number in docs]
+    frequencies = {term: frequency for term, frequency in zip(terms, frequencies) if frequency}
+    return postings, frequencies, doc_sessions, doc_positions, doc_lengths
+
+
+class _UserIndex:
+    __slots__ = (
+        "postings", "frequencies", "doc_sessions", "doc_positions", "doc_lengths", "session_docs",
+        "live", "dead", "total_length", "_pending",
+    )
+
+    def __init__(self):
+        # term -> array("Q") of doc << 8 | count
+        self.postings: Dict[str, array] = {}
+        # term -> number of live documents holding it
+        self.frequencies: Dict[str, int] = {}
+        # doc -> session id (None once deleted), the message's position in
+        # its session and its token count
+        self.doc_sessions: List[Optional[str]] = []
+        self.doc_positions = array("I")
+        self.doc_lengths = array("I")
+        # session id -> its live documents
+        self.session_docs: Dict[str, array] = {}
+        self.live = 0
+        self.dead = 0
+        self.total_length = 0
+        # For a restored user, returns the encoded index
+        self._pending: Optional[Callable[[], bytes]] = None
+
+    def load(self) -> "_UserIndex":
+        """This user's index, decoding it first if it was restored"""
+        if self._pending is not None:
+            self.postings, self.frequencies, self.doc_sessions, self.doc_positions, self.doc_lengths = (
+                decode_user(self._pending())
+            )
+            self._pending = None
+            self.session_docs = _session_docs(self.doc_sessions)
+        return self
+
+
+class SearchIndex:
+    def __init__(self, load_message: Callable[[str, int], dict]):
+        self._load_message = load_message
+        self._users: Dict[str, _UserIndex] = {}
+        # session_id -> session, for every indexed session
+        self._sessions: Dict[str, dict] = {}
+
+    def capture(self) -> Callable[[Callable[[bytes], list]], dict]:
+        """The index as of now, as a function that writes it out through ``blob``
+
+        Cheap enough to call on the event loop: postings arrays only ever
+        grow past the captured lengths (compaction replaces them), so they
+        are copied when the returned function runs. ``blob`` stores bytes
+        and returns a reference to them.
+        """
+        sessions = list(self._sessions)
+        users = {}
+        for user_id, user in self._users.items():
+            if user._pending is not None:
+                encoded = user._pending
+            else:
+                captured = [(term, entries, len(entries)) for term, entries in user.postings.items()]
+                encoded = functools.partial(
+                    _encode_captured, captured, dict(user.frequencies),
+                    list(user.doc_sessions), array("I", user.doc_positions), array("I", user.doc_lengths),
+                )
+            users[user_id] = (user.live, user.dead, user.total_length, encoded)
+
+        def write(blob: Callable[[bytes], list]) -> dict:
+            return {
+                "sessions": sessions,
+                "users": {
+                    user_id: [live, dead, total_length, blob(encoded())]
+                    for user_id, (live, dead, total_length, encoded) in users.items()
+                },
+            }
+
+        return write
+
+    @classmethod
+    def restore(
+        cls,
+        load_message: Callable[[str, int], dict],
+        image: dict,
+        sessions: Dict[str, dict],
+        read: Callable[[list], bytes],
+    ) -> "SearchIndex":
+        """The index written by capture(), for the given session records
+
+        ``read`` returns the bytes behind a reference; users' indexes are
+        read when first used.
+        """
+        index = cls(load_message)
+        index._sessions = {session_id: sessions[session_id] for session_id in image["sessions"]}
+        for user_id, (live, dead, total_length, ref) in image["users"].items():
+            user = index._users[user_id] = _UserIndex()
+            user.live, user.dead, user.total_length = live, dead, total_length
+            user._pending = functools.partial(read, ref)
+        return index
+
+    def add_session(self, session: dict):
+        self._sessions[session["id"]] = session
+        for position, message in enumerate(session.get("messages", [])):
+            self.add_message(session["id"], message, position)
+
+    def add_message(self, session_id: str, message: dict, position: int):
+        session = self._sessions.get(session_id)
+        if session is None:
+            return
+        user = self._users.get(session["user_id"])
+        if user is None:
+            user = self._users[session["user_id"]] = _UserIndex()
+        user.load()
+
+        doc = len(user.doc_sessions)
+        tokens = tokenize(message["content"])
+        frequencies = user.frequencies
+        for term, count in Counter(tokens).items():
+            postings = user.postings.get(term)
+            if postings is None:
+                postings = user.postings[term] = array("Q")
+            postings.append(doc << 8 | min(count, 255))
+            frequencies[term] = frequencies.get(term, 0) + 1
+        user.doc_sessions.append(session_id)
+        user.doc_positions.append(position)
+        user.doc_lengths.append(len(tokens))
+        docs = user.session_docs.get(session_id)
+        if docs is None:
+            docs = user.session_docs[session_id] = array("I")
+        docs.append(doc)
+        user.live += 1
+        user.total_length += len(tokens)
+
+    def delete_session(self, session_id: str, messages: Iterable[dict]):
+        """Drop a session's documents; ``messages`` are the messages it had, in order"""
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return
+        user = self._users.get(session["user_id"])
+        if user is None:
+            return
+        docs = user.load().session_docs.pop(session_id, None)
+        if docs is None:
+            return
+        for doc in docs:
+            user.doc_sessions[doc] = None
+            user.total_length -= user.doc_lengths[doc]
+        frequencies = user.frequencies
+        for message in messages:
+            for term in set(tokenize(message["content"])):
+                frequency = frequencies[term] - 1
+                if frequency:
+                    frequencies[term] = frequency
+                else:
+                    del frequencies[term]
+        user.live -= len(docs)
+        user.dead += len(docs)
+        if not user.live:
+            del self._users[session["user_id"]]
+        elif user.dead > user.live:
+            _compact(user)
+
+    def search(self, user_id: str, query: str, limit: int, offset: int = 0) -> Tuple[List[dict], bool, bool]:
+        """One page of ranked hits for the user's messages containing every query term
+
+        Also returns whether more hits follow, and whether the query matched
+        more than MAX_CANDIDATES messages, so only the newest of them were
+        ranked.
+        """
+        terms = query_terms(query)
+        user = self._users.get(user_id)
+        if not terms or user is None or not user.live:
+            return [], False, False
+        user.load()
+        postings = []
+        for term in terms:
+            frequency = user.frequencies.get(term)
+            if frequency is None:
+                return [], False, False
+            # Deleted documents still in the postings don't count
+            postings.append((user.postings[term], bm25_idf(user.live, frequency)))
+        postings.sort(key=lambda entry: len(entry[0]))
+        postings, idfs = [entries for entries, _ in postings], [idf for _, idf in postings]
+
+        average_length = user.total_length / user.live or 1.0
+
+        doc_sessions, doc_lengths = user.doc_sessions, user.doc_lengths
+        rarest = postings[0]
+        rarest_idf = idfs[0]
+        others = [(entries, len(entries), idf) for entries, idf in zip(postings[1:], idfs[1:])]
+        # BM25 length normalisation is K1 * (1 - B + B * length / average)
+        norm_base = K1 * (1 - B)
+        norm_per_token = K1 * B / average_length
+        candidates = []
+        truncated = False
+        for i in range(len(rarest) - 1, -1, -1):
+            doc = rarest[i] >> 8
+            if doc_sessions[doc] is None:
+                continue
+            norm = norm_base + norm_per_token * doc_lengths[doc]
+            count = rarest[i] & 255
+            score = rarest_idf * count / (count + norm)
+            for entries, size, idf in others:
+                j = bisect_left(entries, doc << 8)
+                if j == size or entries[j] >> 8 != doc:
+                    break
+                count = entries[j] & 255
+                score += idf * count / (count + norm)
+            else:
+                if len(candidates) == MAX_CANDIDATES:
+                    truncated = True
+                    break
+                candidates.append((score * (K1 + 1), doc))
+
+        candidates.sort(reverse=True)
+        page = candidates[offset:offset + limit]
+        hits = []
+        for score, doc in page:
+            session_id = doc_sessions[doc]
+            message = self._load_message(session_id, user.doc_positions[doc])
+            hits.append(search_hit(self._sessions[session_id], message, terms, score))
+        return hits, offset + limit < len(candidates), truncated
+
+    def stats(self) -> dict:
+        # Users restored from a snapshot whose index hasn't been decoded yet
+        # count towards users and documents but not terms
+        loaded = [user for user in self._users.values() if user._pending is None]
+        return {
+            "users": len(self._users),
+            "documents": sum(user.live for user in self._users.values()),
+            "terms": sum(len(user.frequencies) for user in loaded),
+            "loaded_users": len(loaded),
+        }
+
+
+def _compact(user: _UserIndex):
+    """Drop the user's deleted documents and renumber the rest in order
+
+    Builds new arrays rather than changing the old ones in place, which a
+    snapshot being written may still hold.
+    """
+    # old document number -> new one, or -1 if deleted
+    renumbered = array("i", [-1]) * len(user.doc_sessions)
+    doc_sessions: List[Optional[str]] = []
+    positions, lengths = array("I"), array("I")
+    for doc, session_id in enumerate(user.doc_sessions):
+        if session_id is not None:
+            renumbered[doc] = len(doc_sessions)
+            doc_sessions.append(session_id)
+            positions.append(user.doc_positions[doc])
+            lengths.append(user.doc_lengths[doc])
+    postings = {}
+    for term, entries in user.postings.items():
+        keep = array("Q", (
+            renumbered[entry >> 8] << 8 | entry & 255 for entry in entries if renumbered[entry >> 8] >= 0
+        ))
+        if keep:
+            postings[term] = keep
+    user.postings = postings
+    user.doc_sessions, user.doc_positions, user.doc_lengths = doc_sessions, positions, lengths
+    user.session_docs = _session_docs(doc_sessions)
+    user.dead = 0
+
+
+def _session_docs(doc_sessions: List[Optional[str]]) -> Dict[str, array]:
+    session_docs: Dict[str, array] = {}
+    for doc, session_id in enumerate(doc_sessions):
+        if session_id is not None:
+            docs = session_docs.get(session_id)
+            if docs is None:
+                docs = session_docs[session_id] = array("I")
+            docs.append(doc)
+    return session_docs
+
+
+def _encode_captured(
+    captured: List[Tuple[str, array, int]],
+    frequencies: Dict[str, int],
+    doc_sessions: List[Optional[str]],
+    positions: array,
+    lengths: array,
+) -> bytes:
+    postings = {term: entries[:length] for term, entries, length in captured}
+    return encode_user(postings, frequencies, doc_sessions, positions, lengths)
@@ -0,0 +1,59 @@
+import hashlib
+import json
+from typing import Any, Optional
+
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+# Fast response path
+#
+# Routes that return records straight from the store (already in the exact
+# shape of their response_model) wrap them in FastJSONResponse. Returning a
+# Response makes FastAPI skip response_model validation and
+# jsonable_encoder, and the body is encoded with orjson when it is installed.
+# response_model stays on the route for the OpenAPI schema.
+
+
+class FastJSONResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# Conditional responses
+#
+# Routes whose output is covered by version counters send an ETag made from
+# them, and answer a request whose If-None-Match holds that ETag with a bare
+# 304 before loading or encoding anything. The tags are weak (W/): a version
+# may stay put through changes too small to matter, like lastActive moving
+# within the same minute.
+
+
+def make_etag(*parts: Any) -> str:
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against etag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
@@ -0,0 +1,438 @@
+import asyncio
+import glob
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from store import InMemoryStore
+
+try:
+    import fcntl
+except ImportError:  # Windows: no lock
+    fcntl = None
+
+# Snapshots and write journal for the in-memory store
+#
+# A snapshot is one file: a fixed header, then binary blobs, then a
+# compressed JSON manifest that refers to the blobs as [offset, length,
+# crc32]. The header holds the manifest's place and CRC, and the manifest
+# the CRC of all the blobs together, which is checked before a snapshot is
+# used, so a damaged file is skipped at startup rather than failing requests
+# later; each blob is checked again when it is read. Restoring memory-maps the file
+# and decodes only what every request needs up front: users, credentials,
+# session records and the search index's per-message tables. A session's
+# newest messages and a user's search postings are decoded when first used,
+# and archived messages are read from the map when a client pages back to
+# them (see history.py and search.py), so a restart costs roughly what the
+# first requests touch rather than the size of the data.
+#
+# Snapshots are written by a worker thread to "<path>.tmp", fsynced and
+# renamed over "<path>"; the snapshot it replaces is kept as "<path>.prev".
+# The store captures its state on the event loop first, which only copies
+# references, so requests keep going while a snapshot is written.
+#
+# Between snapshots every store write is appended to a journal,
+# "<path>.journal.<generation>", as a JSON record framed by its length and
+# CRC. Records are encoded on the event loop and written by the journal's
+# own thread, which writes whatever has queued up in one go. Each snapshot starts a new generation and records it, so a restore
+# replays only the journals from the snapshot's generation on: the writes
+# made after it. A record cut short by a crash ends its journal's replay.
+# Journals stay on disk until both snapshots are newer than them.
+#
+# One process at a time may use a snapshot path; it holds an flock on
+# "<path>.lock" while open.
+
+MAGIC = b"DBSNAP\x00\x01"
+# magic, manifest offset, manifest length, manifest crc32
+HEADER = struct.Struct("<8sQQI")
+# record length, record crc32
+FRAME = struct.Struct("<II")
+
+# Bytes of the file checked at a time when opening a snapshot
+VERIFY_CHUNK = 16 * 1024 * 1024
+
+# Store methods that journal their writes, and so may be replayed
+JOURNALED = frozenset({
+    "add_user", "update_user", "update_last_active", "delete_user",
+    "add_session", "add_message", "delete_session",
+    "add_credential", "delete_credential",
+})
+
+
+class SnapshotError(Exception):
+    """A snapshot file is missing, damaged or in use"""
+
+
+def encode(value: Any) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode(), 1)
+
+
+class SnapshotWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(bytes(HEADER.size))
+        self._offset = HEADER.size
+        # CRC of every blob written so far, back to back
+        self._crc = 0
+
+    def blob(self, data: bytes) -> list:
+        """Append bytes; returns their [offset, length, crc32]"""
+        ref = [self._offset, len(data), zlib.crc32(data)]
+        self._file.write(data)
+        self._offset += len(data)
+        self._crc = zlib.crc32(data, self._crc)
+        return ref
+
+    def compressed(self, value: Any) -> list:
+        return self.blob(encode(value))
+
+    def finish(self, manifest: dict):
+        """Write the manifest and header and make the file durable"""
+        body = encode({**manifest, "blobs_crc": self._crc})
+        offset = self._offset
+        self._file.write(body)
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, offset, len(body), zlib.crc32(body)))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class SnapshotReader:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise SnapshotError(f"{path}: truncated")
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, offset, length, crc = HEADER.unpack_from(self.map)
+            if magic != MAGIC:
+                raise SnapshotError(f"{path}: not a snapshot")
+            self.manifest = json.loads(zlib.decompress(self.read([offset, length, crc])))
+            if self._blobs_crc(offset) != self.manifest.get("blobs_crc"):
+                raise SnapshotError(f"{path}: checksum mismatch in blobs")
+        except BaseException:
+            self.map.close()
+            raise
+
+    def _blobs_crc(self, end: int) -> int:
+        crc = 0
+        for start in range(HEADER.size, end, VERIFY_CHUNK):
+            crc = zlib.crc32(self.map[start:min(start + VERIFY_CHUNK, end)], crc)
+        return crc
+
+    def read(self, ref: list) -> bytes:
+        offset, length, crc = ref
+        data = self.map[offset:offset + length]
+        if len(data) != length or zlib.crc32(data) != crc:
+            raise SnapshotError(f"{self.path}: checksum mismatch at offset {offset}")
+        return data
+
+    def decompress(self, ref: list) -> Any:
+        return json.loads(zlib.decompress(self.read(ref)))
+
+    def close(self):
+        self.map.close()
+
+
+class Journal:
+    """Append-only log of store writes for one generation"""
+
+    def __init__(self, path: str, generation: int):
+        self.path = path
+        self.generation = generation
+        self._file = open(path, "ab")
+        self.records = 0
+        # Framed records waiting for the writer thread; None stops it
+        self._queue: "queue.SimpleQueue[Optional[bytes]]" = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write, name=f"journal-{generation}", daemon=True)
+        self._writer.start()
+
+    def record(self, method: str, *args):
+        # Encoded now, while args hold the values written
+        payload = json.dumps([method, *args], separators=(",", ":")).encode()
+        self._queue.put(FRAME.pack(len(payload), zlib.crc32(payload)) + payload)
+        self.records += 1
+
+    def _write(self):
+        # Flushed to the OS as soon as it is written, so a crashed process
+        # loses at most the records still queued; fsynced on close()
+        stopping = False
+        while not stopping:
+            frames = [self._queue.get()]
+            while True:
+                try:
+                    frames.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if frames[-1] is None:
+                frames.pop()
+                stopping = True
+            self._file.write(b"".join(frames))
+            self._file.flush()
+
+    def close(self):
+        """Write out the queued records and close the file"""
+        if not self._file.closed:
+            self._queue.put(None)
+            self._writer.join()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+
+def read_journal(path: str) -> Iterator[Tuple[str, list]]:
+    """The (method, args) records of a journal, up to the first damaged one"""
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + FRAME.size <= len(data):
+        length, crc = FRAME.unpack_from(data, offset)
+        start = offset + FRAME.size
+        payload = data[start:start + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            return
+        method, *args = json.loads(payload)
+        yield method, args
+        offset = start + length
+
+
+class SnapshotManager:
+    def __init__(self, path: str, interval: float = 300.0, on_error: Optional[Callable[[BaseException], None]] = None):
+        self.path = path
+        # Seconds between snapshots, taken only if the store changed
+        self.interval = interval
+        self.on_error = on_error
+        # name -> function returning JSON-encodable state saved with each
+        # snapshot, e.g. counters derived from the store; called on the
+        # event loop, so it must return a copy
+        self.extra_state: Dict[str, Callable[[], Any]] = {}
+        # What open() found: the saved extra state, and the journal records
+        # replayed on top of the snapshot
+        self.extras: Dict[str, Any] = {}
+        self.replayed: List[Tuple[str, list]] = []
+        self.store: Optional[InMemoryStore] = None
+        self.journal: Optional[Journal] = None
+        # Generations of the snapshots at path and path.prev, if valid
+        self._current: Optional[int] = None
+        self._previous: Optional[int] = None
+        self._lock_file = None
+        self._task: Optional[asyncio.Task] = None
+        self._saving = False
+        self._unsaved_replay = False
+        self.restored_from: Optional[str] = None
+        self.skipped: List[str] = []
+        self.restore_seconds = 0.0
+        self.saves = 0
+        self.last_save_seconds: Optional[float] = None
+        self.last_saved_at: Optional[float] = None
+
+    @property
+    def previous_path(self) -> str:
+        return self.path + ".prev"
+
+    def _journal_path(self, generation: int) -> str:
+        return f"{self.path}.journal.{generation}"
+
+    def _journal_generations(self) -> List[int]:
+        prefix = self.path + ".journal."
+        return sorted(
+            int(path[len(prefix):]) for path in glob.glob(glob.escape(prefix) + "*")
+            if path[len(prefix):].isdigit()
+        )
+
+    def open(self, **store_options) -> InMemoryStore:
+        """Restore the store from the newest valid snapshot and the journals after it
+
+        Without any snapshot the store starts empty (plus whatever journals
+        there are). Raises SnapshotError if snapshots exist but none can be
+        read, rather than start without their data.
+        """
+        started = time.perf_counter()
+        self._lock()
+        store, generation = None, 0
+        for path in (self.path, self.previous_path):
+            if not os.path.exists(path):
+                continue
+            reader = None
+            try:
+                reader = SnapshotReader(path)
+                manifest = reader.manifest
+                self.extras = {name: reader.decompress(ref) for name, ref in manifest["extras"].items()}
+                store = InMemoryStore.restore(reader, manifest["store"], **store_options)
+            except (OSError, ValueError, KeyError, SnapshotError, zlib.error) as exc:
+                if reader is not None:
+                    reader.close()
+                self.skipped.append(f"{path}: {exc!r}")
+                continue
+            generation = manifest["generation"]
+            if path == self.path:
+                self._current, self._previous = generation, manifest["previous"]
+            else:
+                self._previous = generation
+            self.restored_from = path
+            break
+        if store is None:
+            if self.skipped:
+                self._unlock()
+                raise SnapshotError("No usable snapshot: " + "; ".join(self.skipped))
+            store = InMemoryStore(**store_options)
+
+        generations = self._journal_generations()
+        for journal_generation in generations:
+            if journal_generation >= generation:
+                for method, args in read_journal(self._journal_path(journal_generation)):
+                    if method not in JOURNALED:
+                        raise SnapshotError(f"Unknown journal record {method!r}")
+                    getattr(store, method)(*args)
+                    self.replayed.append((method, args))
+        self._unsaved_replay = bool(self.replayed)
+
+        generation = max([generation, *generations]) + 1
+        self.journal = store.journal = Journal(self._journal_path(generation), generation)
+        self.store = store
+        self.restore_seconds = time.perf_counter() - started
+        return store
+
+    async def save(self) -> bool:
+        """Write a snapshot of the store; False if one is already being written"""
+        if self._saving:
+            return False
+        self._saving = True
+        try:
+            started = time.perf_counter()
+            # Capture and switch journals in one step on the event loop, so
+            # every write lands either in the snapshot or in the new journal
+            image = self.store.capture()
+            extras = {name: state() for name, state in self.extra_state.items()}
+            finished = self.journal
+            generation = finished.generation + 1
+            self.journal = self.store.journal = Journal(self._journal_path(generation), generation)
+            self._unsaved_replay = False
+            await asyncio.get_running_loop().run_in_executor(None, self._write, image, extras, generation, finished)
+            self.saves += 1
+            self.last_saved_at = time.time()
+            self.last_save_seconds = time.perf_counter() - started
+            return True
+        finally:
+            self._saving = False
+
+    def _write(self, image, extras: Dict[str, Any], generation: int, finished: Journal):
+        finished.close()
+        writer = SnapshotWriter(self.path + ".tmp")
+        try:
+            manifest = {
+                "generation": generation,
+                "previous": self._current,
+                "created": time.time(),
+                "store": image(writer.blob, writer.compressed),
+                "extras": {name: writer.compressed(value) for name, value in extras.items()},
+            }
+            writer.finish(manifest)
+        except BaseException:
+            writer.abort()
+            raise
+        if self._current is not None:
+            os.replace(self.path, self.previous_path)
+            self._previous = self._current
+        os.replace(writer.path, self.path)
+        self._current = generation
+        _fsync_directory(self.path)
+        # Both snapshots on disk cover every journal before the older one
+        keep_from = generation if self._previous is None else self._previous
+        for journal_generation in self._journal_generations():
+            if journal_generation < keep_from:
+                os.unlink(self._journal_path(journal_generation))
+
+    def changed(self) -> bool:
+        """Whether the store has writes that no snapshot holds yet"""
+        return self._unsaved_replay or bool(self.journal and self.journal.records)
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop taking snapshots, write a last one if anything changed and close the journal"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.store is None:
+            return
+        if self.changed():
+            await self.save()
+        self.journal.close()
+        self.store.journal = None
+        self._unlock()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.changed():
+                continue
+            try:
+                await self.save()
+            except Exception as exc:
+                if self.on_error is not None:
+                    self.on_error(exc)
+
+    def _lock(self):
+        if fcntl is None:
+            return
+        self._lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            self._lock_file = None
+            raise SnapshotError(f"{self.path} is in use by another process") from None
+
+    def _unlock(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "restored_from": self.restored_from,
+            "restore_seconds": round(self.restore_seconds, 4),
+            "replayed_records": len(self.replayed),
+            "skipped": self.skipped,
+            "journal_generation": self.journal.generation if self.journal else None,
+            "journal_records": self.journal.records if self.journal else 0,
+            "saves": self.saves,
+            "last_saved_at": self.last_saved_at,
+            "last_save_seconds": self.last_save_seconds,
+        }
+
+
+def _fsync_directory(path: str):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,798 @@
+import json
+import queue
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from analytics import DAY, AnalyticsEngine, bucket_updates, parse_timestamp
+from search import MAX_CANDIDATES, bm25_idf, bm25_score, query_terms, search_hit, tokenize
+from store import PRIVATE_USER_FIELDS, RECENT_MESSAGES, SNIPPET_LENGTH, USER_SORT_KEYS, VERSIONED_TIMESTAMP_LENGTH
+
+# SQLite data store
+#
+# Durable counterpart of store.InMemoryStore with the same method names and
+# record shapes. The database runs in WAL mode so readers never block the
+# single writer, and connections come from a bounded pool. Every method is
+# blocking; callers on the event loop run them on ``executor``, which has one
+# thread per pooled connection so a worker never waits for a connection.
+# Several server processes can share one database file (see run.py).
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL UNIQUE,
+    role TEXT NOT NULL,
+    status TEXT NOT NULL,
+    lastActive TEXT NOT NULL,
+    password_hash TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    last_message TEXT,
+    token_count INTEGER NOT NULL DEFAULT 0,
+    last_activity REAL
+);
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_user ON chat_sessions (user_id);
+
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    session_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    type TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, seq);
+
+CREATE TABLE IF NOT EXISTS credentials (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    service TEXT NOT NULL,
+    details TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_credentials_user ON credentials (user_id);
+
+CREATE TABLE IF NOT EXISTS versions (
+    key TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Usage analytics counters (see analytics.py), shared by every process on
+# the database: "sessions", "duration" and "active_sessions" per day and
+# "messages" per hour, bucketed like AnalyticsEngine's and updated in the
+# transaction of each write. Buckets older than the retention are dropped
+# as sessions are added. chat_sessions.last_activity is the time of a
+# session's latest message while its creation day is retained, as in
+# AnalyticsEngine's per-session times.
+ANALYTICS_TABLE = """
+CREATE TABLE analytics_buckets (
+    kind TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    value NUMERIC NOT NULL,
+    PRIMARY KEY (kind, bucket)
+) WITHOUT ROWID
+"""
+PER_DAY_BUCKETS = ("sessions", "duration", "active_sessions")
+
+# Columns added after the first release, with the statement that backfills
+# them on databases created before they existed
+MIGRATIONS = {
+    ("chat_sessions", "message_count"): (
+        "ALTER TABLE chat_sessions ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0",
+        "UPDATE chat_sessions SET message_count ="
+        " (SELECT COUNT(*) FROM messages WHERE messages.session_id = chat_sessions.id)",
+    ),
+    ("chat_sessions", "last_message"): (
+        "ALTER TABLE chat_sessions ADD COLUMN last_message TEXT",
+        f"UPDATE chat_sessions SET last_message ="
+        f" (SELECT substr(content, 1, {SNIPPET_LENGTH}) FROM messages"
+        f" WHERE messages.session_id = chat_sessions.id ORDER BY seq DESC LIMIT 1)",
+    ),
+    ("chat_sessions", "token_count"): (
+        "ALTER TABLE chat_sessions ADD COLUMN token_count INTEGER NOT NULL DEFAULT 0",
+        "UPDATE chat_sessions SET token_count = (SELECT COALESCE(SUM(search_length(content)), 0)"
+        " FROM messages WHERE messages.session_id = chat_sessions.id)",
+    ),
+    # Filled in with the analytics buckets, which came with it
+    ("chat_sessions", "last_activity"): ("ALTER TABLE chat_sessions ADD COLUMN last_activity REAL",),
+}
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_updated ON chat_sessions (user_id, updated_at, id);
+CREATE INDEX IF NOT EXISTS idx_users_role_status ON users (role, status);
+CREATE INDEX IF NOT EXISTS idx_users_status_name ON users (status, name COLLATE NOCASE, id);
+CREATE INDEX IF NOT EXISTS idx_users_name ON users (name COLLATE NOCASE, id);
+CREATE INDEX IF NOT EXISTS idx_users_last_active ON users (lastActive, id);
+"""
+
+# Full-text search: an FTS5 table keyed by messages.seq, kept in step by
+# triggers. "owner" holds the session owner's id as a single hex token, so a
+# query matches only that user's messages inside the FTS index.
+#
+# FTS5 only finds the matches. Its bm25() weighs terms by how common they
+# are across every user's messages, and gives ~0 to a term in more than half
+# of them, which on a small database is most terms. Matches are ranked with
+# search.bm25_score() over the user's own messages instead, as the in-memory
+# index does, from the sessions' message and token counts; token_count is
+# the number of search.tokenize() tokens in a session's messages. The
+# tokenizer keeps diacritics, like search.tokenize(), so both backends match
+# the same words.
+SEARCH_TABLE = "CREATE VIRTUAL TABLE messages_fts USING fts5(owner, content, tokenize = 'unicode61 remove_diacritics 0')"
+SEARCH_BACKFILL = (
+    "INSERT INTO messages_fts (rowid, owner, content)"
+    " SELECT m.seq, 'u' || lower(hex(s.user_id)), m.content"
+    " FROM messages m JOIN chat_sessions s ON s.id = m.session_id"
+)
+SEARCH_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, owner, content)
+    SELECT new.seq, 'u' || lower(hex(user_id)), new.content FROM chat_sessions WHERE id = new.session_id;
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    DELETE FROM messages_fts WHERE rowid = old.seq;
+END;
+"""
+
+# Version counters (see store.py), bumped by triggers so that writes from
+# every process sharing the database count
+def _bump(key: str) -> str:
+    return f"INSERT INTO versions (key, version) VALUES ({key}, 1) ON CONFLICT (key) DO UPDATE SET version = version + 1;"
+
+VERSION_TRIGGERS = f"""
+CREATE TRIGGER IF NOT EXISTS users_version_insert AFTER INSERT ON users BEGIN
+    {_bump("'users'")}
+END;
+CREATE TRIGGER IF NOT EXISTS users_version_update AFTER UPDATE OF name, email, role, status ON users BEGIN
+    {_bump("'users'")}
+END;
+CREATE TRIGGER IF NOT EXISTS users_version_last_active AFTER UPDATE OF lastActive ON users
+WHEN substr(old.lastActive, 1, {VERSIONED_TIMESTAMP_LENGTH}) <> substr(new.lastActive, 1, {VERSIONED_TIMESTAMP_LENGTH}) BEGIN
+    {_bump("'users'")}
+END;
+CREATE TRIGGER IF NOT EXISTS users_version_delete AFTER DELETE ON users BEGIN
+    {_bump("'users'")}
+END;
+CREATE TRIGGER IF NOT EXISTS chat_sessions_version_insert AFTER INSERT ON chat_sessions BEGIN
+    {_bump("'sessions:' || new.user_id")}
+    {_bump("'analytics'")}
+END;
+CREATE TRIGGER IF NOT EXISTS chat_sessions_version_update AFTER UPDATE ON chat_sessions BEGIN
+    {_bump("'sessions:' || new.user_id")}
+    {_bump("'session:' || new.id")}
+END;
+CREATE TRIGGER IF NOT EXISTS chat_sessions_version_delete AFTER DELETE ON chat_sessions BEGIN
+    {_bump("'sessions:' || old.user_id")}
+    DELETE FROM versions WHERE key = 'session:' || old.id;
+END;
+CREATE TRIGGER IF NOT EXISTS messages_version_insert AFTER INSERT ON messages BEGIN
+    {_bump("'analytics'")}
+END;
+CREATE TRIGGER IF NOT EXISTS credentials_version_insert AFTER INSERT ON credentials BEGIN
+    {_bump("'credentials:' || new.user_id")}
+END;
+CREATE TRIGGER IF NOT EXISTS credentials_version_update AFTER UPDATE ON credentials BEGIN
+    {_bump("'credentials:' || new.user_id")}
+END;
+CREATE TRIGGER IF NOT EXISTS credentials_version_delete AFTER DELETE ON credentials BEGIN
+    {_bump("'credentials:' || old.user_id")}
+END;
+"""
+
+USER_COLUMNS = ("id", "name", "email", "role", "status", "lastActive", "password_hash")
+PUBLIC_USER_COLUMNS = tuple(column for column in USER_COLUMNS if column not in PRIVATE_USER_FIELDS)
+SESSION_COLUMNS = ("id", "user_id", "title", "created_at", "updated_at")
+SUMMARY_COLUMNS = SESSION_COLUMNS + ("message_count", "last_message")
+MESSAGE_COLUMNS = ("id", "user_id", "content", "timestamp", "type")
+CREDENTIAL_COLUMNS = ("id", "user_id", "service", "details", "created_at", "updated_at")
+# ORDER BY clause for each user sort key; names compare case-insensitively
+USER_ORDER = {"name": "name COLLATE NOCASE", "email": "email", "lastActive": "lastActive"}
+# Ids or emails bound per statement, well under SQLite's variable limit
+BATCH_SIZE = 500
+
+
+class SQLiteStore:
+    def __init__(self, path: str, pool_size: int = 4, timeout: float = 30.0, analytics_retention_days: int = 90):
+        self.path = path
+        self.timeout = timeout
+        self.analytics_retention_days = analytics_retention_days
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=pool_size)
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="sqlite")
+
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+            conn.executescript(INDEXES)
+            conn.executescript(SEARCH_TRIGGERS)
+            conn.executescript(VERSION_TRIGGERS)
+            self.epoch = str(conn.execute("SELECT version FROM versions WHERE key = 'epoch'").fetchone()[0])
+
+    def _migrate(self, conn: sqlite3.Connection):
+        # Take the write lock before looking at the columns, so workers
+        # opening the same database at once don't both run a migration
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for (table, column), statements in MIGRATIONS.items():
+                existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+                if column not in existing:
+                    for statement in statements:
+                        conn.execute(statement)
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone() is None:
+                conn.execute(SEARCH_TABLE)
+                conn.execute(SEARCH_BACKFILL)
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'analytics_buckets'").fetchone() is None:
+                conn.execute(ANALYTICS_TABLE)
+                self._rebuild_analytics(conn)
+            # Tells this database's version counters from those of another
+            # database at the same path, e.g. after it was deleted
+            conn.execute("INSERT OR IGNORE INTO versions (key, version) VALUES ('epoch', abs(random()))")
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections are handed between executor threads, but the pool
+        # guarantees only one thread uses a connection at a time.
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.create_function("search_length", 1, _search_length, deterministic=True)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        conn = self._pool.get(timeout=self.timeout)
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    # Users
+    def add_user(self, user: dict) -> dict:
+        try:
+            with self._connection() as conn, conn:
+                self._insert_user(conn, user)
+        except sqlite3.IntegrityError as exc:
+            raise KeyError(f"User {user['email']} already exists") from exc
+        return user
+
+    def add_users(self, users: List[dict]) -> List[Optional[str]]:
+        # One transaction; a constraint failure only undoes its own row
+        errors: List[Optional[str]] = []
+        with self._connection() as conn, conn:
+            for user in users:
+                try:
+                    self._insert_user(conn, user)
+                    errors.append(None)
+                except sqlite3.IntegrityError:
+                    errors.append(f"User {user['email']} already exists")
+        return errors
+
+    def get_user(self, user_id: str) -> Optional[dict]:
+        return self._fetch_one("SELECT * FROM users WHERE id = ?", (user_id,))
+
+    def get_user_by_email(self, email: str) -> Optional[dict]:
+        return self._fetch_one("SELECT * FROM users WHERE email = ?", (email,))
+
+    def get_users(self, user_ids: Iterable[str]) -> Dict[str, dict]:
+        users = {}
+        with self._connection() as conn:
+            for batch in _batches(user_ids):
+                for row in conn.execute(f"SELECT * FROM users WHERE id IN ({', '.join('?' * len(batch))})", batch):
+                    users[row["id"]] = dict(row)
+        return users
+
+    def registered_emails(self, emails: Iterable[str]) -> Set[str]:
+        found = set()
+        with self._connection() as conn:
+            for batch in _batches(emails):
+                rows = conn.execute(f"SELECT email FROM users WHERE email IN ({', '.join('?' * len(batch))})", batch)
+                found.update(row["email"] for row in rows)
+        return found
+
+    def list_users(self) -> List[dict]:
+        return self._fetch_all("SELECT * FROM users ORDER BY rowid", ())
+
+    # Public views select only the columns that may be sent to clients
+    def get_public_user(self, user_id: str) -> Optional[dict]:
+        return self._fetch_one(f"SELECT {', '.join(PUBLIC_USER_COLUMNS)} FROM users WHERE id = ?", (user_id,))
+
+    def list_public_users(self) -> List[dict]:
+        return self._fetch_all(f"SELECT {', '.join(PUBLIC_USER_COLUMNS)} FROM users ORDER BY rowid", ())
+
+    def query_users(
+        self,
+        role: Optional[str] = None,
+        status: Optional[str] = None,
+        name_prefix: Optional[str] = None,
+        sort: Optional[str] = None,
+        descending: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> Tuple[List[dict], int]:
+        # Same contract as InMemoryStore.query_users. Filters use
+        # idx_users_role_status, idx_users_status_name and idx_users_name (a
+        # NOCASE range scan for the prefix); sorts use the matching index.
+        clauses, params = [], []
+        if role is not None:
+            clauses.append("role = ?")
+            params.append(role)
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if name_prefix:
+            clauses.append("name COLLATE NOCASE >= ? AND name COLLATE NOCASE < ?")
+            params.extend((name_prefix, name_prefix + "\U0010ffff"))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        direction = "DESC" if descending else "ASC"
+        order = f"{USER_ORDER[sort]} {direction}, id {direction}" if sort in USER_SORT_KEYS else f"rowid {direction}"
+        with self._connection() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM users{where}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT {', '.join(PUBLIC_USER_COLUMNS)} FROM users{where} ORDER BY {order} LIMIT ? OFFSET ?",
+                params + [-1 if limit is None else limit, offset],
+            ).fetchall()
+        return [dict(row) for row in rows], total
+
+    def update_user(self, user_id: str, fields: Dict[str, Any]) -> Optional[dict]:
+        with self._connection() as conn, conn:
+            return self._update_user(conn, user_id, fields)
+
+    def update_users(self, updates: Dict[str, Dict[str, Any]]) -> Dict[str, dict]:
+        updated = {}
+        with self._connection() as conn, conn:
+            for user_id, fields in updates.items():
+                user = self._update_user(conn, user_id, fields)
+                if user is not None:
+                    updated[user_id] = user
+        return updated
+
+    def count_active_users(self, since: Iterable[str]) -> List[int]:
+        """Users whose lastActive is at or after each of ``since``"""
+        with self._connection() as conn:
+            return [
+                conn.execute("SELECT COUNT(*) FROM users WHERE lastActive >= ?", (cutoff,)).fetchone()[0]
+                for cutoff in since
+            ]
+
+    def update_last_active(self, updates: Dict[str, str]):
+        # One transaction per batch of activity timestamps
+        with self._connection() as conn, conn:
+            conn.executemany(
+                "UPDATE users SET lastActive = ? WHERE id = ?",
+                [(last_active, user_id) for user_id, last_active in updates.items()],
+            )
+
+    def delete_user(self, user_id: str) -> Optional[dict]:
+        with self._connection() as conn, conn:
+            row = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        return dict(row)
+
+    def delete_users(self, user_ids: Iterable[str]) -> Dict[str, dict]:
+        deleted = {}
+        with self._connection() as conn, conn:
+            for batch in _batches(user_ids):
+                placeholders = ", ".join("?" * len(batch))
+                for row in conn.execute(f"SELECT * FROM users WHERE id IN ({placeholders})", batch):
+                    deleted[row["id"]] = dict(row)
+                conn.execute(f"DELETE FROM users WHERE id IN ({placeholders})", batch)
+        return deleted
+
+    def count_users(self) -> int:
+        return self._count("users")
+
+    # Chat sessions
+    def add_session(self, session: dict) -> dict:
+        try:
+            with self._connection() as conn, conn:
+                messages = session.get("messages", [])
+                conn.execute(
+                    f"INSERT INTO chat_sessions ({', '.join(SUMMARY_COLUMNS)}, token_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [session[column] for column in SESSION_COLUMNS] + [
+                        len(messages),
+                        messages[-1]["content"][:SNIPPET_LENGTH] if messages else None,
+                        sum(_search_length(message["content"]) for message in messages),
+                    ],
+                )
+                for message in messages:
+                    self._insert_message(conn, session["id"], message)
+                updates, latest = bucket_updates(session["created_at"], messages, None, self._prune_analytics(conn))
+                updates.append(("sessions", int(parse_timestamp(session["created_at"]) // DAY), 1))
+                self._count_analytics(conn, updates)
+                if latest is not None:
+                    conn.execute("UPDATE chat_sessions SET last_activity = ? WHERE id = ?", (latest, session["id"]))
+        except sqlite3.IntegrityError as exc:
+            raise KeyError(f"Chat session {session['id']} already exists") from exc
+        return session
+
+    def get_session(self, session_id: str, with_messages: bool = True) -> Optional[dict]:
+        # with_messages=False skips loading the history when callers only
+        # need the session row (e.g. ownership checks before an append).
+        # Otherwise the session comes with its message_count and newest
+        # RECENT_MESSAGES messages, like the in-memory store's.
+        with self._connection() as conn:
+            if not with_messages:
+                row = conn.execute(
+                    f"SELECT {', '.join(SESSION_COLUMNS)} FROM chat_sessions WHERE id = ?", (session_id,)
+                ).fetchone()
+                return dict(row) if row is not None else None
+            row = conn.execute(
+                f"SELECT {', '.join(SESSION_COLUMNS)}, message_count FROM chat_sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            session = dict(row)
+            session["messages"] = self._recent_messages(conn, session_id)
+            session["has_more_messages"] = session["message_count"] > RECENT_MESSAGES
+        return session
+
+    def list_sessions(self, user_id: str) -> List[dict]:
+        with self._connection() as conn:
+            sessions = [
+                dict(row)
+                for row in conn.execute(
+                    f"SELECT {', '.join(SESSION_COLUMNS)}, message_count FROM chat_sessions"
+                    " WHERE user_id = ? ORDER BY rowid",
+                    (user_id,),
+                )
+            ]
+            # One bounded range of idx_messages_session per session
+            for session in sessions:
+                session["messages"] = self._recent_messages(conn, session["id"])
+                session["has_more_messages"] = session["message_count"] > RECENT_MESSAGES
+        return sessions
+
+    def _recent_messages(self, conn: sqlite3.Connection, session_id: str) -> List[dict]:
+        rows = conn.execute(
+            f"SELECT {', '.join(MESSAGE_COLUMNS)} FROM messages WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+            (session_id, RECENT_MESSAGES),
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def iter_sessions(self) -> Iterator[dict]:
+        # Streams sessions and their messages with two ordered cursors, so
+        # memory stays at one session regardless of the database size. The
+        # generator holds a pooled connection until it is exhausted.
+        with self._connection() as conn:
+            yield from self._iter_sessions(conn)
+
+    def _iter_sessions(self, conn: sqlite3.Connection) -> Iterator[dict]:
+        sessions = conn.execute(f"SELECT {', '.join(SESSION_COLUMNS)} FROM chat_sessions ORDER BY id")
+        messages = conn.execute(
+            f"SELECT session_id, {', '.join(MESSAGE_COLUMNS)} FROM messages ORDER BY session_id, seq"
+        )
+        pending = messages.fetchone()
+        for row in sessions:
+            session = dict(row)
+            session["messages"] = []
+            while pending is not None and pending["session_id"] <= session["id"]:
+                if pending["session_id"] == session["id"]:
+                    message = dict(pending)
+                    del message["session_id"]
+                    session["messages"].append(message)
+                pending = messages.fetchone()
+            yield session
+
+    def add_message(self, session_id: str, message: dict) -> Optional[dict]:
+        # A single-row insert plus a bump of the session's summary columns;
+        # the rest of the session is never rewritten.
+        with self._connection() as conn, conn:
+            updated = conn.execute(
+                "UPDATE chat_sessions SET updated_at = ?, message_count = message_count + 1, last_message = ?,"
+                " token_count = token_count + ? WHERE id = ?",
+                (message["timestamp"], message["content"][:SNIPPET_LENGTH], _search_length(message["content"]), session_id),
+            )
+            if updated.rowcount == 0:
+                return None
+            self._insert_message(conn, session_id, message)
+            # Read under the write lock the UPDATE took
+            created_at, last_activity = conn.execute(
+                "SELECT created_at, last_activity FROM chat_sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            updates, latest = bucket_updates(created_at, [message], last_activity, self._oldest_analytics_day())
+            self._count_analytics(conn, updates)
+            if latest != last_activity:
+                conn.execute("UPDATE chat_sessions SET last_activity = ? WHERE id = ?", (latest, session_id))
+        return message
+
+    def list_messages(
+        self,
+        session_id: str,
+        limit: int,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+    ) -> Optional[Tuple[List[dict], bool]]:
+        # Same contract as InMemoryStore.list_messages; cursors resolve to
+        # seq values so every page is an index range scan.
+        with self._connection() as conn:
+            if conn.execute("SELECT 1 FROM chat_sessions WHERE id = ?", (session_id,)).fetchone() is None:
+                return None
+            clauses, params = ["session_id = ?"], [session_id]
+            for cursor, operator in ((after, ">"), (before, "<")):
+                if cursor is None:
+                    continue
+                row = conn.execute(
+                    "SELECT seq FROM messages WHERE id = ? AND session_id = ?", (cursor, session_id)
+                ).fetchone()
+                if row is None:
+                    return None
+                clauses.append(f"seq {operator} ?")
+                params.append(row["seq"])
+            order = "ASC" if after is not None else "DESC"
+            rows = conn.execute(
+                f"SELECT {', '.join(MESSAGE_COLUMNS)} FROM messages WHERE {' AND '.join(clauses)}"
+                f" ORDER BY seq {order} LIMIT ?",
+                params + [limit + 1],
+            ).fetchall()
+        has_more = len(rows) > limit
+        messages = [dict(row) for row in rows[:limit]]
+        if order == "DESC":
+            messages.reverse()
+        return messages, has_more
+
+    def list_session_summaries(
+        self,
+        user_id: str,
+        limit: int,
+        cursor: Optional[Tuple[str, str]] = None,
+        descending: bool = True,
+    ) -> Tuple[List[dict], Optional[Tuple[str, str]]]:
+        # Keyset pagination over idx_chat_sessions_user_updated
+        operator, order = ("<", "DESC") if descending else (">", "ASC")
+        sql = f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM chat_sessions WHERE user_id = ?"
+        params: list = [user_id]
+        if cursor is not None:
+            sql += f" AND (updated_at, id) {operator} (?, ?)"
+            params.extend(cursor)
+        sql += f" ORDER BY updated_at {order}, id {order} LIMIT ?"
+        rows = self._fetch_all(sql, params + [limit + 1])
+        summaries = rows[:limit]
+        if len(rows) > limit:
+            return summaries, (summaries[-1]["updated_at"], summaries[-1]["id"])
+        return summaries, None
+
+    def search_messages(self, user_id: str, query: str, limit: int, offset: int = 0) -> Tuple[List[dict], bool, bool]:
+        # Same contract and scores as InMemoryStore.search_messages: the
+        # newest MAX_CANDIDATES matches, ranked by BM25 over the user's own
+        # messages, newer first on ties
+        terms = query_terms(query)
+        if not terms:
+            return [], False, False
+        owner = f'owner : "u{user_id.encode().hex()}"'
+        match = f"{owner} AND content : (" + " AND ".join(f'"{term}"' for term in terms) + ")"
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT m.seq, m.id, m.type, m.timestamp, m.content, s.id AS session_id, s.title"
+                " FROM messages_fts"
+                " JOIN messages m ON m.seq = messages_fts.rowid"
+                " JOIN chat_sessions s ON s.id = m.session_id"
+                " WHERE messages_fts MATCH ?"
+                " ORDER BY messages_fts.rowid DESC LIMIT ?",
+                (match, MAX_CANDIDATES + 1),
+            ).fetchall()
+            if not rows:
+                return [], False, False
+            documents, total_length = conn.execute(
+                "SELECT SUM(message_count), SUM(token_count) FROM chat_sessions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            idfs = [
+                bm25_idf(documents, conn.execute(
+                    "SELECT COUNT(*) FROM messages_fts WHERE messages_fts MATCH ?", (f'{owner} AND content : "{term}"',)
+                ).fetchone()[0])
+                for term in terms
+            ]
+        truncated = len(rows) > MAX_CANDIDATES
+        average_length = total_length / documents or 1.0
+        candidates = []
+        for row in rows[:MAX_CANDIDATES]:
+            tokens = tokenize(row["content"])
+            counts = Counter(tokens)
+            score = bm25_score([min(counts[term], 255) for term in terms], idfs, len(tokens), average_length)
+            candidates.append((score, row["seq"], row))
+        candidates.sort(key=lambda candidate: candidate[:2], reverse=True)
+        hits = [
+            search_hit({"id": row["session_id"], "title": row["title"]}, dict(row), terms, score)
+            for score, _, row in candidates[offset:offset + limit]
+        ]
+        return hits, offset + limit < len(candidates), truncated
+
+    def delete_session(self, session_id: str) -> Optional[dict]:
+        session = self.get_session(session_id, False)
+        if session is None:
+            return None
+        with self._connection() as conn, conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM chat_sessions WHERE id = ?", (session_id,))
+        return session
+
+    def count_sessions(self) -> int:
+        return self._count("chat_sessions")
+
+    def count_messages(self) -> int:
+        return self._count("messages")
+
+    # Credentials
+    def add_credential(self, credential: dict) -> dict:
+        row = [credential[column] for column in CREDENTIAL_COLUMNS]
+        row[CREDENTIAL_COLUMNS.index("details")] = json.dumps(credential["details"])
+        try:
+            with self._connection() as conn, conn:
+                conn.execute(
+                    f"INSERT INTO credentials ({', '.join(CREDENTIAL_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                    row,
+                )
+        except sqlite3.IntegrityError as exc:
+            raise KeyError(f"Credential {credential['id']} already exists") from exc
+        return credential
+
+    def get_credential(self, credential_id: str) -> Optional[dict]:
+        return _decode_credential(self._fetch_one("SELECT * FROM credentials WHERE id = ?", (credential_id,)))
+
+    def list_credentials(self, user_id: str) -> List[dict]:
+        rows = self._fetch_all("SELECT * FROM credentials WHERE user_id = ? ORDER BY rowid", (user_id,))
+        return [_decode_credential(row) for row in rows]
+
+    def delete_credential(self, credential_id: str) -> Optional[dict]:
+        with self._connection() as conn, conn:
+            row = conn.execute("SELECT * FROM credentials WHERE id = ?", (credential_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM credentials WHERE id = ?", (credential_id,))
+        return _decode_credential(dict(row))
+
+    def count_credentials(self) -> int:
+        return self._count("credentials")
+
+    # Versions
+    def versions(self, keys: Iterable[str]) -> List[int]:
+        keys = list(keys)
+        with self._connection() as conn:
+            found = dict(conn.execute(
+                f"SELECT key, version FROM versions WHERE key IN ({', '.join('?' * len(keys))})", keys
+            ).fetchall())
+        return [found.get(key, 0) for key in keys]
+
+    # Analytics
+    def analytics_buckets(
+        self, first_day: int, last_day: int, first_hour: int, last_hour: int,
+    ) -> Dict[str, Dict[int, Any]]:
+        """Counter -> bucket -> value for the per-day and per-hour buckets in range"""
+        counters: Dict[str, Dict[int, Any]] = {kind: {} for kind in PER_DAY_BUCKETS + ("messages",)}
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"SELECT kind, bucket, value FROM analytics_buckets"
+                f" WHERE kind IN ({', '.join('?' * len(PER_DAY_BUCKETS))}) AND bucket BETWEEN ? AND ?"
+                f" UNION ALL SELECT kind, bucket, value FROM analytics_buckets"
+                f" WHERE kind = 'messages' AND bucket BETWEEN ? AND ?",
+                PER_DAY_BUCKETS + (first_day, last_day, first_hour, last_hour),
+            )
+            for kind, bucket, value in rows:
+                counters[kind][bucket] = value
+        return counters
+
+    def rebuild_analytics(self):
+        """Recompute the analytics buckets from the stored sessions"""
+        with self._connection() as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._rebuild_analytics(conn)
+
+    def _rebuild_analytics(self, conn: sqlite3.Connection):
+        # Users' activity is read from lastActive, so only sessions count
+        engine = AnalyticsEngine.from_records([], self._iter_sessions(conn), self.analytics_retention_days)
+        engine._prune(int(time.time() // DAY))
+        state = engine.state()
+        conn.execute("DELETE FROM analytics_buckets")
+        conn.execute("UPDATE chat_sessions SET last_activity = NULL WHERE last_activity IS NOT NULL")
+        for kind, key in (
+            ("sessions", "sessions_per_day"),
+            ("messages", "messages_per_hour"),
+            ("duration", "duration_per_day"),
+            ("active_sessions", "active_sessions_per_day"),
+        ):
+            conn.executemany(
+                "INSERT INTO analytics_buckets (kind, bucket, value) VALUES (?, ?, ?)",
+                [(kind, bucket, value) for bucket, value in state[key]],
+            )
+        conn.executemany(
+            "UPDATE chat_sessions SET last_activity = ? WHERE id = ?",
+            [(last, session_id) for session_id, _, last in state["session_times"] if last is not None],
+        )
+        conn.execute(_bump("'analytics'"))
+
+    def _oldest_analytics_day(self) -> int:
+        return int(time.time() // DAY) - self.analytics_retention_days
+
+    def _prune_analytics(self, conn: sqlite3.Connection) -> int:
+        oldest_day = self._oldest_analytics_day()
+        conn.execute(
+            f"DELETE FROM analytics_buckets WHERE kind IN ({', '.join('?' * len(PER_DAY_BUCKETS))}) AND bucket < ?",
+            PER_DAY_BUCKETS + (oldest_day,),
+        )
+        conn.execute("DELETE FROM analytics_buckets WHERE kind = 'messages' AND bucket < ?", (oldest_day * 24,))
+        return oldest_day
+
+    def _count_analytics(self, conn: sqlite3.Connection, updates: List[Tuple[str, int, Any]]):
+        conn.executemany(
+            "INSERT INTO analytics_buckets (kind, bucket, value) VALUES (?, ?, ?)"
+            " ON CONFLICT (kind, bucket) DO UPDATE SET value = value + excluded.value",
+            updates,
+        )
+
+    # Helpers
+    def _insert_user(self, conn: sqlite3.Connection, user: dict):
+        conn.execute(
+            f"INSERT INTO users ({', '.join(USER_COLUMNS)}) VALUES ({', '.join('?' * len(USER_COLUMNS))})",
+            [user[column] for column in USER_COLUMNS],
+        )
+
+    def _update_user(self, conn: sqlite3.Connection, user_id: str, fields: Dict[str, Any]) -> Optional[dict]:
+        columns = [column for column in fields if column in USER_COLUMNS and column != "id"]
+        if columns:
+            try:
+                conn.execute(
+                    f"UPDATE users SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?",
+                    [fields[column] for column in columns] + [user_id],
+                )
+            except sqlite3.IntegrityError as exc:
+                raise KeyError(f"Email {fields.get('email')} already registered") from exc
+        row = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        return dict(row) if row else None
+
+    def _insert_message(self, conn: sqlite3.Connection, session_id: str, message: dict):
+        conn.execute(
+            f"INSERT INTO messages (session_id, {', '.join(MESSAGE_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+            [session_id] + [message[column] for column in MESSAGE_COLUMNS],
+        )
+
+    def _fetch_one(self, sql: str, params) -> Optional[dict]:
+        with self._connection() as conn:
+            row = conn.execute(sql, params).fetchone()
+        return dict(row) if row else None
+
+    def _fetch_all(self, sql: str, params) -> List[dict]:
+        with self._connection() as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
+    def _count(self, table: str) -> int:
+        with self._connection() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def _search_length(content: str) -> int:
+    return len(tokenize(content))
+
+
+def _batches(values: Iterable[str]) -> Iterator[List[str]]:
+    values = list(dict.fromkeys(values))
+    for start in range(0, len(values), BATCH_SIZE):
+        yield values[start:start + BATCH_SIZE]
+
+
+def _decode_credential(row: Optional[dict]) -> Optional[dict]:
+    if row is not None:
+        row["details"] = json.loads(row["details"])
+    return row
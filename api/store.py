@@ -0,0 +1,663 @@
+import bisect
+import functools
+import secrets
+from array import array
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from history import MessageHistory, SegmentLog
+from search import SearchIndex
+
+# In-memory data store
+#
+# Records are kept as plain dicts (the same shape the routes already return)
+# in primary maps keyed by id, with secondary hash indexes for the lookups the
+# API performs on every request. Every insert and delete goes through this
+# class so the indexes never drift from the primary maps.
+#
+# sqlite_store.SQLiteStore implements the same methods against a database.
+#
+# Both stores keep version counters that go up whenever what a GET route
+# returns changes, so the routes can answer conditional requests without
+# building the response. The keys are "users", "sessions:<user_id>" (the
+# user's sessions and their messages), "session:<session_id>" and
+# "credentials:<user_id>". A lastActive change only counts when it moves to
+# another minute. Counters start from 0 in a new store, so ``epoch`` tells
+# one store's counters from another's.
+#
+# With a ``journal`` attached (see snapshot.py), every successful write is
+# recorded as the method name and its arguments, so a store restored from a
+# snapshot can replay the writes made after it. Bulk methods record each
+# item through the single-item method they call.
+
+# Length of the last-message preview kept in chat session summaries
+SNIPPET_LENGTH = 120
+# Newest messages returned with a chat session; older ones are paged
+# through list_messages()
+RECENT_MESSAGES = 50
+
+# Chat session fields other than its messages
+SESSION_FIELDS = ("id", "user_id", "title", "created_at", "updated_at")
+
+# User fields that never leave the server
+PRIVATE_USER_FIELDS = frozenset({"password_hash"})
+
+# Fields the admin user listing can sort by
+USER_SORT_KEYS = ("name", "email", "lastActive")
+# Fields whose change moves a user between listing indexes
+INDEXED_USER_FIELDS = frozenset({"role", "status"} | set(USER_SORT_KEYS))
+# Characters of an ISO timestamp that versioning compares: up to the minute
+VERSIONED_TIMESTAMP_LENGTH = 16
+
+
+def public_view(user: dict) -> dict:
+    return {k: v for k, v in user.items() if k not in PRIVATE_USER_FIELDS}
+
+
+def user_sort_value(user: dict, key: str) -> str:
+    # Names sort and match prefixes case-insensitively
+    value = user[key]
+    return value.lower() if key == "name" else value
+
+
+def session_summary(session: dict) -> dict:
+    """Sidebar view of a chat session, without its messages"""
+    messages = session["messages"]
+    return {
+        "id": session["id"],
+        "user_id": session["user_id"],
+        "title": session["title"],
+        "created_at": session["created_at"],
+        "updated_at": session["updated_at"],
+        "message_count": len(messages),
+        "last_message": messages[-1]["content"][:SNIPPET_LENGTH] if messages else None,
+    }
+
+
+class InMemoryStore:
+    # Lookups never block, so callers can run them directly on the event loop
+    executor = None
+
+    def __init__(self, hot_messages: int = 256, segment_messages: int = 128, archive_dir: Optional[str] = None):
+        # Users: id -> user, email -> user, plus id -> public view (the user
+        # without password_hash, ready to send as-is)
+        self._users: Dict[str, dict] = {}
+        self._users_by_email: Dict[str, dict] = {}
+        self._public_users: Dict[str, dict] = {}
+        # Admin listing indexes: role -> {id: public view} and status ->
+        # {id: public view}, each user's creation number, and per sort key a
+        # sorted list of (value, user_id). The lowercased name list also
+        # answers name prefix filters.
+        self._users_by_role: Dict[str, Dict[str, dict]] = {}
+        self._users_by_status: Dict[str, Dict[str, dict]] = {}
+        self._user_order: Dict[str, int] = {}
+        self._next_user_order = 0
+        self._user_sort_index: Dict[str, List[Tuple[str, str]]] = {key: [] for key in USER_SORT_KEYS}
+
+        # Chat sessions (SESSION_FIELDS only): id -> session, user_id ->
+        # {session_id: session}. The inner dicts preserve insertion order, so
+        # listings come back in creation order just like the old list scans
+        # did.
+        self._sessions: Dict[str, dict] = {}
+        self._sessions_by_user: Dict[str, Dict[str, dict]] = {}
+        # session_id -> its messages: the newest ``hot_messages`` (up to
+        # ``segment_messages`` more) in memory, older ones compressed in the
+        # archive file and loaded when a client pages back (see history.py)
+        self._histories: Dict[str, MessageHistory] = {}
+        self._archive = SegmentLog(archive_dir)
+        self.hot_messages = hot_messages
+        self.segment_messages = segment_messages
+        self._message_count = 0
+        # Per-session summary metadata maintained on append, and each user's
+        # sessions as a sorted list of (updated_at, session_id) keys
+        self._summaries: Dict[str, dict] = {}
+        self._sessions_by_updated: Dict[str, List[Tuple[str, str]]] = {}
+        # Full-text index of each user's chat history
+        self._search = SearchIndex(self._load_message)
+
+        # Credentials: id -> credential, user_id -> {credential_id: credential}
+        self._credentials: Dict[str, dict] = {}
+        self._credentials_by_user: Dict[str, Dict[str, dict]] = {}
+
+        # Version counters, see versions()
+        self._versions: Dict[str, int] = {}
+        self.epoch = secrets.token_hex(8)
+
+        # Records every write while set; a snapshot this store was restored
+        # from stays open for as long as the store
+        self.journal = None
+        self._snapshot = None
+
+    def close(self):
+        self._archive.close()
+        if self._snapshot is not None:
+            self._snapshot.close()
+
+    # Users
+    def add_user(self, user: dict) -> dict:
+        if user["id"] in self._users:
+            raise KeyError(f"User {user['id']} already exists")
+        if user["email"] in self._users_by_email:
+            raise KeyError(f"Email {user['email']} already registered")
+        self._insert_user(user, self._next_user_order)
+        self._next_user_order += 1
+        for key, keys in self._user_sort_index.items():
+            bisect.insort(keys, (user_sort_value(user, key), user["id"]))
+        self._bump("users")
+        self._record("add_user", user)
+        return user
+
+    def add_users(self, users: List[dict]) -> List[Optional[str]]:
+        """Add each user that doesn't clash with an existing one; returns an error message or None per user"""
+        errors: List[Optional[str]] = []
+        for user in users:
+            try:
+                self.add_user(user)
+                errors.append(None)
+            except KeyError as exc:
+                errors.append(exc.args[0])
+        return errors
+
+    def get_user(self, user_id: str) -> Optional[dict]:
+        return self._users.get(user_id)
+
+    def get_user_by_email(self, email: str) -> Optional[dict]:
+        return self._users_by_email.get(email)
+
+    def get_users(self, user_ids: Iterable[str]) -> Dict[str, dict]:
+        return {user_id: self._users[user_id] for user_id in user_ids if user_id in self._users}
+
+    def registered_emails(self, emails: Iterable[str]) -> Set[str]:
+        return {email for email in emails if email in self._users_by_email}
+
+    def list_users(self) -> List[dict]:
+        return list(self._users.values())
+
+    def get_public_user(self, user_id: str) -> Optional[dict]:
+        return self._public_users.get(user_id)
+
+    def list_public_users(self) -> List[dict]:
+        return list(self._public_users.values())
+
+    def query_users(
+        self,
+        role: Optional[str] = None,
+        status: Optional[str] = None,
+        name_prefix: Optional[str] = None,
+        sort: Optional[str] = None,
+        descending: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> Tuple[List[dict], int]:
+        """One page of public user views matching every given filter, and how many match.
+
+        Users come in creation order unless ``sort`` names one of
+        USER_SORT_KEYS (ties broken by id). The smallest applicable index
+        supplies the matches. A page is cut either by sorting the matches or
+        by walking the full ordering and skipping non-matches until the page
+        is full, whichever visits fewer users.
+        """
+        # Each source is a dict or set keyed by user id
+        sources: list = []
+        if role is not None:
+            sources.append(self._users_by_role.get(role, {}))
+        if status is not None:
+            sources.append(self._users_by_status.get(status, {}))
+        if name_prefix:
+            prefix = name_prefix.lower()
+            names = self._user_sort_index["name"]
+            start = bisect.bisect_left(names, (prefix,))
+            end = bisect.bisect_left(names, (prefix + "\U0010ffff",))
+            sources.append({user_id for _, user_id in names[start:end]})
+
+        if not sources:
+            matches = self._public_users
+        else:
+            sources.sort(key=len)
+            matches = sources[0] if len(sources) == 1 else set(sources[0]).intersection(*sources[1:])
+        total = len(matches)
+        stop = None if limit is None else offset + limit
+        users = self._public_users
+
+        # Walking the full ordering visits about stop * len(users) / total
+        # users before the page is full; sort the matches instead when that
+        # would be several times more users than there are matches
+        walk = len(users) if stop is None else min(len(users), stop * len(users) // max(total, 1))
+        if walk > 4 * total:
+            if sort is None:
+                ids = sorted(matches, key=self._user_order.__getitem__, reverse=descending)
+            else:
+                ids = sorted(matches, key=lambda user_id: (user_sort_value(users[user_id], sort), user_id), reverse=descending)
+            return [users[user_id] for user_id in ids[offset:stop]], total
+
+        if sort is None:
+            ordered = reversed(users.values()) if descending else iter(users.values())
+        else:
+            keys = self._user_sort_index[sort]
+            ordered = (users[user_id] for _, user_id in (reversed(keys) if descending else keys))
+        if sources:
+            ordered = (user for user in ordered if user["id"] in matches)
+        return list(islice(ordered, offset, stop)), total
+
+    def update_user(self, user_id: str, fields: Dict[str, Any]) -> Optional[dict]:
+        user = self._users.get(user_id)
+        if user is None:
+            return None
+        if "email" in fields and fields["email"] != user["email"]:
+            if fields["email"] in self._users_by_email:
+                raise KeyError(f"Email {fields['email']} already registered")
+            del self._users_by_email[user["email"]]
+            self._users_by_email[fields["email"]] = user
+        reindex = not INDEXED_USER_FIELDS.isdisjoint(fields)
+        if reindex:
+            self._unindex_user(user)
+        user.update(fields)
+        self._public_users[user_id].update((k, v) for k, v in fields.items() if k not in PRIVATE_USER_FIELDS)
+        if reindex:
+            self._index_user(user)
+        if not PRIVATE_USER_FIELDS.issuperset(fields):
+            self._bump("users")
+        self._record("update_user", user_id, fields)
+        return user
+
+    def update_users(self, updates: Dict[str, Dict[str, Any]]) -> Dict[str, dict]:
+        """Apply user_id -> fields updates; returns the updated users that exist"""
+        updated = {}
+        for user_id, fields in updates.items():
+            user = self.update_user(user_id, fields)
+            if user is not None:
+                updated[user_id] = user
+        return updated
+
+    def update_last_active(self, updates: Dict[str, str]):
+        keys = self._user_sort_index["lastActive"]
+        for user_id, last_active in updates.items():
+            user = self._users.get(user_id)
+            if user is not None:
+                if user["lastActive"][:VERSIONED_TIMESTAMP_LENGTH] != last_active[:VERSIONED_TIMESTAMP_LENGTH]:
+                    self._bump("users")
+                _remove_sorted(keys, (user["lastActive"], user_id))
+                bisect.insort(keys, (last_active, user_id))
+                user["lastActive"] = last_active
+                self._public_users[user_id]["lastActive"] = last_active
+        self._record("update_last_active", updates)
+
+    def delete_user(self, user_id: str) -> Optional[dict]:
+        user = self._users.pop(user_id, None)
+        if user is None:
+            return None
+        self._unindex_user(user)
+        del self._users_by_email[user["email"]]
+        del self._public_users[user_id]
+        del self._user_order[user_id]
+        self._bump("users")
+        self._record("delete_user", user_id)
+        return user
+
+    def delete_users(self, user_ids: Iterable[str]) -> Dict[str, dict]:
+        """Delete the given users; returns the ones that existed"""
+        deleted = {}
+        for user_id in user_ids:
+            user = self.delete_user(user_id)
+            if user is not None:
+                deleted[user_id] = user
+        return deleted
+
+    def count_users(self) -> int:
+        return len(self._users)
+
+    def _insert_user(self, user: dict, order: int):
+        # Primary maps and hash indexes; the sorted indexes are up to the caller
+        self._users[user["id"]] = user
+        self._users_by_email[user["email"]] = user
+        public = self._public_users[user["id"]] = public_view(user)
+        self._user_order[user["id"]] = order
+        self._users_by_role.setdefault(user["role"], {})[user["id"]] = public
+        self._users_by_status.setdefault(user["status"], {})[user["id"]] = public
+
+    def _index_user(self, user: dict):
+        public = self._public_users[user["id"]]
+        self._users_by_role.setdefault(user["role"], {})[user["id"]] = public
+        self._users_by_status.setdefault(user["status"], {})[user["id"]] = public
+        for key, keys in self._user_sort_index.items():
+            bisect.insort(keys, (user_sort_value(user, key), user["id"]))
+
+    def _unindex_user(self, user: dict):
+        _remove_from_bucket(self._users_by_role, user["role"], user["id"])
+        _remove_from_bucket(self._users_by_status, user["status"], user["id"])
+        for key, keys in self._user_sort_index.items():
+            _remove_sorted(keys, (user_sort_value(user, key), user["id"]))
+
+    # Chat sessions
+    def add_session(self, session: dict) -> dict:
+        if session["id"] in self._sessions:
+            raise KeyError(f"Chat session {session['id']} already exists")
+        record = {field: session[field] for field in SESSION_FIELDS}
+        history = MessageHistory(self._archive, self.hot_messages, self.segment_messages)
+        self._sessions[session["id"]] = record
+        self._sessions_by_user.setdefault(session["user_id"], {})[session["id"]] = record
+        self._histories[session["id"]] = history
+        self._summaries[session["id"]] = session_summary(session)
+        bisect.insort(
+            self._sessions_by_updated.setdefault(session["user_id"], []),
+            (session["updated_at"], session["id"]),
+        )
+        self._search.add_session(record)
+        for position, message in enumerate(session.get("messages", [])):
+            history.append(message)
+            self._search.add_message(session["id"], message, position)
+        self._message_count += len(history)
+        self._bump(f"sessions:{session['user_id']}")
+        self._record("add_session", session)
+        return session
+
+    def get_session(self, session_id: str, with_messages: bool = True) -> Optional[dict]:
+        # With messages: the session's message_count and its newest
+        # RECENT_MESSAGES messages, which come from the hot tail. Otherwise
+        # just the session fields.
+        session = self._sessions.get(session_id)
+        if session is None or not with_messages:
+            return session
+        return self._recent_view(session)
+
+    def list_sessions(self, user_id: str) -> List[dict]:
+        return [self._recent_view(session) for session in self._sessions_by_user.get(user_id, {}).values()]
+
+    def _recent_view(self, session: dict) -> dict:
+        history = self._histories[session["id"]]
+        return {
+            **session,
+            "message_count": len(history),
+            "has_more_messages": len(history) > RECENT_MESSAGES,
+            "messages": history.tail(RECENT_MESSAGES),
+        }
+
+    def iter_sessions(self) -> Iterator[dict]:
+        """Every session with all of its messages, for rebuilding derived data
+
+        "messages" is an iterator that decodes archived segments one at a
+        time, so consume each session before moving on to the next.
+        """
+        for session_id in list(self._sessions):
+            session = self._sessions.get(session_id)
+            if session is not None:
+                yield {**session, "messages": iter(self._histories[session_id])}
+
+    def add_message(self, session_id: str, message: dict) -> Optional[dict]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        history = self._histories[session_id]
+        history.append(message)
+        self._message_count += 1
+        # The stored id, so every indexed message shares one string
+        self._search.add_message(session["id"], message, len(history) - 1)
+        self._touch_session(session, message["timestamp"])
+
+        summary = self._summaries[session_id]
+        summary["message_count"] += 1
+        summary["last_message"] = message["content"][:SNIPPET_LENGTH]
+        self._bump(f"sessions:{session['user_id']}", f"session:{session_id}")
+        self._record("add_message", session_id, message)
+        return message
+
+    def list_session_summaries(
+        self,
+        user_id: str,
+        limit: int,
+        cursor: Optional[Tuple[str, str]] = None,
+        descending: bool = True,
+    ) -> Tuple[List[dict], Optional[Tuple[str, str]]]:
+        """Page through a user's session summaries ordered by updated_at.
+
+        ``cursor`` is the (updated_at, session_id) key of the last summary on
+        the previous page. Returns (summaries, next_cursor), where
+        next_cursor is None on the last page.
+        """
+        keys = self._sessions_by_updated.get(user_id, [])
+        if descending:
+            end = bisect.bisect_left(keys, tuple(cursor)) if cursor else len(keys)
+            page = keys[max(0, end - limit):end][::-1]
+            has_more = end - limit > 0
+        else:
+            start = bisect.bisect_right(keys, tuple(cursor)) if cursor else 0
+            page = keys[start:start + limit]
+            has_more = start + limit < len(keys)
+        summaries = [self._summaries[session_id] for _, session_id in page]
+        return summaries, (page[-1] if has_more else None)
+
+    def list_messages(
+        self,
+        session_id: str,
+        limit: int,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+    ) -> Optional[Tuple[List[dict], bool]]:
+        """Page through a session's messages by message id cursors.
+
+        Returns (messages, has_more) in chronological order, or None if the
+        session or a cursor does not exist. With ``after`` the page holds
+        the first ``limit`` messages after that id and has_more means newer
+        ones remain; otherwise it holds the last ``limit`` messages (before
+        ``before``, if given) and has_more means older ones remain.
+        """
+        history = self._histories.get(session_id)
+        if history is None:
+            return None
+        start, end = 0, len(history)
+        if after is not None:
+            position = history.position(after)
+            if position is None:
+                return None
+            start = position + 1
+        if before is not None:
+            position = history.position(before)
+            if position is None:
+                return None
+            end = position
+        if end <= start:
+            return [], False
+        if after is not None:
+            return history.slice(start, min(start + limit, end)), start + limit < end
+        return history.slice(max(start, end - limit), end), end - limit > start
+
+    def search_messages(self, user_id: str, query: str, limit: int, offset: int = 0) -> Tuple[List[dict], bool, bool]:
+        """Ranked hits for the user's messages containing every query term,
+        whether more follow and whether only the newest matches were ranked"""
+        return self._search.search(user_id, query, limit, offset)
+
+    def delete_session(self, session_id: str) -> Optional[dict]:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return None
+        _remove_from_bucket(self._sessions_by_user, session["user_id"], session_id)
+        history = self._histories.pop(session_id)
+        self._message_count -= len(history)
+        del self._summaries[session_id]
+        keys = self._sessions_by_updated[session["user_id"]]
+        keys.pop(bisect.bisect_left(keys, (session["updated_at"], session_id)))
+        if not keys:
+            del self._sessions_by_updated[session["user_id"]]
+        self._search.delete_session(session_id, history)
+        self._versions.pop(f"session:{session_id}", None)
+        self._bump(f"sessions:{session['user_id']}")
+        self._record("delete_session", session_id)
+        return session
+
+    def _touch_session(self, session: dict, updated_at: str):
+        # Move the session to its new place in the owner's updated_at order
+        keys = self._sessions_by_updated[session["user_id"]]
+        keys.pop(bisect.bisect_left(keys, (session["updated_at"], session["id"])))
+        bisect.insort(keys, (updated_at, session["id"]))
+        session["updated_at"] = updated_at
+        self._summaries[session["id"]]["updated_at"] = updated_at
+
+    def count_sessions(self) -> int:
+        return len(self._sessions)
+
+    def count_messages(self) -> int:
+        return self._message_count
+
+    def history_stats(self) -> dict:
+        hot = sum(len(history) - history.cold_count for history in self._histories.values())
+        return {"hot_messages": hot, "cold_messages": self._message_count - hot, "archive": self._archive.stats()}
+
+    def _load_message(self, session_id: str, position: int) -> dict:
+        return self._histories[session_id].slice(position, position + 1)[0]
+
+    # Credentials
+    def add_credential(self, credential: dict) -> dict:
+        if credential["id"] in self._credentials:
+            raise KeyError(f"Credential {credential['id']} already exists")
+        self._credentials[credential["id"]] = credential
+        self._credentials_by_user.setdefault(credential["user_id"], {})[credential["id"]] = credential
+        self._bump(f"credentials:{credential['user_id']}")
+        self._record("add_credential", credential)
+        return credential
+
+    def get_credential(self, credential_id: str) -> Optional[dict]:
+        return self._credentials.get(credential_id)
+
+    def list_credentials(self, user_id: str) -> List[dict]:
+        return list(self._credentials_by_user.get(user_id, {}).values())
+
+    def delete_credential(self, credential_id: str) -> Optional[dict]:
+        credential = self._credentials.pop(credential_id, None)
+        if credential is None:
+            return None
+        _remove_from_bucket(self._credentials_by_user, credential["user_id"], credential_id)
+        self._bump(f"credentials:{credential['user_id']}")
+        self._record("delete_credential", credential_id)
+        return credential
+
+    def count_credentials(self) -> int:
+        return len(self._credentials)
+
+    # Versions
+    def versions(self, keys: Iterable[str]) -> List[int]:
+        """Current value of each version counter; 0 for one that never moved"""
+        return [self._versions.get(key, 0) for key in keys]
+
+    def _bump(self, *keys: str):
+        for key in keys:
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    # Snapshots
+    def _record(self, method: str, *args):
+        if self.journal is not None:
+            self.journal.record(method, *args)
+
+    def capture(self) -> Callable[[Callable[[bytes], list], Callable[[Any], list]], dict]:
+        """The store as of now, as a function that writes it out
+
+        Call on the event loop; it only copies references and small
+        per-record state, and the returned function (safe to run on another
+        thread while the store keeps changing) does the encoding. It takes
+        ``blob``, which stores bytes and returns a reference to them, and
+        ``compressed``, the same for a JSON-encodable value.
+        """
+        users = [dict(user) for user in self._users.values()]
+        orders = [self._user_order[user["id"]] for user in users]
+        credentials = list(self._credentials.values())
+        sessions = []
+        for session_id, record in self._sessions.items():
+            summary = self._summaries[session_id]
+            sessions.append((dict(record), summary["message_count"], summary["last_message"], self._histories[session_id].capture()))
+        search = self._search.capture()
+        versions = dict(self._versions)
+        archive = self._archive
+        state = {"epoch": self.epoch, "next_user_order": self._next_user_order, "segment_messages": self.segment_messages}
+
+        def write(blob: Callable[[bytes], list], compressed: Callable[[Any], list]) -> dict:
+            session_images = []
+            for record, message_count, last_message, (segments, hashes, hot) in sessions:
+                # Cold segments are copied as stored, and become plain
+                # [offset, length] pairs in the snapshot file
+                session_images.append([
+                    record, message_count, last_message,
+                    [blob(archive.read_raw(offset, length))[:2] for offset, length in segments],
+                    blob(hashes.tobytes()),
+                    blob(hot()),
+                ])
+            return {
+                **state,
+                "users": compressed([users, orders]),
+                "credentials": compressed(credentials),
+                "sessions": compressed(session_images),
+                "search": search(blob),
+                "versions": compressed(versions),
+            }
+
+        return write
+
+    @classmethod
+    def restore(
+        cls,
+        snapshot,
+        image: dict,
+        hot_messages: int = 256,
+        segment_messages: int = 128,
+        archive_dir: Optional[str] = None,
+    ) -> "InMemoryStore":
+        """A store from an image written by capture(), in a snapshot.SnapshotReader
+
+        Users, credentials and session records are decoded now; message
+        tails and search postings as they are used, and archived segments
+        are read from the snapshot. The snapshot stays open until close().
+        The snapshot's segment size wins over ``segment_messages``, as its
+        segments already hold that many messages.
+        """
+        segment_messages = image["segment_messages"]
+        store = cls(hot_messages, segment_messages, archive_dir)
+        store._archive.close()
+        store._archive = SegmentLog(archive_dir, base=snapshot.map)
+        store._snapshot = snapshot
+        store.epoch = image["epoch"]
+        store._versions = snapshot.decompress(image["versions"])
+
+        users, orders = snapshot.decompress(image["users"])
+        for user, order in zip(users, orders):
+            store._insert_user(user, order)
+        store._next_user_order = image["next_user_order"]
+        for key in USER_SORT_KEYS:
+            store._user_sort_index[key] = sorted((user_sort_value(user, key), user["id"]) for user in users)
+
+        for credential in snapshot.decompress(image["credentials"]):
+            store._credentials[credential["id"]] = credential
+            store._credentials_by_user.setdefault(credential["user_id"], {})[credential["id"]] = credential
+
+        for record, message_count, last_message, segments, hashes_ref, hot_ref in snapshot.decompress(image["sessions"]):
+            session_id = record["id"]
+            hashes = array("I")
+            hashes.frombytes(snapshot.read(hashes_ref))
+            store._sessions[session_id] = record
+            store._sessions_by_user.setdefault(record["user_id"], {})[session_id] = record
+            store._histories[session_id] = MessageHistory.restored(
+                store._archive, hot_messages, segment_messages,
+                [tuple(segment) for segment in segments], hashes, functools.partial(snapshot.read, hot_ref),
+            )
+            store._message_count += len(hashes)
+            store._summaries[session_id] = {
+                **record, "message_count": message_count, "last_message": last_message,
+            }
+            store._sessions_by_updated.setdefault(record["user_id"], []).append((record["updated_at"], session_id))
+        for keys in store._sessions_by_updated.values():
+            keys.sort()
+        store._search = SearchIndex.restore(store._load_message, image["search"], store._sessions, snapshot.read)
+        return store
+
+
+def _remove_from_bucket(index: Dict[str, Dict[str, dict]], key: str, record_id: str):
+    bucket = index.get(key)
+    if bucket is None:
+        return
+    bucket.pop(record_id, None)
+    if not bucket:
+        # Drop empty buckets so the index stays O(live records)
+        del index[key]
+
+
+def _remove_sorted(keys: List[Tuple[str, str]], key: Tuple[str, str]):
+    position = bisect.bisect_left(keys, key)
+    if position < len(keys) and keys[position] == key:
+        del keys[position]
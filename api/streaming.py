@@ -0,0 +1,111 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+# Chat session event fan-out
+#
+# Every open stream for a chat session (the sender's own reply stream and any
+# GET /chat/sessions/{id}/events listeners) is a Subscriber with a bounded
+# queue. publish() never blocks: if a subscriber falls more than
+# ``queue_size`` events behind, its queue is replaced by a single "reset"
+# event and it is unsubscribed. The client is expected to reconnect and catch
+# up with GET /chat/sessions/{id}/messages?after=<last message id>.
+
+KEEPALIVE_SECONDS = 15.0
+
+_RESET = ("reset", {"reason": "Subscriber fell too far behind; resync with ?after=<message id>"})
+
+
+class Subscriber:
+    def __init__(self, session_id: str, queue_size: int):
+        self.session_id = session_id
+        self.queue: "asyncio.Queue[tuple]" = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[tuple]:
+        """Next (event, data) pair, or None if nothing arrived within timeout"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class SessionBroadcaster:
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[Subscriber]] = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, session_id: str) -> Subscriber:
+        subscriber = Subscriber(session_id, self.queue_size)
+        self._subscribers.setdefault(session_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self._subscribers.get(subscriber.session_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._subscribers[subscriber.session_id]
+
+    def publish(self, session_id: str, event: str, data: Any):
+        for subscriber in list(self._subscribers.get(session_id, ())):
+            try:
+                subscriber.queue.put_nowait((event, data))
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+        self.published += 1
+
+    def subscriber_count(self, session_id: Optional[str] = None) -> int:
+        if session_id is not None:
+            return len(self._subscribers.get(session_id, ()))
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._subscribers),
+            "subscribers": self.subscriber_count(),
+            "published": self.published,
+            "dropped_subscribers": self.dropped,
+        }
+
+    def _drop(self, subscriber: Subscriber):
+        # Discard the backlog and leave only the reset marker
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(_RESET)
+        subscriber.overflowed = True
+        self.unsubscribe(subscriber)
+        self.dropped += 1
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def sse_stream(
+    broadcaster: SessionBroadcaster,
+    subscriber: Subscriber,
+    until_message_id: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """Render a subscriber's events as Server-Sent Events.
+
+    Ends after the bot message (or error) with id ``until_message_id`` for
+    reply streams, after a reset, or when the client disconnects.
+    """
+    try:
+        while True:
+            item = await subscriber.get(timeout=KEEPALIVE_SECONDS)
+            if item is None:
+                yield ": keepalive\n\n"
+                continue
+            event, data = item
+            yield sse_event(event, data)
+            if event == "reset":
+                return
+            if until_message_id is not None and event in ("bot_message", "error") and data["id"] == until_message_id:
+                return
+    finally:
+        broadcaster.unsubscribe(subscriber)
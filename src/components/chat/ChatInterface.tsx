@@ -54,12 +54,12 @@ const ChatInterface = () => {
     
     try {
       // Send message to backend API
-      const response = await sendChatMessage(sessionId, input);
+      const { bot_message } = await sendChatMessage(sessionId, input);
       
       // Add bot response from API
       const botMessage: Message = {
-        id: response.id || Date.now().toString() + "-response",
-        content: response.content,
+        id: bot_message.id || Date.now().toString() + "-response",
+        content: bot_message.content,
         sender: "bot",
         timestamp: new Date(),
       };
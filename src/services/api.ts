@@ -41,6 +41,10 @@ export interface ChatSession {
   title: string;
   created_at: string;
   updated_at: string;
+  // The newest messages only; when has_more_messages is set, older ones
+  // come from fetchChatMessages with `before` set to the oldest id here
+  message_count: number;
+  has_more_messages: boolean;
   messages: ChatMessage[];
 }
 
@@ -52,6 +56,37 @@ export interface ChatMessage {
   type: 'user' | 'bot';
 }
 
+export interface ChatSessionSummary {
+  id: string;
+  user_id: string;
+  title: string;
+  created_at: string;
+  updated_at: string;
+  message_count: number;
+  last_message: string | null;
+}
+
+export interface ChatSessionSummaryPage {
+  sessions: ChatSessionSummary[];
+  next_cursor: string | null;
+}
+
+export interface ChatMessagePage {
+  messages: ChatMessage[];
+  has_more: boolean;
+}
+
+export interface ChatMessageQuery {
+  limit?: number;
+  before?: string;
+  after?: string;
+}
+
+export interface ChatExchange {
+  user_message: ChatMessage;
+  bot_message: ChatMessage;
+}
+
 export interface Credential {
   id: string;
   user_id: string;
@@ -62,17 +97,17 @@ export interface Credential {
 }
 
 export interface AnalyticsData {
-  daily_sessions: { day: string; count: number }[];
+  range: { days: number; start: string; end: string };
+  daily_sessions: { day: string; date: string; count: number }[];
+  hourly_messages: { hour: string; count: number }[];
   user_activity: {
     active_users: number;
+    active_users_1h: number;
+    active_users_24h: number;
+    active_users_7d: number;
     total_messages: number;
     average_session_duration: string;
-  };
-  system_metrics: {
-    cpu_usage: number;
-    memory_usage: number;
-    storage_usage: number;
-    network_bandwidth: number;
+    average_session_duration_seconds: number;
   };
 }
 
@@ -215,6 +250,20 @@ export const fetchChatSessions = async (): Promise<ChatSession[]> => {
   }
 };
 
+// Sidebar listing without messages, most recently updated first
+export const fetchChatSessionSummaries = async (
+  cursor?: string,
+  limit = 20
+): Promise<ChatSessionSummaryPage> => {
+  try {
+    const response = await api.get('/chat/sessions/summary', { params: { cursor, limit } });
+    return response.data;
+  } catch (error) {
+    console.error('Error fetching chat session summaries:', error);
+    throw error;
+  }
+};
+
 export const fetchChatSession = async (sessionId: string): Promise<ChatSession> => {
   try {
     const response = await api.get(`/chat/sessions/${sessionId}`);
@@ -225,6 +274,20 @@ export const fetchChatSession = async (sessionId: string): Promise<ChatSession>
   }
 };
 
+// Page back with `before`, or fetch only messages newer than `after`
+export const fetchChatMessages = async (
+  sessionId: string,
+  query: ChatMessageQuery = {}
+): Promise<ChatMessagePage> => {
+  try {
+    const response = await api.get(`/chat/sessions/${sessionId}/messages`, { params: query });
+    return response.data;
+  } catch (error) {
+    console.error('Error fetching chat messages:', error);
+    throw error;
+  }
+};
+
 export const createChatSession = async (title: string): Promise<ChatSession> => {
   try {
     const response = await api.post('/chat/sessions', { title });
@@ -235,9 +298,13 @@ export const createChatSession = async (title: string): Promise<ChatSession> =>
   }
 };
 
-export const sendChatMessage = async (sessionId: string, content: string): Promise<ChatMessage> => {
+// Returns both the stored user message and the bot's reply, so there is no
+// need to refetch the session afterwards
+export const sendChatMessage = async (sessionId: string, content: string): Promise<ChatExchange> => {
   try {
-    const response = await api.post(`/chat/sessions/${sessionId}/messages`, { content });
+    const response = await api.post(`/chat/sessions/${sessionId}/messages`, { content }, {
+      params: { include_reply: true },
+    });
     return response.data;
   } catch (error) {
     console.error('Error sending chat message:', error);
@@ -276,9 +343,9 @@ export const deleteCredential = async (credentialId: string): Promise<void> => {
 };
 
 // Admin analytics
-export const fetchAnalytics = async (): Promise<AnalyticsData> => {
+export const fetchAnalytics = async (days = 7): Promise<AnalyticsData> => {
   try {
-    const response = await api.get('/admin/analytics');
+    const response = await api.get('/admin/analytics', { params: { days } });
     return response.data;
   } catch (error) {
     console.error('Error fetching analytics:', error);
@@ -297,7 +364,9 @@ export default {
   toggleUserStatus,
   deleteUser,
   fetchChatSessions,
+  fetchChatSessionSummaries,
   fetchChatSession,
+  fetchChatMessages,
   createChatSession,
   sendChatMessage,
   fetchCredentials,